@@ -19,6 +19,12 @@ long waitTime = millis();
 
 bool gyroBegin = true; 
 
+// Binary frames: sync byte, message id, float32 payload, CRC8 (poly 0x07) over id + payload
+// The Pi switches to them by sending 'B', 'T' switches back to text lines
+const uint8_t SYNC_BYTE = 0xA5;
+const uint8_t GYRO_ID = 0x10;
+bool binaryMode = false;
+
 void setup() {
   Serial.begin(115200);
 
@@ -38,31 +44,68 @@ void setup() {
 }
 
 void loop() {
+  while (Serial.available()){
+    char command = Serial.read();
+    if (command == 'B'){
+      binaryMode = true;
+      Serial.println("BIN OK");}
+    else if (command == 'T'){
+      binaryMode = false;}}
+
   if (millis() - waitTime > wait && Serial.availableForWrite()){
-    print_ir_sensor("1", irSensor1, 130);
-    print_ir_sensor("2", irSensor2, 130);
-    print_ir_sensor("3", irSensor3, 130);
-    print_ir_sensor("4", irSensor4, 130);
-    print_ir_sensor("5", irSensor5, 130);
-    print_ir_sensor("6", irSensor6, 130);
-    print_ir_sensor("7", irSensor7, 50);
+    print_ir_sensor(1, irSensor1, 130);
+    print_ir_sensor(2, irSensor2, 130);
+    print_ir_sensor(3, irSensor3, 130);
+    print_ir_sensor(4, irSensor4, 130);
+    print_ir_sensor(5, irSensor5, 130);
+    print_ir_sensor(6, irSensor6, 130);
+    print_ir_sensor(7, irSensor7, 50);
     print_gyro();
     waitTime = millis();}
 }
 
-void print_ir_sensor(String ir_num, int ir_pin, int distance){
+uint8_t crc8(const uint8_t *data, uint8_t length){
+  uint8_t crc = 0;
+  for (uint8_t i = 0; i < length; i++){
+    crc ^= data[i];
+    for (uint8_t bit = 0; bit < 8; bit++){
+      crc = crc & 0x80 ? (crc << 1) ^ 0x07 : crc << 1;}}
+  return crc;}
+
+void send_frame(uint8_t id, const float *values, uint8_t count){
+  uint8_t frame[3 + 5 * sizeof(float)];
+  frame[0] = SYNC_BYTE;
+  frame[1] = id;
+  memcpy(frame + 2, values, count * sizeof(float));
+  frame[2 + count * sizeof(float)] = crc8(frame + 1, 1 + count * sizeof(float));
+  Serial.write(frame, 3 + count * sizeof(float));
+  return;}
+
+void print_ir_sensor(uint8_t ir_num, int ir_pin, int distance){
   int16_t t = pulseIn(ir_pin, HIGH);
-  if (t == 0){Serial.println("S" + ir_num + " No");}
-  else if (t > 1850) {Serial.println("S" + ir_num + " -1");}
+  if (binaryMode){
+    float value = NAN;
+    if (t > 1850) {value = -1.0;}
+    else if (t != 0){
+      int16_t d = (t - 1000) * 2;
+      if (distance == 50) {d = (t - 1000) * 3 / 4;}
+      if (d < 0){d = 0;}
+      value = float(d);}
+    send_frame(ir_num, &value, 1);}
+  else if (t == 0){Serial.println("S" + String(ir_num) + " No");}
+  else if (t > 1850) {Serial.println("S" + String(ir_num) + " -1");}
   else{
     int16_t d = (t - 1000) * 2;
     if (distance == 50) {d = (t - 1000) * 3 / 4;}
     if (d < 0){d = 0;}
-    Serial.println("S" + ir_num + " " + String(float(d)));}
+    Serial.println("S" + String(ir_num) + " " + String(float(d)));}
   return;}
 
 void print_gyro(){
-  if (gyroBegin){
+  if (binaryMode){
+    send_gyro(bno_normal_adr, GYRO_ID + 1);
+    send_gyro(bno2_diff_adr, GYRO_ID + 2);}
+  else if (gyroBegin){
     sensors_event_t event_normal;
     bno_normal_adr.getEvent(&event_normal);
   
@@ -77,4 +120,17 @@ void print_gyro(){
   else{
     Serial.println("G1 X: No Y: No Z: No AX: No AY: No");
     Serial.println("G2 X: No Y: No Z: No AX: No AY: No");}}
-  
\ No newline at end of file
+
+void send_gyro(Adafruit_BNO055 &bno, uint8_t id){
+  float values[5] = {NAN, NAN, NAN, NAN, NAN};
+  if (gyroBegin){
+    sensors_event_t event;
+    bno.getEvent(&event);
+    imu::Vector<3> acceleration = bno.getVector(Adafruit_BNO055::VECTOR_ACCELEROMETER);
+    values[0] = event.orientation.x;
+    values[1] = event.orientation.y;
+    values[2] = event.orientation.z;
+    values[3] = acceleration.x();
+    values[4] = acceleration.y();}
+  send_frame(id, values, 5);
+  return;}
@@ -1,29 +1,40 @@
+import heapq
 import time
 
-import numpy as np
-
 
 class Timer:
     def __init__(self):
-        self.timer_arr = np.array([["none", 1, 0, 0]])
+        self.timers = {}  # name -> expiry time
+        self.deadlines = []  # min-heap of (expiry time, name), may contain outdated entries
 
     def remove_timer(self, name):
-        self.timer_arr = self.timer_arr[np.where(self.timer_arr[:, 0] != name)]
+        self.timers.pop(name, None)
 
     def set_timer(self, name, set_time):
-        self.remove_timer(name)
-        self.timer_arr = np.append(self.timer_arr, [[name, time.perf_counter(), set_time, False]], axis=0)
+        expiry = time.perf_counter() + set_time
+        self.timers[name] = expiry
+        heapq.heappush(self.deadlines, (expiry, name))
 
-    def update_timer(self):
-        for i, timer in enumerate(self.timer_arr):
-            if not timer[0] == "none":
-                self.timer_arr[i, 3] = (time.perf_counter() - float(timer[1])) > float(timer[2])
+        # Drop outdated heap entries once they outnumber the timers
+        if len(self.deadlines) > 2 * len(self.timers) + 32:
+            self.deadlines = [(expiry, name) for name, expiry in self.timers.items()]
+            heapq.heapify(self.deadlines)
 
     def get_timer(self, name):
-        self.update_timer()
-        time_val = self.timer_arr[np.where(self.timer_arr[:, 0] == name), 3]
+        expiry = self.timers.get(name)
 
-        if time_val.size > 0:
-            return time_val[0][0] == "True"
+        if expiry is not None:
+            return time.perf_counter() > expiry
         else:
             return False
+
+    def next_deadline(self):
+        # (name, time left) of the timer that runs out next, None if every timer has run out
+        now = time.perf_counter()
+        while self.deadlines:
+            expiry, name = self.deadlines[0]
+            if self.timers.get(name) == expiry and expiry >= now:
+                return name, expiry - now
+            heapq.heappop(self.deadlines)
+
+        return None
@@ -0,0 +1,87 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+
+main_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main")
+sys.path.insert(0, main_dir)
+os.chdir(main_dir)
+
+from Vision import BallDetector, BallTracker
+
+horizontal_center = 320
+
+
+def simulate(frames, frame_rate, detection_rate, noise, miss_rate, flip_rate, seed=0):
+    # The robot turns towards the first ball, a second (bigger) ball comes into view halfway through
+    # Yields the frame time, the true x of the first ball and the detections (None on frames without a detector run)
+    rng = np.random.default_rng(seed)
+    for index in range(frames):
+        frame_time = index / frame_rate
+        ball_x = 80 + 240 * (1 - np.exp(-frame_time))
+        balls = [(ball_x, 180, 40, 0)]
+        if index > frames // 2:
+            balls.append((ball_x + 200, 160, 70, 1))
+
+        if index % round(frame_rate / detection_rate) != 0:
+            yield frame_time, ball_x, None
+            continue
+
+        detections = []
+        for x, y, size, class_id in balls:
+            if rng.random() < miss_rate:
+                continue
+            x1, y1, x2, y2 = np.array([x - size / 2, y - size / 2, x + size / 2, y + size / 2]) + rng.normal(0, noise, 4)
+            detections.append((x1, y1, x2, y2, 1 - class_id if rng.random() < flip_rate else class_id, rng.uniform(.4, .9)))
+        yield frame_time, ball_x, np.array(detections, BallDetector.box_dtype)
+
+
+def best_box(detections, last_best_box):
+    # Selection of zone_cam before the tracker
+    boxes = [[(d["x2"] - d["x1"]) * (d["y2"] - d["y1"]), int(d["x1"] + (d["x2"] - d["x1"]) // 2) - horizontal_center, int(d["cls"])] for d in detections]
+    if len(boxes) == 0:
+        return None
+    box = max(boxes, key=lambda x: x[0])
+    if last_best_box is not None:
+        box = min(boxes, key=lambda x: abs(x[1] - last_best_box[1]))
+    return box
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compares the per frame best_box selection with BallTracker on simulated detections")
+    parser.add_argument("--frames", type=int, default=600)
+    parser.add_argument("--frame-rate", type=float, default=30)
+    parser.add_argument("--detection-rate", type=float, default=15)
+    parser.add_argument("--noise", type=float, default=4, help="standard deviation of the box corners in pixels")
+    parser.add_argument("--miss-rate", type=float, default=.15)
+    parser.add_argument("--flip-rate", type=float, default=.1, help="share of detections with the wrong class")
+    args = parser.parse_args()
+
+    tracker = BallTracker(2)
+    last_best_box = None
+    results = {name: {"errors": [], "classes": [], "wrong_ball": 0, "missing": 0} for name in ["best_box", "BallTracker"]}
+
+    for frame_time, ball_x, detections in simulate(args.frames, args.frame_rate, args.detection_rate, args.noise, args.miss_rate, args.flip_rate):
+        # zone_cam only published on detector frames before, in between the last values stayed
+        if detections is not None:
+            last_best_box = best_box(detections, last_best_box)
+        raw = (last_best_box[1], last_best_box[2]) if last_best_box is not None else None
+
+        target = tracker.update(detections, frame_time) if detections is not None else tracker.predict(frame_time)
+        tracked = (target.x - horizontal_center, target.cls) if target is not None else None
+
+        for name, published in [("best_box", raw), ("BallTracker", tracked)]:
+            result = results[name]
+            if published is None:
+                result["missing"] += 1
+            elif abs(published[0] - (ball_x - horizontal_center)) > 100:
+                result["wrong_ball"] += 1
+            else:
+                result["errors"].append(published[0] - (ball_x - horizontal_center))
+                result["classes"].append(published[1])
+
+    for name, result in results.items():
+        errors = np.array(result["errors"])
+        print(f"{name:>12}: ball_distance error mean |{np.abs(errors).mean():5.2f}| px  std {errors.std():5.2f} px  "
+              f"frames on the other ball {result['wrong_ball']}  without target {result['missing']}  wrong class {np.mean(np.array(result['classes']) != 0) * 100:4.1f} %")
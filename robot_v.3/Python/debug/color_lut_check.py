@@ -0,0 +1,177 @@
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+main_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main")
+sys.path.insert(0, main_dir)
+os.chdir(main_dir)
+os.environ["ROBOT_SHM_PREFIX"] = "debug_"
+
+from Managers import ConfigManager, FileFrameSource, MorphologyChain, SyntheticFrameSource
+from mp_manager import cam_1_frames, cam_2_frames, line_profile, silver_frames, state
+import line_cam
+
+
+def read_frames(frame_source, camera_x=448, camera_y=252):
+    frames = []
+    while True:
+        frame, _ = frame_source.read()
+        if frame is None:
+            return frames
+        frames.append(cv2.cvtColor(cv2.resize(frame, (camera_x, camera_y)), cv2.COLOR_RGBA2BGR))
+
+
+def blob_frames(count, camera_x=448, camera_y=252, seed=0):
+    # Gray frames with a few green and red blobs of every size, most of them without any
+    rng = np.random.default_rng(seed)
+    frames = []
+    for _ in range(count):
+        frame = np.full((camera_y, camera_x, 3), 200, np.uint8)
+        cv2.rectangle(frame, (200, 0), (250, camera_y), (20, 20, 20), -1)
+        for _ in range(rng.choice([0, 0, 0, 1, 2, 4])):
+            color = [(40, 160, 40), (40, 40, 200), (60, 30, 170)][rng.integers(0, 3)]
+            x, y, size = int(rng.integers(-10, camera_x)), int(rng.integers(-10, camera_y)), int(rng.integers(1, 60))
+            cv2.rectangle(frame, (x, y), (x + size, y + int(rng.integers(1, 60))), color, -1)
+        frames.append(frame)
+    return frames
+
+
+def in_range_masks(frame):
+    # The masks as line_cam built them with one inRange per threshold
+    hsv_image = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+    masks = {name: cv2.inRange(frame, line_cam.black_min, maximum) for name, maximum in black_classes.items()}
+    for name, ranges in hsv_classes.items():
+        masks[name] = cv2.inRange(hsv_image, *ranges[0])
+        for range_min, range_max in ranges[1:]:
+            masks[name] |= cv2.inRange(hsv_image, range_min, range_max)
+    return masks
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compares the ColorLut masks of line_cam with one inRange per threshold")
+    parser.add_argument("source", nargs="?", default="synthetic", help="directory of PNGs, an .npy stack of frames or 'synthetic'")
+    parser.add_argument("--frames", type=int, default=200, help="number of synthetic frames")
+    parser.add_argument("--levels", type=int, default=64, help="levels per channel of the HSV table")
+    parser.add_argument("--blobs", type=int, default=300, help="random marker blob frames for the tile check")
+    args = parser.parse_args()
+
+    if args.source == "synthetic":
+        source = SyntheticFrameSource(args.frames)
+    else:
+        source = FileFrameSource(args.source)
+
+    # Real frames and uniform noise, which puts as many pixels as possible next to a threshold
+    # Both are counted on their own, the share of the noise frames would otherwise depend on the number of real ones
+    rng = np.random.default_rng(0)
+    camera_frames = read_frames(source)
+    noise_frames = [rng.integers(0, 256, (252, 448, 3), dtype=np.uint8) for _ in range(20)]
+    frames = camera_frames + noise_frames
+
+    line_cam.color_lut = line_cam.ColorLut((252, 448), args.levels)
+    line_cam.update_color_values()
+    color_lut = line_cam.color_lut
+
+    black_classes = {name: getattr(line_cam, name.replace("black_", "black_max_")) for name in color_lut.bits if name.startswith("black_")}
+    hsv_classes = {"green": [(line_cam.green_min, line_cam.green_max)],
+                   "red": [(line_cam.red_min_1, line_cam.red_max_1), (line_cam.red_min_2, line_cam.red_max_2)],
+                   "green_zone": [(line_cam.green_min_zone, line_cam.green_max_zone)],
+                   "red_zone": [(line_cam.red_min_1_zone, line_cam.red_max_1_zone), (line_cam.red_min_2_zone, line_cam.red_max_2_zone)]}
+    chain = MorphologyChain(ConfigManager("config.ini").read_variable('morphology', 'green'))
+
+    for frames_name, checked_frames in [("camera frames", camera_frames), ("uniform noise", noise_frames)]:
+        differ = {name: 0 for name in color_lut.bits}
+        differ_after_morphology = {name: 0 for name in hsv_classes}
+        for frame in checked_frames:
+            classes = color_lut.classify(frame)
+            for name, mask in in_range_masks(frame).items():
+                lut_mask = color_lut.mask(classes, name)
+                differ[name] += int(np.count_nonzero(lut_mask != mask))
+                if name in hsv_classes:
+                    differ_after_morphology[name] += int(np.count_nonzero(chain.apply(lut_mask) != chain.apply(mask)))
+
+        pixels = len(checked_frames) * 252 * 448
+        print(f"{frames_name} ({len(checked_frames)} frames)")
+        for name in color_lut.bits:
+            after = f"  {differ_after_morphology[name] / pixels * 100:7.4f} % after the noise reduction" if name in differ_after_morphology else ""
+            print(f"{name:>34}: {differ[name] / pixels * 100:7.4f} % of the pixels differ{after}")
+
+    start_time = time.perf_counter()
+    for frame in frames:
+        in_range_masks(frame)
+    in_range_time = (time.perf_counter() - start_time) / len(frames) * 1e6
+
+    start_time = time.perf_counter()
+    for frame in frames:
+        classes = color_lut.classify(frame)
+        for name in color_lut.bits:
+            color_lut.mask(classes, name)
+    lut_time = (time.perf_counter() - start_time) / len(frames) * 1e6
+
+    start_time = time.perf_counter()
+    for frame in frames:
+        color_lut.classify(frame)
+    classify_time = (time.perf_counter() - start_time) / len(frames) * 1e6
+
+    print(f"All {len(color_lut.bits)} masks: inRange {in_range_time:.1f} us  ColorLut {lut_time:.1f} us (classify alone {classify_time:.1f} us)")
+
+    # The fused follow_line kernel against the step by step black mask of line_cam
+    def step_by_step(frame, black_top, black_bottom, top_rows):
+        classes = color_lut.classify(frame)
+        green_image = color_lut.mask(classes, "green")
+        black_image = color_lut.mask(classes, black_bottom)
+        black_image[0:top_rows] = color_lut.mask(classes[0:top_rows], black_top)
+        black_image -= green_image
+        black_image[black_image < 2] = 0
+        black_image_2 = color_lut.mask(classes, "black_ramp_down_top")
+        black_image_2 -= green_image
+        black_image_2[black_image_2 < 2] = 0
+        return black_image, green_image, color_lut.mask(classes, "red"), black_image_2[0:100], np.mean(black_image[0:63]), np.mean(black_image_2[0:63])
+
+    # Frames without a marker nearby only classify green and red in the tiles around the grid hits, so those two masks
+    # are compared after their noise reduction, everything else has to match exactly
+    green_chain = MorphologyChain(ConfigManager("config.ini").read_variable('morphology', 'green'))
+    red_chain = MorphologyChain(ConfigManager("config.ini").read_variable('morphology', 'red'))
+    frames_with_blobs = frames + blob_frames(args.blobs)
+    for hold_frames in (0, color_lut.hold_frames):
+        color_lut.hold_frames = hold_frames
+        mismatches = 0
+        times = {"tiles": [], "whole frame": []}
+        for frame in frames_with_blobs:
+            start_time = time.perf_counter_ns()
+            fused = color_lut.line_masks(frame, "black_normal_top", "black_normal_bottom", 100, "black_ramp_down_top", 100, 63)
+            times["whole frame" if color_lut.full_frame else "tiles"].append(time.perf_counter_ns() - start_time)
+            reference = step_by_step(frame, "black_normal_top", "black_normal_bottom", 100)
+            mismatches += sum(int(np.count_nonzero(a != b)) for a, b in [(fused[0], reference[0]), (fused[3], reference[3]), (green_chain.apply(fused[1]), green_chain.apply(reference[1])), (red_chain.apply(fused[2]), red_chain.apply(reference[2]))])
+            mismatches += sum(abs(a - b) > 1e-9 for a, b in zip(fused[4:], reference[4:]))
+        print(f"line_masks hold_frames {hold_frames}: {mismatches} differences over {len(frames_with_blobs)} frames  " + "  ".join(f"{name} {len(values)} frames {np.mean(values) / 1000:.1f} us" for name, values in times.items() if values))
+
+    for black_top, black_bottom, top_rows in [("black_normal_top", "black_normal_bottom", 100), ("black_silver_validate_top_off", "black_silver_validate_bottom_off", 176), ("black_silver_validate_top_on", "black_silver_validate_bottom_on", 100)]:
+        # Once a marker was seen the whole frame is classified from then on, so the raw masks have to match
+        color_lut.hold_frames = len(frames)
+        mismatches = 0
+        for frame in frames:
+            fused = color_lut.line_masks(frame, black_top, black_bottom, top_rows, "black_ramp_down_top", 100, 63)
+            reference = step_by_step(frame, black_top, black_bottom, top_rows)
+            mismatches += sum(int(np.count_nonzero(a != b)) for a, b in zip(fused[:4], reference[:4])) + sum(abs(a - b) > 1e-9 for a, b in zip(fused[4:], reference[4:]))
+
+        start_time = time.perf_counter()
+        for frame in frames:
+            step_by_step(frame, black_top, black_bottom, top_rows)
+        step_time = (time.perf_counter() - start_time) / len(frames) * 1e6
+
+        start_time = time.perf_counter()
+        for frame in frames:
+            color_lut.line_masks(frame, black_top, black_bottom, top_rows, "black_ramp_down_top", 100, 63)
+        fused_time = (time.perf_counter() - start_time) / len(frames) * 1e6
+
+        print(f"line_masks {black_bottom}: {mismatches} differences  step by step {step_time:.1f} us  fused {fused_time:.1f} us")
+
+    cam_1_frames.unlink()
+    cam_2_frames.unlink()
+    silver_frames.unlink()
+    line_profile.unlink()
+    state.unlink()
@@ -0,0 +1,112 @@
+import argparse
+import math
+import os
+import pty
+import random
+import select
+import struct
+import threading
+import time
+import tty
+
+SYNC_BYTE = 0xA5
+
+
+def crc8(data):
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+def frame(message_id, values):
+    payload = bytes([message_id]) + struct.pack(f"<{len(values)}f", *values)
+    return bytes([SYNC_BYTE]) + payload + bytes([crc8(payload)])
+
+
+class FakeArduino:
+    # Pretends to be arduino_main.ino on a pseudo terminal: 7 distance sensors and 2 IMUs per cycle
+    def __init__(self, rate=10, binary=True):
+        self.rate = rate
+        self.binary = binary
+        self.binary_mode = False
+        self.cycles = 0
+
+        self.__master, self.__slave = pty.openpty()
+        tty.setraw(self.__slave)
+        self.port = os.ttyname(self.__slave)
+
+        self.__running = False
+        self.__threads = []
+
+    def start(self):
+        self.__running = True
+        self.__threads = [threading.Thread(target=self.__write_loop, daemon=True), threading.Thread(target=self.__command_loop, daemon=True)]
+        for thread in self.__threads:
+            thread.start()
+        return self.port
+
+    def stop(self):
+        self.__running = False
+        for thread in self.__threads:
+            thread.join()
+
+    def __command_loop(self):
+        while self.__running:
+            if not select.select([self.__master], [], [], .1)[0]:
+                continue
+            for command in os.read(self.__master, 64):
+                if command == ord("B") and self.binary:
+                    self.binary_mode = True
+                    os.write(self.__master, b"BIN OK\r\n")
+                elif command == ord("T"):
+                    self.binary_mode = False
+
+    def cycle(self):
+        angle = (self.cycles * .5) % 360
+        distances = [random.choice([-1.0, math.nan] + [float(random.randint(0, 1200))] * 8) for _ in range(7)]
+        imus = [[angle, random.uniform(-2, 2), random.uniform(-2, 2), random.uniform(-.2, .2), random.uniform(-.2, .2)] for _ in range(2)]
+
+        if self.binary_mode:
+            data = b"".join(frame(index + 1, [distance]) for index, distance in enumerate(distances))
+            data += frame(0x11, imus[0]) + frame(0x12, imus[1])
+        else:
+            lines = []
+            for index, distance in enumerate(distances):
+                if distance != distance:
+                    lines.append(f"S{index + 1} No")
+                elif distance == -1:
+                    lines.append(f"S{index + 1} -1")
+                else:
+                    lines.append(f"S{index + 1} {distance:.2f}")
+            for index, imu in enumerate(imus):
+                lines.append(f"G{index + 1} X: {imu[0]:.2f} Y: {imu[1]:.2f} Z: {imu[2]:.2f} AX: {imu[3]:.2f} AY: {imu[4]:.2f}")
+            data = "".join(line + "\r\n" for line in lines).encode()
+
+        self.cycles += 1
+        return data
+
+    def __write_loop(self):
+        next_time = time.perf_counter()
+        while self.__running:
+            os.write(self.__master, self.cycle())
+            next_time += 1 / self.rate
+            time.sleep(max(0., next_time - time.perf_counter()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Arduino on a pseudo terminal, set [serial] port in config.ini to the printed path")
+    parser.add_argument("--rate", type=float, default=10, help="sensor cycles per second")
+    parser.add_argument("--text", action="store_true", help="never acknowledge the binary protocol")
+    args = parser.parse_args()
+
+    fake_arduino = FakeArduino(args.rate, not args.text)
+    print(f"Fake serial port: {fake_arduino.start()}")
+    try:
+        while True:
+            time.sleep(1)
+            print(f"Cycles: {fake_arduino.cycles} Binary: {fake_arduino.binary_mode}")
+    except KeyboardInterrupt:
+        fake_arduino.stop()
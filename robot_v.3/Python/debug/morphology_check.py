@@ -0,0 +1,93 @@
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+main_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main")
+sys.path.insert(0, main_dir)
+os.chdir(main_dir)
+
+from Managers import ConfigManager, FileFrameSource, MorphologyChain, SyntheticFrameSource
+
+kernal = np.ones((3, 3), np.uint8)
+
+
+def iterated(mask, steps):
+    # The chains as line_cam ran them before, one cv2 call with iterations of the 3x3 kernel per step
+    for operation, iterations in steps:
+        if operation == "erode":
+            mask = cv2.erode(mask, kernal, iterations=iterations)
+        else:
+            mask = cv2.dilate(mask, kernal, iterations=iterations)
+    return mask
+
+
+def frame_masks(frame_source, camera_x=448, camera_y=252):
+    config_manager = ConfigManager("config.ini")
+    black_max = np.array(config_manager.read_variable('color_values_line', 'black_max_normal_bottom'))
+    green_min = np.array(config_manager.read_variable('color_values_line', 'green_min'))
+    green_max = np.array(config_manager.read_variable('color_values_line', 'green_max'))
+    red_min = np.array(config_manager.read_variable('color_values_line', 'red_min_1'))
+    red_max = np.array(config_manager.read_variable('color_values_line', 'red_max_1'))
+
+    while True:
+        frame, _ = frame_source.read()
+        if frame is None:
+            return
+        cv2_img = cv2.cvtColor(cv2.resize(frame, (camera_x, camera_y)), cv2.COLOR_RGBA2BGR)
+        hsv_image = cv2.cvtColor(cv2_img, cv2.COLOR_BGR2HSV)
+        yield cv2.inRange(cv2_img, np.array([0, 0, 0]), black_max)
+        yield cv2.inRange(hsv_image, green_min, green_max)
+        yield cv2.inRange(hsv_image, red_min, red_max)
+
+
+def noise_masks(count, camera_x=448, camera_y=252, seed=0):
+    # Random blobs touching the borders, where a wrong border handling would show up
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        mask = np.zeros((camera_y, camera_x), np.uint8)
+        mask[rng.random((camera_y, camera_x)) < rng.uniform(.001, .3)] = 255
+        for _ in range(rng.integers(0, 6)):
+            x, y = rng.integers(-20, camera_x), rng.integers(-20, camera_y)
+            cv2.rectangle(mask, (int(x), int(y)), (int(x + rng.integers(5, 120)), int(y + rng.integers(5, 120))), 255, -1)
+        yield mask
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checks that the [morphology] chains give the same masks as the iterated 3x3 erode/dilate calls")
+    parser.add_argument("source", nargs="?", default="synthetic", help="directory of PNGs, an .npy stack of frames or 'synthetic'")
+    parser.add_argument("--frames", type=int, default=200, help="number of synthetic frames")
+    parser.add_argument("--noise", type=int, default=200, help="number of random masks checked in addition")
+    args = parser.parse_args()
+
+    if args.source == "synthetic":
+        source = SyntheticFrameSource(args.frames)
+    else:
+        source = FileFrameSource(args.source)
+
+    masks = list(frame_masks(source)) + list(noise_masks(args.noise))
+    chains = ConfigManager("config.ini").read_section('morphology')
+    print(f"{len(masks)} masks")
+
+    failed = False
+    for name, steps in chains.items():
+        chain = MorphologyChain(steps)
+        mismatches = sum(int(np.count_nonzero(chain.apply(mask) != iterated(mask, steps))) for mask in masks)
+        failed |= mismatches > 0
+
+        start_time = time.perf_counter()
+        for mask in masks:
+            iterated(mask, steps)
+        iterated_time = (time.perf_counter() - start_time) / len(masks) * 1e6
+
+        start_time = time.perf_counter()
+        for mask in masks:
+            chain.apply(mask)
+        chain_time = (time.perf_counter() - start_time) / len(masks) * 1e6
+
+        print(f"{name:>24}: {mismatches:6d} pixels differ  iterated {iterated_time:7.1f} us  chain {chain_time:7.1f} us")
+
+    sys.exit(1 if failed else 0)
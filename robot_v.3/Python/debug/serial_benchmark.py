@@ -0,0 +1,40 @@
+import argparse
+import os
+import sys
+import time
+from multiprocessing import Process
+
+from fake_serial import FakeArduino
+
+main_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main")
+sys.path.insert(0, main_dir)
+os.chdir(main_dir)
+os.environ["ROBOT_SHM_PREFIX"] = "debug_"
+
+from mp_manager import *
+from sensor_serial import serial_loop
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs serial_loop against a fake Arduino and prints the per channel counters")
+    parser.add_argument("--rate", type=float, default=100, help="sensor cycles per second sent by the fake Arduino")
+    parser.add_argument("--seconds", type=int, default=10)
+    parser.add_argument("--text", action="store_true", help="never acknowledge the binary protocol")
+    args = parser.parse_args()
+
+    fake_arduino = FakeArduino(args.rate, not args.text)
+    fake_arduino.start()
+
+    process = Process(target=serial_loop, args=(fake_arduino.port,))
+    process.start()
+
+    try:
+        for _ in range(args.seconds):
+            time.sleep(1)
+            print(f"IPS_S: {iterations_serial.value} Binary: {fake_arduino.binary_mode}")
+            for channel in serial_channels:
+                print(f"  {channel}: received {serial_received[channel].value:5d}/s published {serial_rate[channel].value:5d}/s dropped {serial_dropped[channel].value:6d} late {serial_late[channel].value:4d}")
+    finally:
+        terminate.value = True
+        process.join()
+        fake_arduino.stop()
+        state.unlink()
@@ -1,9 +1,21 @@
+import argparse
+
 import serial
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--record", help="also write the raw bytes to this file, for serial_replay_benchmark.py")
+    args = parser.parse_args()
+
+    record_file = open(args.record, "wb") if args.record else None
+
     ser = serial.Serial('/dev/ttyUSB0', 115200, timeout=1)
     ser.reset_input_buffer()
     while True:
         if ser.in_waiting > 0:
-            line = ser.readline().decode('utf-8').rstrip()
+            raw_line = ser.readline()
+            if record_file is not None:
+                record_file.write(raw_line)
+                record_file.flush()
+            line = raw_line.decode('utf-8').rstrip()
             print(line)
@@ -0,0 +1,46 @@
+import argparse
+import os
+import sys
+import time
+
+from fake_serial import FakeArduino
+
+main_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main")
+sys.path.insert(0, main_dir)
+os.chdir(main_dir)
+os.environ["ROBOT_SHM_PREFIX"] = "debug_"
+
+from mp_manager import *
+from sensor_serial import decode_line, publish
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replays a recorded text serial capture (serial_debug.py --record) through the line decoder")
+    parser.add_argument("capture", nargs="?", help="capture file, a synthetic one is generated when omitted")
+    parser.add_argument("--cycles", type=int, default=2000, help="sensor cycles in the synthetic capture")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.capture:
+        with open(args.capture, "rb") as capture_file:
+            capture = capture_file.read()
+    else:
+        fake_arduino = FakeArduino(binary=False)
+        capture = b"".join(fake_arduino.cycle() for _ in range(args.cycles))
+
+    lines = [line.decode(errors="ignore").rstrip() for line in capture.split(b"\n") if line]
+    print(f"{len(lines)} lines")
+
+    try:
+        best = 0
+        for _ in range(args.repeats):
+            start_time = time.perf_counter()
+            for line in lines:
+                decoded = decode_line(line)
+                if decoded is not None:
+                    publish(*decoded, time.perf_counter())
+            lines_per_second = len(lines) / (time.perf_counter() - start_time)
+            best = max(best, lines_per_second)
+            print(f"{lines_per_second:10.0f} lines/s")
+        print(f"Best: {best:.0f} lines/s")
+    finally:
+        state.unlink()
@@ -0,0 +1,68 @@
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+from ultralytics import YOLO
+
+main_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main")
+sys.path.insert(0, main_dir)
+os.chdir(main_dir)
+
+from Managers import FileFrameSource, SyntheticFrameSource
+from Vision import SilverClassifier
+
+
+def read_frames(frame_source, camera_x=448, camera_y=252):
+    # The frames line_cam posts to silver_cam, resized but still RGBA
+    frames = []
+    while True:
+        frame, _ = frame_source.read()
+        if frame is None:
+            return frames
+        frames.append(cv2.resize(frame, (camera_x, camera_y)))
+
+
+def timed(predict, frames):
+    predict(frames[0])  # the first run allocates and warms up the session
+
+    values, times = [], []
+    for frame in frames:
+        start_time = time.perf_counter_ns()
+        values.append(predict(frame))
+        times.append((time.perf_counter_ns() - start_time) / 1000)
+    return np.array(values), np.array(times)
+
+
+def print_times(name, times):
+    print(f"{name:>34}: mean {np.mean(times):8.1f} us  p50 {np.percentile(times, 50):8.1f} us  p95 {np.percentile(times, 95):8.1f} us  p99 {np.percentile(times, 99):8.1f} us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compares SilverClassifier (onnxruntime) with the ultralytics predict() path on the same frames")
+    parser.add_argument("model", nargs="?", default="../../Ai/models/silver_zone_entry/silver_classify_s.onnx", help="exported YOLO classifier")
+    parser.add_argument("source", nargs="?", default="synthetic", help="directory of PNGs, an .npy stack of frames or 'synthetic'")
+    parser.add_argument("--frames", type=int, default=200, help="number of synthetic frames")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4], help="intra op threads of the onnxruntime session")
+    args = parser.parse_args()
+
+    if args.source == "synthetic":
+        source = SyntheticFrameSource(args.frames)
+    else:
+        source = FileFrameSource(args.source)
+    frames = read_frames(source)
+    print(f"{len(frames)} frames")
+
+    model = YOLO(args.model, task='classify')
+    ultralytics_values, ultralytics_times = timed(lambda frame: float(model.predict(frame, imgsz=128, conf=0.4, verbose=False)[0].probs.data[1]), frames)
+    print_times("ultralytics predict()", ultralytics_times)
+
+    for threads in args.threads:
+        classifier = SilverClassifier(args.model, threads)
+        values, times = timed(classifier.predict, frames)
+        difference = np.abs(values - ultralytics_values)
+        print_times(f"SilverClassifier {threads} threads", times)
+        print(f"{'':>34}  |difference| mean {difference.mean():.4f} max {difference.max():.4f}  "
+              f"same side of .5 on {np.mean((values > .5) == (ultralytics_values > .5)) * 100:.1f} % of the frames")
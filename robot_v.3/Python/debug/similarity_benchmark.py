@@ -0,0 +1,91 @@
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+from skimage.metrics import structural_similarity
+
+main_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main")
+sys.path.insert(0, main_dir)
+os.chdir(main_dir)
+
+from Managers import FileFrameSource, SimilarityDetector, SyntheticFrameSource
+
+
+def read_frames(frame_source, camera_x=448, camera_y=252):
+    frames = []
+    while True:
+        frame, _ = frame_source.read()
+        if frame is None:
+            return frames
+        frames.append(cv2.cvtColor(cv2.resize(frame, (camera_x, camera_y)), cv2.COLOR_RGBA2BGR))
+
+
+def stuck_frames(frame, count, seed=0):
+    # The same view over and over with sensor noise, like a robot that does not move
+    rng = np.random.default_rng(seed)
+    return [np.clip(frame + rng.normal(0, 4, frame.shape), 0, 255).astype(np.uint8) for _ in range(count)]
+
+
+def compare(name, images, lag, size, threshold, stuck):
+    # threshold: the stuck threshold control.py used with skimage
+    detector = SimilarityDetector(lag, size)
+    full, small = [], []
+    full_time, small_time = 0, 0
+
+    for index, image in enumerate(images):
+        start_time = time.perf_counter_ns()
+        value = detector.update(image)
+        small_time += time.perf_counter_ns() - start_time
+
+        if index >= lag:
+            start_time = time.perf_counter_ns()
+            full.append(structural_similarity(image, images[index - lag]))
+            full_time += time.perf_counter_ns() - start_time
+            small.append(value)
+
+    full, small = np.array(full), np.array(small)
+    # Comparisons of two moving frames and of two stuck frames, the ones in between are left out
+    moving = slice(0, len(images) - stuck - lag)
+    stuck_part = slice(-(stuck - lag), None)
+    print(f"{name}: {len(full)} comparisons, lag {lag} frames, downsampled to {size[0]}x{size[1]}")
+    print(f"  skimage full frame {full_time / len(full) / 1000:8.1f} us per comparison ({full_time / len(full) / lag / 1000:.1f} us per frame when run every {lag} frames)")
+    print(f"  SimilarityDetector {small_time / len(images) / 1000:8.1f} us per frame")
+    print(f"  moving: mean skimage {full[moving].mean():.3f}  detector {small[moving].mean():.3f}  mean |difference| {np.abs(full[moving] - small[moving]).mean():.3f}  "
+          f"correlation {np.corrcoef(full[moving], small[moving])[0, 1]:.3f}")
+    print(f"  moving above the stuck threshold {threshold}: skimage {np.mean(full[moving] > threshold) * 100:.1f} %  detector {np.mean(small[moving] > threshold) * 100:.1f} %  "
+          f"(max skimage {full[moving].max():.3f}  detector {small[moving].max():.3f})")
+    print(f"  stuck: mean skimage {full[stuck_part].mean():.3f}  detector {small[stuck_part].mean():.3f}  (min skimage {full[stuck_part].min():.3f}  detector {small[stuck_part].min():.3f})")
+
+    # Least squares line through the moving and stuck comparisons, maps the skimage thresholds onto the detector scale
+    slope, offset = np.polyfit(small[moving.start:moving.stop].tolist() + small[stuck_part].tolist(), full[moving.start:moving.stop].tolist() + full[stuck_part].tolist(), 1)
+    print(f"  fit: skimage = {slope:.3f} * detector + {offset:.3f}  ->  skimage threshold {threshold} is detector {(threshold - offset) / slope:.3f}")
+    print(f"  detector between moving and stuck: {(small[moving].max() + small[stuck_part].min()) / 2:.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compares SimilarityDetector with skimage structural_similarity on recorded or synthetic frames")
+    parser.add_argument("source", nargs="?", default="synthetic", help="directory of PNGs, an .npy stack of frames or 'synthetic'")
+    parser.add_argument("--frames", type=int, default=300, help="number of synthetic frames")
+    parser.add_argument("--stuck", type=int, default=100, help="number of noisy copies of the last frame appended")
+    args = parser.parse_args()
+
+    if args.source == "synthetic":
+        source = SyntheticFrameSource(args.frames)
+    else:
+        source = FileFrameSource(args.source)
+
+    frames = read_frames(source)
+    frames += stuck_frames(frames[-1], args.stuck)
+
+    # line_cam compares the black mask, zone_cam the grey image
+    black_images = [cv2.inRange(frame, np.array([0, 0, 0]), np.array([133, 133, 135])) for frame in frames]
+    grey_images = [cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) for frame in frames]
+
+    # Zone frames are 640x264 on the robot, the synthetic ones are scaled up to that
+    grey_images = [cv2.resize(image, (640, 264)) for image in grey_images]
+
+    compare("line (black mask)", black_images, 30, (64, 36), .88, args.stuck)
+    compare("zone (grey image)", grey_images, 10, (160, 66), .95, args.stuck)
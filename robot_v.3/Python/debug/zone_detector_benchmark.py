@@ -0,0 +1,92 @@
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+from ultralytics import YOLO
+
+main_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main")
+sys.path.insert(0, main_dir)
+os.chdir(main_dir)
+
+from Managers import FileFrameSource, SyntheticFrameSource
+from Vision import BallDetector
+
+
+def read_frames(frame_source, camera_x=640, camera_y=264):
+    # The cropped zone camera image, the synthetic frames are scaled up to it
+    frames = []
+    while True:
+        frame, _ = frame_source.read()
+        if frame is None:
+            return frames
+        frames.append(cv2.cvtColor(cv2.resize(frame, (camera_x, camera_y)), cv2.COLOR_RGBA2BGR))
+
+
+def timed(detect, frames):
+    detect(frames[0])  # the first run allocates and warms up the interpreter
+
+    detections, times = [], []
+    for frame in frames:
+        start_time = time.perf_counter_ns()
+        detections.append(detect(frame))
+        times.append((time.perf_counter_ns() - start_time) / 1000)
+    return detections, np.array(times)
+
+
+def matched(boxes_1, boxes_2, iou=.9):
+    # Boxes of boxes_1 with a box of the same class in boxes_2 that overlaps by more than iou
+    count = 0
+    for x1, y1, x2, y2, cls in boxes_1:
+        for other_x1, other_y1, other_x2, other_y2, other_cls in boxes_2:
+            intersection = max(0, min(x2, other_x2) - max(x1, other_x1)) * max(0, min(y2, other_y2) - max(y1, other_y1))
+            union = (x2 - x1) * (y2 - y1) + (other_x2 - other_x1) * (other_y2 - other_y1) - intersection
+            if cls == other_cls and union > 0 and intersection / union > iou:
+                count += 1
+                break
+    return count
+
+
+def print_times(name, times):
+    print(f"{name:>26}: mean {np.mean(times):8.1f} us  p50 {np.percentile(times, 50):8.1f} us  p95 {np.percentile(times, 95):8.1f} us  ({1e6 / np.mean(times):.1f} fps)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compares BallDetector with the ultralytics predict() path of zone_cam on the same frames")
+    parser.add_argument("model", nargs="?", default="../../Ai/models/ball_zone_s/ball_detect_s_edgetpu.tflite", help=".tflite (tflite_runtime, Edge TPU if named *_edgetpu) or .onnx (onnxruntime)")
+    parser.add_argument("source", nargs="?", default="synthetic", help="directory of PNGs, an .npy stack of frames or 'synthetic'")
+    parser.add_argument("--frames", type=int, default=200, help="number of synthetic frames")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4], help="interpreter / session threads")
+    parser.add_argument("--conf", type=float, default=.3)
+    parser.add_argument("--iou", type=float, default=.2)
+    args = parser.parse_args()
+
+    if args.source == "synthetic":
+        source = SyntheticFrameSource(args.frames)
+    else:
+        source = FileFrameSource(args.source)
+    frames = read_frames(source)
+    print(f"{len(frames)} frames")
+
+    image_size = (frames[0].shape[1], frames[0].shape[0])
+    input_width, input_height = BallDetector(args.model, image_size, threads=1).input_size
+
+    model = YOLO(args.model, task='detect')
+
+    def predict(frame):
+        result = model.predict(frame, imgsz=(input_height, input_width), conf=args.conf, iou=args.iou, agnostic_nms=True, verbose=False)[0].numpy()
+        return [(*box.xyxy[0], int(box.cls[0])) for box in result.boxes]
+
+    ultralytics_boxes, ultralytics_times = timed(predict, frames)
+    print_times("ultralytics predict()", ultralytics_times)
+
+    for threads in args.threads:
+        detector = BallDetector(args.model, image_size, conf=args.conf, iou=args.iou, threads=threads)
+        detections, times = timed(detector.detect, frames)
+        boxes = [[(*detection[["x1", "y1", "x2", "y2"]], int(detection["cls"])) for detection in frame_detections] for frame_detections in detections]
+
+        print_times(f"BallDetector {threads} threads", times)
+        print(f"{'':>26}  {sum(map(len, boxes))} boxes, ultralytics {sum(map(len, ultralytics_boxes))}, "
+              f"{sum(matched(a, b) for a, b in zip(boxes, ultralytics_boxes))} of them found by both (IoU > .9, same class)")
@@ -1,7 +1,15 @@
 import configparser
+import glob
+import heapq
 import json
+import math
+import os
 import time
+import types
+from collections import deque, namedtuple
+from multiprocessing import shared_memory
 
+import cv2
 import numpy as np
 
 
@@ -30,28 +38,890 @@ class ConfigManager:
         else:
             return None
 
+    def read_section(self, section):
+        if not self.__config.has_section(section):
+            return {}
+        return {variable: self.read_variable(section, variable) for variable in self.__config.options(section)}
+
 
 class Timer:
     def __init__(self):
-        self.__timer_arr = np.array([["none", 1, 0, 0]])
+        self.__timers = {}  # name -> expiry time
+        self.__deadlines = []  # min-heap of (expiry time, name), may contain outdated entries
 
     def remove_timer(self, name):
-        self.__timer_arr = self.__timer_arr[np.where(self.__timer_arr[:, 0] != name)]
+        self.__timers.pop(name, None)
 
     def set_timer(self, name, set_time):
-        self.remove_timer(name)
-        self.__timer_arr = np.append(self.__timer_arr, [[name, time.perf_counter(), set_time, False]], axis=0)
+        expiry = time.perf_counter() + set_time
+        self.__timers[name] = expiry
+        heapq.heappush(self.__deadlines, (expiry, name))
 
-    def __update_timer(self):
-        for i, timer in enumerate(self.__timer_arr):
-            if not timer[0] == "none":
-                self.__timer_arr[i, 3] = (time.perf_counter() - float(timer[1])) > float(timer[2])
+        # Drop outdated heap entries once they outnumber the timers
+        if len(self.__deadlines) > 2 * len(self.__timers) + 32:
+            self.__deadlines = [(expiry, name) for name, expiry in self.__timers.items()]
+            heapq.heapify(self.__deadlines)
 
     def get_timer(self, name):
-        self.__update_timer()
-        time_val = self.__timer_arr[np.where(self.__timer_arr[:, 0] == name), 3]
+        expiry = self.__timers.get(name)
 
-        if time_val.size > 0:
-            return time_val[0][0] == "True"
+        if expiry is not None:
+            return time.perf_counter() > expiry
         else:
             return False
+
+    def next_deadline(self):
+        # (name, time left) of the timer that runs out next, None if every timer has run out
+        now = time.perf_counter()
+        while self.__deadlines:
+            expiry, name = self.__deadlines[0]
+            if self.__timers.get(name) == expiry and expiry >= now:
+                return name, expiry - now
+            heapq.heappop(self.__deadlines)
+
+        return None
+
+
+class TimeSeries:
+    # Ring buffer of (time, value) samples. Every sample is stored twice (at i and i + length), so the last
+    # length samples are always the contiguous, time sorted slice [index, index + length)
+    __slots__ = ("length", "__times", "__values", "__index")
+
+    def __init__(self, length=240):
+        self.length = length
+        self.__times = np.zeros(2 * length)
+        self.__values = np.zeros(2 * length)
+        self.__index = 0
+
+    def fill(self, value, fill_time=0):
+        self.__times[:] = 0
+        self.__times[fill_time:self.length] = time.perf_counter()
+        self.__times[self.length + fill_time:] = time.perf_counter()
+        self.__values[:] = value
+        self.__index = 0
+
+    def add(self, value):
+        i = self.__index
+        self.__times[i] = self.__times[i + self.length] = time.perf_counter()
+        self.__values[i] = self.__values[i + self.length] = value
+        self.__index = (i + 1) % self.length
+
+    def window(self, time_range):
+        start = self.__index
+        end = start + self.length
+        first = start + np.searchsorted(self.__times[start:end], time.perf_counter() - time_range, side="right")
+        return self.__values[first:end]
+
+    def average(self, time_range):
+        values = self.window(time_range)
+        if values.size > 0:
+            return np.mean(values)
+        else:
+            return -1
+
+    def max(self, time_range):
+        values = self.window(time_range)
+        if values.size > 0:
+            return np.max(values)
+        else:
+            return -1
+
+
+class ImuFusion:
+    # Fuses the two BNO055s: circular mean of the headings, pitch / roll from the Euler angles with a small
+    # complementary pull towards the tilt measured by the accelerometer
+    # Rows are the IMUs, raw columns are x, y, z, ax, ay, 361 marks a missing value
+    def __init__(self, accel_weight=.02, accel_signs=(1, 1), tilt_signs=((-1, 1), (1, -1)), reference_samples=20):
+        self.accel_weight = accel_weight
+        self.accel_signs = np.array(accel_signs, dtype=np.float64)
+        self.tilt_signs = np.array(tilt_signs, dtype=np.float64)
+        self.reference_samples = reference_samples
+
+        self.tilt = np.zeros((2, 2))
+        self.__last_euler = np.zeros((2, 2))
+        self.__accel_reference = np.zeros((2, 2))
+        self.__samples = np.zeros(2, dtype=np.int64)
+        self.__last_offsets = np.full((2, 3), np.nan)
+
+        self.pose = np.full(3, 361.)
+
+    def update(self, raw, offsets, connected):
+        valid = (raw[:, :3] != 361) & np.array(connected)[:, None]
+        count = valid.sum(axis=0)
+
+        x = np.radians(raw[:, 0] + offsets[:, 0])
+        if count[0] > 0:
+            self.pose[0] = math.degrees(math.atan2(np.sin(x) @ valid[:, 0], np.cos(x) @ valid[:, 0])) % 360
+
+        euler = raw[:, 1:3] + offsets[:, 1:3]
+        accel_tilt = np.degrees(np.arcsin(np.minimum(np.maximum(raw[:, 3:5] / 9.81, -1), 1))) * self.accel_signs
+
+        # Start over after a recalibration or a dropout, the accelerometer tilt is measured relative to the
+        # Euler angles of the first samples after that
+        usable = valid[:, 1] & valid[:, 2] & (raw[:, 3] != 361) & (raw[:, 4] != 361)
+        if not np.array_equal(offsets, self.__last_offsets):
+            self.__samples[(offsets != self.__last_offsets).any(axis=1)] = 0
+        self.__samples = self.__samples * usable + usable
+        learning = (self.__samples <= self.reference_samples)[:, None]
+
+        if learning.any():
+            self.__accel_reference += learning * (accel_tilt - euler - self.__accel_reference) / self.__samples.clip(1)[:, None]
+        delta = (euler - self.__last_euler + 180) % 360 - 180
+        step = (1 - self.accel_weight) * (self.tilt + delta) + self.accel_weight * (accel_tilt - self.__accel_reference)
+        self.tilt = np.where(learning, euler, step)
+
+        self.__last_euler = euler
+        self.__last_offsets = offsets
+
+        tilt = (self.tilt * self.tilt_signs * valid[:, 1:3]).sum(axis=0)
+        self.pose[1:] = np.where(count[1:] > 0, tilt / count[1:].clip(1), self.pose[1:])
+        return self.pose
+
+
+class ChannelStats:
+    # Samples received and published per second, samples overwritten by a newer one before they were published and
+    # samples that were received more than twice the usual interval after the previous one, published once per second
+    def __init__(self, received_values, rate_values, dropped_values, late_values):
+        self.__received_values = received_values
+        self.__rate_values = rate_values
+        self.__dropped_values = dropped_values
+        self.__late_values = late_values
+
+        self.received_samples = {channel: 0 for channel in rate_values}
+        self.samples = {channel: 0 for channel in rate_values}
+        self.dropped = {channel: 0 for channel in rate_values}
+        self.late = {channel: 0 for channel in rate_values}
+        self.__interval = {channel: 0. for channel in rate_values}
+        self.__last_time = {channel: -1. for channel in rate_values}
+
+    def received(self, channel, now):
+        if channel not in self.received_samples:
+            return
+        if self.__last_time[channel] != -1 and 0 < self.__interval[channel] < (now - self.__last_time[channel]) / 2:
+            self.late[channel] += 1
+        self.received_samples[channel] += 1
+        self.__last_time[channel] = now
+
+    def overwritten(self, channel):
+        if channel in self.dropped:
+            self.dropped[channel] += 1
+
+    def published(self, channel):
+        if channel in self.samples:
+            self.samples[channel] += 1
+
+    def publish(self, elapsed):
+        for channel in self.samples:
+            received_rate = self.received_samples[channel] / elapsed
+            if received_rate > 0:
+                self.__interval[channel] = 1 / received_rate
+            self.__received_values[channel].value = int(received_rate)
+            self.__rate_values[channel].value = int(self.samples[channel] / elapsed)
+            self.__dropped_values[channel].value = self.dropped[channel]
+            self.__late_values[channel].value = self.late[channel]
+            self.received_samples[channel] = 0
+            self.samples[channel] = 0
+
+
+class SharedValue:
+    __slots__ = ("name", "group", "dtype", "default", "max_length", "_field", "_version", "_written")
+
+    def __init__(self, name, group, dtype, default):
+        self.name = name
+        self.group = group
+        self.dtype = dtype
+        self.default = default
+        # Strings have a fixed width in the block, numpy would cut longer ones off without an error
+        self.max_length = np.dtype(dtype).itemsize // 4 if np.dtype(dtype).kind == "U" else None
+        self._written = None  # inside a transaction: the values assigned in it
+
+    @property
+    def value(self):
+        # seqlock read: retry while the writer is inside the group, a few times right away, then yielding the CPU to it
+        # A version that stays odd means the writer died during a write
+        tries = 0
+        while True:
+            start = self._version.item(0)
+            value = self._field.item(0)
+            if not start & 1 and self._version.item(0) == start:
+                return value
+
+            tries += 1
+            if tries == 8:
+                deadline = time.perf_counter() + 1
+            elif tries > 8:
+                if time.perf_counter() > deadline:
+                    raise RuntimeError(f"{self.name}: group {self.group} stayed locked for 1 s")
+                time.sleep(0)
+
+    @value.setter
+    def value(self, value):
+        if self.max_length is not None and len(value) > self.max_length:
+            raise ValueError(f"{self.name}: {value!r} is longer than {self.max_length} characters")
+
+        # always ends on an even version, even if two writers interleave
+        seq = (self._version.item(0) + 1) | 1
+        self._version[0] = seq
+        self._field[0] = value
+        self._version[0] = seq + 1
+        if self._written is not None:
+            self._written[self] = True
+
+
+class StateManager:
+    def __init__(self, name, prefix=""):
+        self.__name = prefix + name
+        self.__values = []
+        self.__groups = []
+        self.__group_values = {}
+        self.__buffers = {}
+        self.__shm = None
+
+    def Value(self, name, group, dtype, default):
+        if group not in self.__groups:
+            self.__groups.append(group)
+            self.__group_values[group] = []
+
+        value = SharedValue(name, group, dtype, default)
+        self.__values.append(value)
+        self.__group_values[group].append(value)
+        return value
+
+    def allocate(self):
+        self.__dtype = np.dtype([(value.name, value.dtype) for value in self.__values], align=True)
+        versions_size = 8 * len(self.__groups)
+        size = versions_size + self.__dtype.itemsize
+
+        try:
+            self.__shm = shared_memory.SharedMemory(name=self.__name, create=True, size=size)
+        except FileExistsError:
+            # Left over from a run that was not shut down properly
+            stale_shm = shared_memory.SharedMemory(name=self.__name)
+            stale_shm.unlink()
+            self.__shm = shared_memory.SharedMemory(name=self.__name, create=True, size=size)
+
+        self.__versions = np.ndarray((len(self.__groups),), dtype=np.int64, buffer=self.__shm.buf)
+        self.__versions[:] = 0
+
+        self.__block = np.ndarray((1,), dtype=self.__dtype, buffer=self.__shm.buf, offset=versions_size)
+        # Copying the raw bytes is much faster than copying the structured array field by field
+        self.__block_bytes = np.ndarray((self.__dtype.itemsize,), dtype=np.uint8, buffer=self.__shm.buf, offset=versions_size)
+
+        for value in self.__values:
+            group_index = self.__groups.index(value.group)
+            value._field = self.__block[value.name]
+            value._version = self.__versions[group_index:group_index + 1]
+            value._field[0] = value.default
+
+        self.__snapshot_type = namedtuple("Snapshot", [value.name for value in self.__values])
+
+    def version(self, group):
+        # Goes up by 2 with every write or commit of the group, odd while one is in progress
+        return self.__versions.item(self.__groups.index(group))
+
+    def begin(self, *groups):
+        # Writes to the groups only go to a private copy until commit(), so readers never see a half written frame
+        # Only the values assigned in the transaction are written back, a value of the group that another process sets
+        # in the meantime keeps its new value
+        for group in groups:
+            if group in self.__buffers:
+                self.commit(group)
+
+            buffer = self.__block_bytes.copy().view(self.__dtype)
+            buffer_version = np.zeros(1, dtype=np.int64)
+            written = {}
+            self.__buffers[group] = (buffer, written)
+
+            for value in self.__group_values[group]:
+                value._field = buffer[value.name]
+                value._version = buffer_version
+                value._written = written
+
+    def commit(self, *groups):
+        # Groups committed together are odd during the whole copy, so a snapshot sees all of them or none
+        commits = []
+        for group in groups:
+            transaction = self.__buffers.pop(group, None)
+            if transaction is not None:
+                group_index = self.__groups.index(group)
+                version = self.__versions[group_index:group_index + 1]
+                seq = (version.item(0) + 1) | 1
+                version[0] = seq
+                commits.append((group, *transaction, version, seq))
+
+        for group, buffer, written, version, seq in commits:
+            for value in written:
+                self.__block[value.name] = buffer[value.name]
+            for value in self.__group_values[group]:
+                value._field = self.__block[value.name]
+                value._version = version
+                value._written = None
+
+        for group, buffer, written, version, seq in commits:
+            version[0] = seq + 1
+
+    def snapshot(self):
+        # One copy of the whole block, retried until no group was written during the copy, like SharedValue.value
+        tries = 0
+        while True:
+            start = self.__versions.copy()
+            record = self.__block_bytes.copy().view(self.__dtype)
+            if not np.any(start & 1) and np.array_equal(start, self.__versions):
+                return self.__snapshot_type._make(record.item(0))
+
+            tries += 1
+            if tries == 100:
+                deadline = time.perf_counter() + 1
+            elif tries > 100:
+                if time.perf_counter() > deadline:
+                    locked = [group for group, version in zip(self.__groups, self.__versions) if version & 1]
+                    raise RuntimeError(f"snapshot: no consistent copy for 1 s, groups {locked} locked")
+                time.sleep(0)
+
+    def unlink(self):
+        if self.__shm is not None:
+            self.__shm.unlink()
+
+
+class FrameRing:
+    # A few frame slots in shared memory, the writer fills the next slot and then publishes its sequence number
+    # Header: latest sequence, then the sequence of every slot (-1 while it is being written), then the frame time of every slot
+    def __init__(self, name, shape, dtype=np.uint8, slots=3, prefix=""):
+        self.__name = prefix + name
+        self.shape = shape
+        self.dtype = np.dtype(dtype)
+        self.slots = slots
+        self.__shm = None
+
+    def allocate(self):
+        header_size = 8 * (2 * self.slots + 1)
+        size = header_size + self.slots * int(np.prod(self.shape)) * self.dtype.itemsize
+
+        try:
+            self.__shm = shared_memory.SharedMemory(name=self.__name, create=True, size=size)
+        except FileExistsError:
+            stale_shm = shared_memory.SharedMemory(name=self.__name)
+            stale_shm.unlink()
+            self.__shm = shared_memory.SharedMemory(name=self.__name, create=True, size=size)
+
+        self.__header = np.ndarray((self.slots + 1,), dtype=np.int64, buffer=self.__shm.buf)
+        self.__header[:] = 0
+        self.__frame_times = np.ndarray((self.slots,), dtype=np.float64, buffer=self.__shm.buf, offset=8 * (self.slots + 1))
+        self.__frame_times[:] = -1
+        self.__frames = np.ndarray((self.slots, *self.shape), dtype=self.dtype, buffer=self.__shm.buf, offset=header_size)
+
+    def write(self, frame, frame_time=-1.):
+        sequence = self.__header.item(0) + 1
+        slot = sequence % self.slots
+
+        self.__header[slot + 1] = -1
+        self.__frames[slot] = frame
+        self.__frame_times[slot] = frame_time
+        self.__header[slot + 1] = sequence
+        self.__header[0] = sequence
+
+    def read(self, last_sequence=0):
+        # Returns the sequence and a view of the newest frame, or None if nothing new was written since last_sequence
+        sequence = self.__header.item(0)
+        if sequence == last_sequence or sequence == 0:
+            return last_sequence, None
+
+        slot = sequence % self.slots
+        if self.__header.item(slot + 1) != sequence:
+            return last_sequence, None
+        return sequence, self.__frames[slot]
+
+    def frame_time(self, sequence):
+        # Time the frame was captured, check overwritten() afterwards like for the frame itself
+        return self.__frame_times.item(sequence % self.slots)
+
+    def overwritten(self, sequence):
+        # True if the writer reused the slot of this frame, so whatever was read from it may be torn
+        return self.__header.item(sequence % self.slots + 1) != sequence
+
+    def unlink(self):
+        if self.__shm is not None:
+            self.__shm.unlink()
+
+
+class MorphologyChain:
+    # Erode/dilate chain of the 3x3 noise kernel, steps like [["erode", 5], ["dilate", 17], ["erode", 9]] count 3x3 iterations
+    # Every step runs as one pass with a precomputed (2n+1)x(2n+1) kernel, which gives the same mask as n iterations
+    def __init__(self, steps):
+        self.steps = [(operation, int(iterations)) for operation, iterations in steps]
+
+        passes = []
+        for operation, iterations in self.steps:
+            if operation not in ("erode", "dilate"):
+                raise ValueError(f"Unknown morphology step: {operation}")
+            if iterations <= 0:
+                continue
+            if passes and passes[-1][0] == operation:
+                passes[-1][1] += iterations
+            else:
+                passes.append([operation, iterations])
+
+        self.__passes = [(cv2.erode if operation == "erode" else cv2.dilate, np.ones((2 * iterations + 1, 2 * iterations + 1), np.uint8)) for operation, iterations in passes]
+
+    def apply(self, mask):
+        # An empty mask stays empty, which is the common case for the green and red masks
+        if not self.__passes or not cv2.countNonZero(mask):
+            return mask
+        for operation, kernel in self.__passes:
+            mask = operation(mask, kernel)
+        return mask
+
+
+class SimilarityDetector:
+    # Structural similarity between each frame and the one lag frames earlier, on a copy downsampled to size
+    # Same formula as skimage.metrics.structural_similarity (7x7 box window, sample covariance), cheap enough for
+    # every frame: the window means of each frame are kept with it, so a comparison only filters the product
+    def __init__(self, lag, size=(64, 36), data_range=255, window=7):
+        self.lag = lag
+        self.size = size
+        self.window = window
+        self.value = 0.
+        self.__frames = np.zeros((lag, 3, size[1], size[0]), np.float32)  # image, window mean, window mean of the square
+        self.__count = 0
+        self.__c1 = (.01 * data_range) ** 2
+        self.__c2 = (.03 * data_range) ** 2
+        self.__covariance_norm = window ** 2 / (window ** 2 - 1)
+
+    def reset(self):
+        self.__count = 0
+        self.value = 0.
+
+    def update(self, image):
+        slot = self.__count % self.lag
+        frame = self.__prepare(cv2.resize(image, self.size, interpolation=cv2.INTER_AREA).astype(np.float32))
+        if self.__count >= self.lag:
+            self.value = self.__similarity(frame, self.__frames[slot])
+        self.__frames[slot] = frame
+        self.__count += 1
+        return self.value
+
+    def similarity(self, image_1, image_2):
+        return self.__similarity(self.__prepare(np.float32(image_1)), self.__prepare(np.float32(image_2)))
+
+    def __prepare(self, image):
+        window = (self.window, self.window)
+        return np.stack((image, cv2.boxFilter(image, -1, window), cv2.boxFilter(image * image, -1, window)))
+
+    def __similarity(self, frame_1, frame_2):
+        image_1, mean_1, square_1 = frame_1
+        image_2, mean_2, square_2 = frame_2
+        product = cv2.boxFilter(image_1 * image_2, -1, (self.window, self.window))
+
+        mean_product = mean_1 * mean_2
+        variances = self.__covariance_norm * (square_1 + square_2 - mean_1 * mean_1 - mean_2 * mean_2)
+        covariance = self.__covariance_norm * (product - mean_product)
+        ssim = ((2 * mean_product + self.__c1) * (2 * covariance + self.__c2)) / ((mean_1 * mean_1 + mean_2 * mean_2 + self.__c1) * (variances + self.__c2))
+
+        pad = self.window // 2
+        return float(ssim[pad:-pad, pad:-pad].mean())
+
+
+class StageTimer:
+    # Nanoseconds spent in each stage of the current frame, lap() closes the stage that ran since the last lap
+    def __init__(self):
+        self.stages = {}
+        self.__last = time.perf_counter_ns()
+
+    def start(self):
+        self.stages = {}
+        self.__last = time.perf_counter_ns()
+
+    def lap(self, stage):
+        now = time.perf_counter_ns()
+        self.stages[stage] = self.stages.get(stage, 0) + now - self.__last
+        self.__last = now
+
+
+class StageProfile:
+    # Rolling window of the last frames' stage times (ns) in shared memory, so any process can read the percentiles
+    # Header: number of frames added, then one row per frame with every stage and the total
+    def __init__(self, name, stages, window=512, prefix=""):
+        self.__name = prefix + name
+        self.stages = list(stages)
+        self.window = window
+        self.__shm = None
+
+    def allocate(self):
+        size = 8 + self.window * (len(self.stages) + 1) * 8
+
+        try:
+            self.__shm = shared_memory.SharedMemory(name=self.__name, create=True, size=size)
+        except FileExistsError:
+            stale_shm = shared_memory.SharedMemory(name=self.__name)
+            stale_shm.unlink()
+            self.__shm = shared_memory.SharedMemory(name=self.__name, create=True, size=size)
+
+        self.__count = np.ndarray((1,), dtype=np.int64, buffer=self.__shm.buf)
+        self.__count[0] = 0
+        self.__samples = np.ndarray((self.window, len(self.stages) + 1), dtype=np.int64, buffer=self.__shm.buf, offset=8)
+
+    def add(self, stages):
+        count = self.__count.item(0)
+        row = self.__samples[count % self.window]
+        total = 0
+        for index, stage in enumerate(self.stages):
+            stage_time = stages.get(stage, 0)
+            row[index] = stage_time
+            total += stage_time
+        row[-1] = total
+        self.__count[0] = count + 1
+
+    def percentiles(self, q=(50, 95, 99)):
+        # {stage: [p50, p95, p99]} in microseconds over the filled part of the window, "total" included
+        samples = self.__samples[:min(self.__count.item(0), self.window)]
+        if len(samples) == 0:
+            return {}
+        values = np.percentile(samples, q, axis=0) / 1000
+        return {stage: values[:, index].round(1).tolist() for index, stage in enumerate(self.stages + ["total"])}
+
+    def dump(self, path, q=(50, 95, 99)):
+        with open(path, "w") as dump_file:
+            dump_file.write(f"stage,{','.join(f'p{percentile}_us' for percentile in q)}\n")
+            for stage, values in self.percentiles(q).items():
+                dump_file.write(f"{stage},{','.join(str(value) for value in values)}\n")
+
+    def unlink(self):
+        if self.__shm is not None:
+            self.__shm.unlink()
+
+
+class ControlScheduler:
+    # wait() returns as soon as one of the given state groups was committed again (a new camera frame, a new IMU sample)
+    # or the given wake up time has come, at the latest one period after the last wake, so a control loop runs once per
+    # new input instead of spinning
+    # Every tick (wake to next wait) is accounted to the control state it ran in, ticks longer than a period missed their deadline
+    def __init__(self, state, period=1 / 60, poll=.001):
+        self.state = state
+        self.period = period
+        self.poll = poll
+        self.stats = {}  # control state -> [ticks, missed deadlines, cpu time, wall time, longest tick]
+        self.missed = 0
+        self.__seen = {}  # group -> version at the last wake
+        self.__tick = None  # (control state, wake time, cpu time at the wake) of the running tick
+        self.__next_tick = time.perf_counter()
+
+    def wait(self, wake=(), name="none"):
+        # wake: state groups and / or a perf_counter time (alone or in the tuple), returns the group that woke the loop,
+        # "time" or "tick"
+        now = time.perf_counter()
+        self.__account(now)
+
+        if isinstance(wake, float):
+            wake = (wake,)
+        groups = [item for item in wake if isinstance(item, str)]
+        until = min((item for item in wake if not isinstance(item, str)), default=math.inf)
+        reason = None
+        while reason is None:
+            for group in groups:
+                version = self.state.version(group)
+                if not version & 1 and version != self.__seen.get(group):
+                    reason = group
+                    break
+            else:
+                now = time.perf_counter()
+                if now >= until:
+                    reason = "time"
+                elif now >= self.__next_tick:
+                    reason = "tick"
+                else:
+                    time.sleep(min(self.poll, self.__next_tick - now, until - now))
+
+        now = time.perf_counter()
+        for group in groups:
+            self.__seen[group] = self.state.version(group)
+        self.__next_tick = now + self.period
+        self.__tick = (name, now, time.process_time())
+        return reason
+
+    def stop(self):
+        # Closes the running tick
+        self.__account(time.perf_counter())
+        self.__tick = None
+
+    def __account(self, now):
+        if self.__tick is None:
+            return
+
+        name, start, cpu_start = self.__tick
+        tick_time = now - start
+        stats = self.stats.setdefault(name, [0, 0, 0., 0., 0.])
+        stats[0] += 1
+        stats[2] += time.process_time() - cpu_start
+        stats[3] += tick_time
+        stats[4] = max(stats[4], tick_time)
+        if tick_time > self.period:
+            stats[1] += 1
+            self.missed += 1
+
+    def dump(self, path):
+        with open(path, "w") as dump_file:
+            dump_file.write("state,ticks,missed,cpu_s,wall_s,cpu_mean_ms,wall_mean_ms,wall_max_ms\n")
+            for name, (ticks, missed, cpu_time, wall_time, longest) in sorted(self.stats.items(), key=lambda item: -item[1][2]):
+                dump_file.write(f"{name},{ticks},{missed},{cpu_time:.3f},{wall_time:.3f},{cpu_time / ticks * 1000:.3f},{wall_time / ticks * 1000:.3f},{longest * 1000:.1f}\n")
+
+
+class StateMachine:
+    # handlers[state](frame) returns the next state, None to stay, or a maneuver: a generator that is advanced by one
+    # step per tick and returns the next state (or None) when it ends. A maneuver yields what its next step waits for,
+    # the state groups and / or the time to pass to ControlScheduler.wait
+    # The state lives in a shared value (the enum values are its strings), so a write from outside is a transition too
+    # Transitions are kept with the time spent in the state that was left
+    def __init__(self, states, value, handlers, history=4096):
+        self.states = states
+        self.value = value
+        self.handlers = handlers
+        self.transitions = deque(maxlen=history)  # (time, from, to, time spent in from)
+        self.maneuver = None
+        self.wake = None  # what the running maneuver waits for
+        self.state = states(value.value)
+        self.__since = time.perf_counter()
+
+    def goto(self, state):
+        self.value.value = state.value
+        self.__enter(state)
+
+    def tick(self, frame):
+        self.__enter(self.states(self.value.value))
+
+        if self.maneuver is None:
+            handler = self.handlers.get(self.state)
+            result = handler(frame) if handler is not None else None
+            if not isinstance(result, types.GeneratorType):
+                if result is not None:
+                    self.goto(result)
+                return
+            self.maneuver = result
+
+        try:
+            self.wake = next(self.maneuver)
+        except StopIteration as stop:
+            self.maneuver = None
+            self.wake = None
+            if stop.value is not None:
+                self.goto(stop.value)
+
+    def start(self, maneuver):
+        # Runs a maneuver that is not the result of a handler, the state stays until it ends
+        self.cancel()
+        self.maneuver = maneuver
+
+    def cancel(self):
+        # Stops the running maneuver, its finally blocks still run
+        if self.maneuver is not None:
+            self.maneuver.close()
+            self.maneuver = None
+            self.wake = None
+
+    def __enter(self, state):
+        if state is self.state:
+            return
+
+        now = time.perf_counter()
+        self.transitions.append((now, self.state, state, now - self.__since))
+        self.state = state
+        self.__since = now
+
+    def dump(self, path):
+        with open(path, "w") as dump_file:
+            dump_file.write("time,from,to,from_s\n")
+            for transition_time, old, new, duration in self.transitions:
+                dump_file.write(f"{transition_time:.3f},{old.value},{new.value},{duration:.3f}\n")
+
+
+class PidController:
+    # output = kff * feed_forward + kp * error + ki * integral + kd * derivative, limited to +-limit
+    # Anti windup: the integral is clamped to +-integral_limit and does not grow while the output is saturated in the
+    # direction of the error. The derivative is low pass filtered with the time constant d_filter (s)
+    # Only a new measurement time updates the output, a pause longer than reset_after starts the controller over
+    # Every update is kept in telemetry (time, error, feed forward, p, i, d, output, saturated)
+    def __init__(self, kp=0., ki=0., kd=0., kff=0., limit=math.inf, integral_limit=math.inf, d_filter=0., reset_after=.25, history=20000):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.kff = kff
+        self.limit = limit
+        self.integral_limit = integral_limit
+        self.d_filter = d_filter
+        self.reset_after = reset_after
+        self.telemetry = deque(maxlen=history)
+        self.reset()
+
+    def reset(self):
+        self.integral = 0.
+        self.output = 0.
+        self.__derivative = 0.
+        self.__last_error = None
+        self.__last_time = None
+
+    def update(self, error, now, feed_forward=0.):
+        if self.__last_time is not None and now <= self.__last_time:
+            return self.output
+
+        if self.__last_time is None or now - self.__last_time > self.reset_after:
+            self.reset()
+            dt = 0.
+        else:
+            dt = now - self.__last_time
+            self.__derivative += dt / (self.d_filter + dt) * ((error - self.__last_error) / dt - self.__derivative)
+
+        self.__last_error = error
+        self.__last_time = now
+
+        feed_forward *= self.kff
+        p = self.kp * error
+        d = self.kd * self.__derivative
+        integral = min(max(self.integral + error * dt, -self.integral_limit), self.integral_limit)
+        output = feed_forward + p + self.ki * integral + d
+
+        saturated = abs(output) > self.limit
+        if not saturated or error * output < 0:
+            self.integral = integral
+        output = min(max(feed_forward + p + self.ki * self.integral + d, -self.limit), self.limit)
+
+        self.output = output
+        self.telemetry.append((now, error, feed_forward, p, self.ki * self.integral, d, output, saturated))
+        return output
+
+    def dump(self, path):
+        with open(path, "w") as dump_file:
+            dump_file.write("time,error,feed_forward,p,i,d,output,saturated\n")
+            for values in self.telemetry:
+                dump_file.write(f"{values[0]:.4f},{','.join(f'{value:.4f}' for value in values[1:7])},{int(values[7])}\n")
+
+
+# Frame sources return (frame, capture_time) with the frame in the camera layout (4 channels, RGBA order),
+# or (None, -1) once there are no frames left
+class CameraFrameSource:
+    realtime = True
+
+    def __init__(self, camera_num=0, sensor_mode=None, lens_position=None, frame_rate=None):
+        # Only available on the robot
+        os.environ["LIBCAMERA_LOG_LEVELS"] = "4"
+        from libcamera import controls
+        from picamera2 import MappedArray, Picamera2
+
+        Picamera2.set_logging(Picamera2.ERROR)
+        self.camera = Picamera2(camera_num)
+        self.__mapped_array = MappedArray
+        self.__frame = None
+
+        if sensor_mode is not None:
+            mode = self.camera.sensor_modes[sensor_mode]
+            self.camera.configure(self.camera.create_video_configuration(sensor={'output_size': mode['size'], 'bit_depth': mode['bit_depth']}))
+
+        self.camera.start()
+        self.running = True
+
+        camera_controls = {}
+        if lens_position is not None:
+            camera_controls["AfMode"] = controls.AfModeEnum.Manual
+            camera_controls["LensPosition"] = lens_position
+        if frame_rate is not None:
+            camera_controls["FrameDurationLimits"] = (1000000 // frame_rate, 1000000 // frame_rate)
+        if camera_controls:
+            self.camera.set_controls(camera_controls)
+        time.sleep(0.1)
+
+    def read(self):
+        # Waits for the next frame and copies it out of the camera buffer, always into the same array
+        request = self.camera.capture_request()
+        try:
+            with self.__mapped_array(request, "main") as mapped:
+                if self.__frame is None or self.__frame.shape != mapped.array.shape:
+                    self.__frame = np.empty_like(mapped.array)
+                np.copyto(self.__frame, mapped.array)
+            # Exposure time of the frame, on the same monotonic clock as time.perf_counter()
+            sensor_timestamp = request.get_metadata().get("SensorTimestamp")
+        finally:
+            request.release()
+        return self.__frame, time.perf_counter() if sensor_timestamp is None else sensor_timestamp / 1e9
+
+    def pause(self):
+        # Stops the sensor, no frames are captured (and no CPU or memory bandwidth is used) until resume()
+        if self.running:
+            self.camera.stop()
+            self.running = False
+
+    def resume(self):
+        if not self.running:
+            self.camera.start()
+            self.running = True
+
+
+class FileFrameSource:
+    # A directory of PNGs (BGR, like cv2.imwrite saves them) or an .npy stack of frames, opened as a memmap
+    realtime = False
+
+    def __init__(self, path, loop=False):
+        self.loop = loop
+        self.__index = 0
+
+        if os.path.isdir(path):
+            self.__files = sorted(glob.glob(os.path.join(path, "*.png")))
+            self.__frames = None
+            self.length = len(self.__files)
+        else:
+            self.__files = None
+            self.__frames = np.load(path, mmap_mode="r")
+            self.length = len(self.__frames)
+
+    def read(self):
+        if self.__index >= self.length:
+            if not self.loop or self.length == 0:
+                return None, -1
+            self.__index = 0
+
+        if self.__files is not None:
+            frame = cv2.imread(self.__files[self.__index])
+        else:
+            frame = np.asarray(self.__frames[self.__index])
+        self.__index += 1
+
+        if frame.ndim == 3 and frame.shape[2] == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGBA)
+        return frame, time.perf_counter()
+
+
+class SyntheticFrameSource:
+    # A black line swinging across a light floor, with a green marker next to it every few frames and the red stop
+    # line at the end
+    realtime = False
+
+    def __init__(self, count=500, width=448, height=252, seed=0):
+        self.count = count
+        self.width = width
+        self.height = height
+        self.__random = np.random.default_rng(seed)
+        self.__index = 0
+
+    def read(self):
+        if self.__index >= self.count:
+            return None, -1
+
+        frame = np.full((self.height, self.width, 3), 190, dtype=np.uint8)
+        frame += self.__random.integers(0, 20, frame.shape, dtype=np.uint8)
+
+        phase = self.__index / 40
+        top_x = int(self.width / 2 + np.sin(phase) * self.width * .35)
+        bottom_x = int(self.width / 2 + np.sin(phase - .5) * self.width * .1)
+        points = np.array([[bottom_x, self.height], [(top_x + bottom_x) // 2, self.height // 2], [top_x, 0]], dtype=np.int32)
+        cv2.polylines(frame, [points], False, (15, 15, 15), 28)
+
+        if self.__index % 60 > 40:
+            # Crossing with a marker below it, on the right side every other time
+            crossing_y = int(self.height * .4)
+            marker_y = crossing_y + 55
+            line_x = (top_x + bottom_x) // 2 + int((bottom_x - (top_x + bottom_x) // 2) * (marker_y - self.height // 2) / (self.height // 2))
+            cv2.line(frame, (0, crossing_y), (self.width, crossing_y), (15, 15, 15), 28)
+            marker_x = line_x + 25 if self.__index % 120 > 60 else line_x - 85
+            cv2.rectangle(frame, (marker_x, crossing_y + 25), (marker_x + 60, crossing_y + 85), (40, 160, 40), -1)
+        if self.__index >= self.count - 10:
+            cv2.rectangle(frame, (0, int(self.height * .3)), (self.width, int(self.height * .3) + 40), (30, 30, 200), -1)
+
+        self.__index += 1
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGBA), time.perf_counter()
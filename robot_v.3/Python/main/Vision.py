@@ -0,0 +1,519 @@
+import ast
+import math
+import os
+import zipfile
+from collections import namedtuple
+
+import cv2
+import numpy as np
+import onnxruntime
+from numba import njit, prange
+
+
+@njit(cache=True)
+def classify_colors(bgr_image, channel_tables, color_table, shift, classes):
+    for y in range(bgr_image.shape[0]):
+        for x in range(bgr_image.shape[1]):
+            b, g, r = bgr_image[y, x, 0], bgr_image[y, x, 1], bgr_image[y, x, 2]
+            classes[y, x] = (channel_tables[0, b] & channel_tables[1, g] & channel_tables[2, r]) | color_table[b >> shift, g >> shift, r >> shift]
+    return classes
+
+
+@njit(cache=True)
+def marker_tiles_numba(bgr_image, color_table, shift, marker_bits, rows, cols, tile, tiles):
+    # Marks the tile of every grid sample with a marker color and the tiles around it, returns the number of hits
+    tiles[:] = False
+    hits = 0
+    for y in rows:
+        for x in cols:
+            if color_table[bgr_image[y, x, 0] >> shift, bgr_image[y, x, 1] >> shift, bgr_image[y, x, 2] >> shift] & marker_bits:
+                hits += 1
+                tile_y, tile_x = y // tile, x // tile
+                tiles[max(tile_y - 1, 0):tile_y + 2, max(tile_x - 1, 0):tile_x + 2] = True
+    return hits
+
+
+@njit(parallel=True, cache=True)
+def line_masks_numba(bgr_image, channel_tables, color_table, shift, bits, top_rows, ramp_rows, mean_rows, black_image, green_image, red_image, ramp_image):
+    # bits: black top, black bottom, black ramp down, green, red
+    black_rows = np.zeros(mean_rows, dtype=np.int64)
+    ramp_rows_sum = np.zeros(mean_rows, dtype=np.int64)
+
+    for y in prange(bgr_image.shape[0]):
+        black_bit = bits[0] if y < top_rows else bits[1]
+        for x in range(bgr_image.shape[1]):
+            b, g, r = bgr_image[y, x, 0], bgr_image[y, x, 1], bgr_image[y, x, 2]
+            classes = (channel_tables[0, b] & channel_tables[1, g] & channel_tables[2, r]) | color_table[b >> shift, g >> shift, r >> shift]
+            green = classes & bits[3] != 0
+
+            black = classes & black_bit != 0 and not green
+            black_image[y, x] = 255 if black else 0
+            green_image[y, x] = 255 if green else 0
+            red_image[y, x] = 255 if classes & bits[4] else 0
+
+            if y < ramp_rows:
+                ramp = classes & bits[2] != 0 and not green
+                ramp_image[y, x] = 255 if ramp else 0
+                if y < mean_rows:
+                    black_rows[y] += black
+                    ramp_rows_sum[y] += ramp
+
+    pixels = mean_rows * bgr_image.shape[1]
+    return black_rows.sum() * 255 / pixels, ramp_rows_sum.sum() * 255 / pixels
+
+
+@njit(parallel=True, cache=True)
+def black_masks_numba(bgr_image, channel_tables, bits, top_rows, ramp_rows, black_image, ramp_image, black_rows, ramp_rows_sum):
+    # line_masks_numba without green and red, marker_masks_numba adds them afterwards inside the marker tiles
+    mean_rows = black_rows.shape[0]
+    for y in prange(bgr_image.shape[0]):
+        black_bit = bits[0] if y < top_rows else bits[1]
+        for x in range(bgr_image.shape[1]):
+            b, g, r = bgr_image[y, x, 0], bgr_image[y, x, 1], bgr_image[y, x, 2]
+            classes = channel_tables[0, b] & channel_tables[1, g] & channel_tables[2, r]
+
+            black = classes & black_bit != 0
+            black_image[y, x] = 255 if black else 0
+
+            if y < ramp_rows:
+                ramp = classes & bits[2] != 0
+                ramp_image[y, x] = 255 if ramp else 0
+                if y < mean_rows:
+                    black_rows[y] += black
+                    ramp_rows_sum[y] += ramp
+
+
+@njit(cache=True)
+def marker_masks_numba(bgr_image, color_table, shift, bits, tile, tiles, black_image, green_image, red_image, ramp_image, black_rows, ramp_rows_sum):
+    # Green and red inside the marked tiles, green is removed from the black masks and their row counts
+    for tile_y, tile_x in zip(*np.nonzero(tiles)):
+        for y in range(tile_y * tile, min((tile_y + 1) * tile, bgr_image.shape[0])):
+            for x in range(tile_x * tile, min((tile_x + 1) * tile, bgr_image.shape[1])):
+                classes = color_table[bgr_image[y, x, 0] >> shift, bgr_image[y, x, 1] >> shift, bgr_image[y, x, 2] >> shift]
+                if classes & bits[4]:
+                    red_image[y, x] = 255
+                if classes & bits[3]:
+                    green_image[y, x] = 255
+                    if black_image[y, x]:
+                        black_image[y, x] = 0
+                        if y < black_rows.shape[0]:
+                            black_rows[y] -= 1
+                    if y < ramp_image.shape[0] and ramp_image[y, x]:
+                        ramp_image[y, x] = 0
+                        if y < ramp_rows_sum.shape[0]:
+                            ramp_rows_sum[y] -= 1
+
+
+class ColorLut:
+    # Maps every BGR pixel to a bitmask of color classes in one pass, instead of one inRange per threshold
+    # BGR ranges (the black thresholds) are exact, a pixel is in the range if every channel is, so one table per channel
+    # HSV ranges come from a levels^3 table over the BGR cube, decided by the HSV value of the center of each cell
+    # line_masks only classifies green and red in the tiles around the hits of a coarse grid (every third row / column
+    # and the outermost two), so every 3x3 block of a marker color (2x2 at the image border) is found, which is all
+    # the first erode of their noise reduction keeps. Single green pixels outside the tiles are not removed from black.
+    # For hold_frames frames after a hit the whole frame is classified
+    def __init__(self, shape, levels=64, tile=16, hold_frames=5):
+        self.shape = shape
+        self.levels = levels
+        self.tile = tile
+        self.hold_frames = hold_frames
+        self.bits = {}
+        self.full_frame = False
+        self.__shift = 8 - int(math.log2(levels))
+        self.__channel_tables = np.zeros((3, 256), np.uint16)
+        self.__color_table = np.zeros((levels, levels, levels), np.uint16)
+        self.__classes = np.zeros(shape, np.uint16)
+        self.__rows, self.__cols = (self.__grid(size) for size in shape)
+        self.tiles = np.zeros((-(-shape[0] // tile), -(-shape[1] // tile)), np.bool_)
+        self.__frames_since_seen = hold_frames + 1
+
+    @staticmethod
+    def __grid(size):
+        indices = np.arange(1, size, 3)
+        if indices[-1] < size - 2:
+            indices = np.append(indices, size - 1)
+        return indices
+
+    def build(self, bgr_ranges, hsv_ranges):
+        # bgr_ranges: {class: (min, max)}, hsv_ranges: {class: [(min, max), ...]}, the HSV class is the union of its ranges
+        if len(bgr_ranges) + len(hsv_ranges) > 16:
+            raise ValueError("ColorLut supports at most 16 classes")
+
+        bits = {}
+        channel_tables = np.zeros((3, 256), np.uint16)
+        values = np.arange(256)[None, :]
+        for name, (range_min, range_max) in bgr_ranges.items():
+            bits[name] = 1 << len(bits)
+            inside = (values >= np.array(range_min)[:, None]) & (values <= np.array(range_max)[:, None])
+            channel_tables |= np.where(inside, bits[name], 0).astype(np.uint16)
+
+        step = 256 // self.levels
+        centers = np.arange(self.levels, dtype=np.uint8) * step + step // 2
+        cube = np.stack(np.meshgrid(centers, centers, centers, indexing="ij"), axis=-1).reshape(self.levels, -1, 3)
+        hsv_cube = cv2.cvtColor(cube, cv2.COLOR_BGR2HSV)
+        color_table = np.zeros((self.levels, self.levels, self.levels), np.uint16)
+        for name, ranges in hsv_ranges.items():
+            bits[name] = 1 << len(bits)
+            inside = np.zeros(hsv_cube.shape[:2], bool)
+            for range_min, range_max in ranges:
+                inside |= cv2.inRange(hsv_cube, np.array(range_min), np.array(range_max)) > 0
+            color_table |= np.where(inside, bits[name], 0).astype(np.uint16).reshape(color_table.shape)
+
+        self.bits = bits
+        self.__channel_tables = channel_tables
+        self.__color_table = color_table
+
+    def classify(self, bgr_image):
+        # The returned array is reused by the next call
+        return classify_colors(bgr_image, self.__channel_tables, self.__color_table, self.__shift, self.__classes)
+
+    def mask(self, classes, name):
+        return cv2.compare(cv2.bitwise_and(classes, self.bits[name]), 0, cv2.CMP_GT)
+
+    def line_masks(self, bgr_image, black_top, black_bottom, top_rows, black_ramp, ramp_rows, mean_rows, green="green", red="red"):
+        # Black mask (black_top above top_rows, black_bottom below, green removed), green and red masks, the ramp down
+        # black mask of the top ramp_rows and the means of both black masks over the top mean_rows
+        black_image = np.empty(self.shape, np.uint8)
+        ramp_image = np.empty((ramp_rows, self.shape[1]), np.uint8)
+        bits = np.array([self.bits[black_top], self.bits[black_bottom], self.bits[black_ramp], self.bits[green], self.bits[red]], np.uint16)
+
+        hits = marker_tiles_numba(bgr_image, self.__color_table, self.__shift, bits[3] | bits[4], self.__rows, self.__cols, self.tile, self.tiles)
+        self.full_frame = self.__frames_since_seen <= self.hold_frames
+        self.__frames_since_seen = 0 if hits else self.__frames_since_seen + 1
+
+        if self.full_frame:
+            green_image = np.empty(self.shape, np.uint8)
+            red_image = np.empty(self.shape, np.uint8)
+            black_mean, ramp_mean = line_masks_numba(bgr_image, self.__channel_tables, self.__color_table, self.__shift, bits, top_rows, ramp_rows, mean_rows, black_image, green_image, red_image, ramp_image)
+            return black_image, green_image, red_image, ramp_image, black_mean, ramp_mean
+
+        green_image = np.zeros(self.shape, np.uint8)
+        red_image = np.zeros(self.shape, np.uint8)
+        black_rows = np.zeros(mean_rows, np.int64)
+        ramp_rows_sum = np.zeros(mean_rows, np.int64)
+        black_masks_numba(bgr_image, self.__channel_tables, bits, top_rows, ramp_rows, black_image, ramp_image, black_rows, ramp_rows_sum)
+        if hits:
+            marker_masks_numba(bgr_image, self.__color_table, self.__shift, bits, self.tile, self.tiles, black_image, green_image, red_image, ramp_image, black_rows, ramp_rows_sum)
+
+        pixels = mean_rows * self.shape[1]
+        return black_image, green_image, red_image, ramp_image, black_rows.sum() * 255 / pixels, ramp_rows_sum.sum() * 255 / pixels
+
+
+class SilverClassifier:
+    # The exported YOLO classifier straight through onnxruntime, preprocessed like ultralytics predict() does it:
+    # 4 channel frames are taken as BGRA, the center square is scaled to the model input, RGB in 0-1
+    def __init__(self, model_path, threads=2, silver_class=1):
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.__session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+
+        model_input = self.__session.get_inputs()[0]
+        self.__input_name = model_input.name
+        self.size = tuple(model_input.shape[2:4])  # height, width
+        self.silver_class = silver_class
+        self.__tensor = np.zeros((1, 3, *self.size), np.float32)
+        self.__resized = None
+
+    def predict(self, frame):
+        height, width = frame.shape[:2]
+        if self.size[0] == self.size[1]:
+            # ultralytics scales the short side to the input size and crops the center, here the same square is cut
+            # out first, at the offset the crop has after rounding the scaled long side
+            short, long = min(height, width), max(height, width)
+            scaled = int(self.size[0] * long / short)
+            offset = round(int(round((scaled - self.size[0]) / 2)) * long / scaled)
+            if width >= height:
+                frame = frame[:, offset:offset + short]
+            else:
+                frame = frame[offset:offset + short]
+
+        if self.__resized is None or self.__resized.shape[2] != frame.shape[2]:
+            self.__resized = np.empty((*self.size, frame.shape[2]), np.uint8)
+        cv2.resize(frame, self.size[::-1], dst=self.__resized, interpolation=cv2.INTER_AREA)
+        np.multiply(self.__resized[:, :, 2::-1].transpose(2, 0, 1), 1 / 255, out=self.__tensor[0])
+
+        probabilities = self.__session.run(None, {self.__input_name: self.__tensor})[0]
+        return float(probabilities[0, self.silver_class])
+
+
+class BallDetector:
+    # YOLO detector without ultralytics, the interpreter, the letterboxed image and the input tensor are allocated once
+    # .tflite models run with tflite_runtime (on the Edge TPU if the name ends in _edgetpu), .onnx with onnxruntime,
+    # so the same code can be tested off the robot
+    box_dtype = np.dtype([("x1", "f4"), ("y1", "f4"), ("x2", "f4"), ("y2", "f4"), ("cls", "i4"), ("conf", "f4")])
+
+    def __init__(self, model_path, image_size, conf=.3, iou=.2, agnostic=True, max_det=300, threads=2):
+        self.conf = conf
+        self.iou = iou
+        self.agnostic = agnostic
+        self.max_det = max_det
+
+        if model_path.endswith(".tflite"):
+            from tflite_runtime.interpreter import Interpreter, load_delegate  # only installed on the robot
+
+            delegates = [load_delegate("libedgetpu.so.1")] if os.path.splitext(model_path)[0].endswith("_edgetpu") else []
+            self.__interpreter = Interpreter(model_path, experimental_delegates=delegates, num_threads=threads)
+            self.__interpreter.allocate_tensors()
+            input_details = self.__interpreter.get_input_details()[0]
+            output_details = self.__interpreter.get_output_details()[0]
+            self.__input_index = input_details["index"]
+            self.__output_index = output_details["index"]
+            self.__output_quantization = output_details["quantization"] if output_details["dtype"] != np.float32 else None
+
+            _, height, width, _ = input_details["shape"]
+            self.__tensor = np.zeros(input_details["shape"], input_details["dtype"])
+            self.__channels_first = False
+            # Exported tflite models give the boxes relative to the input size
+            self.__box_scale = np.array([width, height, width, height], np.float32)
+            self.__session = None
+
+            # Pixel value to input value (cv2.LUT), quantized for int8 / uint8 inputs
+            self.__lut = np.arange(256, dtype=np.float32) / 255
+            if input_details["dtype"] != np.float32:
+                scale, zero_point = input_details["quantization"]
+                limits = np.iinfo(input_details["dtype"])
+                self.__lut = np.clip(np.rint(self.__lut / scale + zero_point), limits.min, limits.max)
+            self.__lut = self.__lut.astype(input_details["dtype"])
+
+            with zipfile.ZipFile(model_path) as model_zip:
+                self.names = ast.literal_eval(model_zip.read(model_zip.namelist()[0]).decode("utf-8"))["names"]
+        else:
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+            options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+            options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            self.__session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+
+            model_input = self.__session.get_inputs()[0]
+            self.__input_name = model_input.name
+            _, _, height, width = model_input.shape
+            self.__tensor = np.zeros((1, 3, height, width), np.float32)
+            self.__channels_first = True
+            self.__box_scale = None
+            self.__output_quantization = None
+            self.__lut = np.arange(256, dtype=np.float32) / 255
+
+            self.names = ast.literal_eval(self.__session.get_modelmeta().custom_metadata_map["names"])
+
+        self.input_size = (width, height)
+
+        # Letterbox like ultralytics: scaled to fit, centered, the border filled with 114
+        image_width, image_height = image_size
+        gain = min(height / image_height, width / image_width)
+        scaled_width, scaled_height = round(image_width * gain), round(image_height * gain)
+        self.__scaled_size = (scaled_width, scaled_height)
+        self.__gain = np.array([scaled_width / image_width, scaled_height / image_height] * 2, np.float32)
+        self.__pad_x, self.__pad_y = round((width - scaled_width) / 2 - .1), round((height - scaled_height) / 2 - .1)
+        self.__image_size = image_size
+
+        self.__letterbox = np.full((height, width, 3), 114, np.uint8)
+        self.__letterbox_inner = self.__letterbox[self.__pad_y:self.__pad_y + scaled_height, self.__pad_x:self.__pad_x + scaled_width]
+        self.__planes = [np.empty((height, width), np.uint8) for _ in range(3)]
+        self.__rgb = np.empty((height, width, 3), np.uint8)
+
+    def detect(self, image):
+        # BGR image of image_size -> structured array of box_dtype, best first
+        cv2.resize(image, self.__scaled_size, dst=self.__letterbox_inner, interpolation=cv2.INTER_LINEAR)
+        if self.__channels_first:
+            cv2.split(self.__letterbox, self.__planes)
+            for channel, plane in enumerate(reversed(self.__planes)):  # BGR to RGB
+                cv2.LUT(plane, self.__lut, dst=self.__tensor[0, channel])
+        else:
+            cv2.cvtColor(self.__letterbox, cv2.COLOR_BGR2RGB, dst=self.__rgb)
+            cv2.LUT(self.__rgb, self.__lut, dst=self.__tensor[0])
+
+        if self.__session is not None:
+            prediction = self.__session.run(None, {self.__input_name: self.__tensor})[0][0]
+        else:
+            self.__interpreter.set_tensor(self.__input_index, self.__tensor)
+            self.__interpreter.invoke()
+            prediction = self.__interpreter.get_tensor(self.__output_index)[0]
+
+        if self.__output_quantization is not None:
+            scale, zero_point = self.__output_quantization
+            prediction = (prediction.astype(np.float32) - zero_point) * scale
+
+        return self.__postprocess(prediction)
+
+    def __postprocess(self, prediction):
+        # prediction: (4 + classes, anchors) with center x, center y, width, height and the class scores
+        scores = prediction[4:]
+        classes = scores.argmax(0)
+        confidences = scores[classes, np.arange(scores.shape[1])]
+        candidates = np.flatnonzero(confidences > self.conf)
+
+        detections = np.zeros(0, self.box_dtype)
+        if len(candidates) == 0:
+            return detections
+
+        order = candidates[np.argsort(-confidences[candidates], kind="stable")]
+        xywh = prediction[:4, order].T
+        if self.__box_scale is not None:
+            xywh = xywh * self.__box_scale
+        boxes = np.concatenate((xywh[:, :2] - xywh[:, 2:] / 2, xywh[:, :2] + xywh[:, 2:] / 2), 1)
+        classes, confidences = classes[order], confidences[order]
+
+        keep = self.__nms(boxes, None if self.agnostic else classes)
+
+        boxes = (boxes[keep] - [self.__pad_x, self.__pad_y, self.__pad_x, self.__pad_y]) / self.__gain
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, self.__image_size[0])
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, self.__image_size[1])
+
+        detections = np.zeros(len(keep), self.box_dtype)
+        detections["x1"], detections["y1"], detections["x2"], detections["y2"] = boxes.T
+        detections["cls"] = classes[keep]
+        detections["conf"] = confidences[keep]
+        return detections
+
+    def __nms(self, boxes, classes=None):
+        # Greedy suppression on boxes sorted by confidence, each kept box removes all its overlaps at once
+        # Without classes (agnostic) a box also suppresses boxes of the other classes
+        areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+        remaining = np.arange(len(boxes))
+        keep = []
+
+        while len(remaining) > 0 and len(keep) < self.max_det:
+            index, remaining = remaining[0], remaining[1:]
+            keep.append(index)
+
+            top_left = np.maximum(boxes[index, :2], boxes[remaining, :2])
+            bottom_right = np.minimum(boxes[index, 2:], boxes[remaining, 2:])
+            intersections = np.prod((bottom_right - top_left).clip(0), 1)
+            overlapping = intersections > self.iou * (areas[index] + areas[remaining] - intersections)
+            if classes is not None:
+                overlapping &= classes[remaining] == classes[index]
+            remaining = remaining[~overlapping]
+        return np.array(keep, int)
+
+
+BallTarget = namedtuple("BallTarget", ["id", "x", "y", "width", "height", "velocity_x", "cls"])
+
+
+class BallTracker:
+    # Follows the balls between detector runs, a constant velocity Kalman filter per ball over the box center and size
+    # (x, y, width, height and their velocities) with greedy IoU association of the detections to the predicted boxes
+    # The target keeps its id while its track lives, only once it is lost the biggest confirmed ball becomes the target
+    def __init__(self, classes, iou=.1, max_age=.5, min_hits=2, measurement_noise=4., acceleration_noise=400., velocity_noise=300.):
+        self.iou = iou
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self.acceleration_noise = acceleration_noise
+
+        self.ids = np.zeros(0, np.int64)
+        self.states = np.zeros((0, 8))
+        self.covariances = np.zeros((0, 8, 8))
+        self.hits = np.zeros(0, np.int64)
+        self.last_seen = np.zeros(0)
+        self.votes = np.zeros((0, classes))  # summed confidence per class, the class of a track is the one with most
+
+        self.target_id = -1
+        self.target = None
+
+        self.__time = None
+        self.__next_id = 0
+        self.__measurement_covariance = np.eye(4) * measurement_noise ** 2
+        self.__initial_covariance = np.diag([measurement_noise ** 2] * 4 + [velocity_noise ** 2] * 4)
+
+    def predict(self, frame_time):
+        # Moves all tracks to frame_time without a detection and returns the target there
+        self.__advance(frame_time)
+        return self.__select_target()
+
+    def update(self, detections, frame_time):
+        # detections: structured array of BallDetector.box_dtype from the frame captured at frame_time
+        self.__advance(frame_time)
+
+        boxes = np.stack((detections["x1"], detections["y1"], detections["x2"], detections["y2"]), 1).astype(np.float64)
+        measurements = np.concatenate(((boxes[:, :2] + boxes[:, 2:]) / 2, boxes[:, 2:] - boxes[:, :2]), 1)
+
+        tracks, matched = self.__associate(boxes)
+        if len(tracks) > 0:
+            # Kalman update of all matched tracks at once, only x, y, width and height are measured
+            covariances = self.covariances[tracks]
+            innovation_covariances = covariances[:, :4, :4] + self.__measurement_covariance
+            gains = covariances[:, :, :4] @ np.linalg.inv(innovation_covariances)
+            innovations = measurements[matched] - self.states[tracks, :4]
+            self.states[tracks] += (gains @ innovations[:, :, None])[:, :, 0]
+            self.covariances[tracks] = covariances - gains @ covariances[:, :4, :]
+
+            self.hits[tracks] += 1
+            self.last_seen[tracks] = frame_time
+            self.votes[tracks, detections["cls"][matched]] += detections["conf"][matched]
+
+        new = np.setdiff1d(np.arange(len(detections)), matched)
+        if len(new) > 0:
+            self.ids = np.concatenate((self.ids, np.arange(self.__next_id, self.__next_id + len(new))))
+            self.__next_id += len(new)
+            self.states = np.concatenate((self.states, np.concatenate((measurements[new], np.zeros((len(new), 4))), 1)))
+            self.covariances = np.concatenate((self.covariances, np.repeat(self.__initial_covariance[None], len(new), 0)))
+            self.hits = np.concatenate((self.hits, np.ones(len(new), np.int64)))
+            self.last_seen = np.concatenate((self.last_seen, np.full(len(new), frame_time)))
+            votes = np.zeros((len(new), self.votes.shape[1]))
+            votes[np.arange(len(new)), detections["cls"][new]] = detections["conf"][new]
+            self.votes = np.concatenate((self.votes, votes))
+
+        return self.__select_target()
+
+    def __advance(self, frame_time):
+        dt = 0 if self.__time is None else max(frame_time - self.__time, 0)
+        self.__time = frame_time
+
+        # Tracks that were not seen for too long are dropped before they could take a new detection
+        alive = frame_time - self.last_seen <= self.max_age
+        if not alive.all():
+            self.ids, self.states, self.covariances = self.ids[alive], self.states[alive], self.covariances[alive]
+            self.hits, self.last_seen, self.votes = self.hits[alive], self.last_seen[alive], self.votes[alive]
+
+        if dt == 0 or len(self.ids) == 0:
+            return
+
+        transition = np.eye(8)
+        transition[:4, 4:] = np.eye(4) * dt
+        # Random acceleration between the frames
+        noise = np.kron(np.array([[dt ** 4 / 4, dt ** 3 / 2], [dt ** 3 / 2, dt ** 2]]), np.eye(4)) * self.acceleration_noise ** 2
+
+        self.states = self.states @ transition.T
+        self.states[:, 2:4] = self.states[:, 2:4].clip(1)
+        self.covariances = transition @ self.covariances @ transition.T + noise
+
+    def __associate(self, boxes):
+        # Greedy: the pair with the highest IoU first, until no pair overlaps by more than iou
+        if len(self.ids) == 0 or len(boxes) == 0:
+            return np.zeros(0, np.int64), np.zeros(0, np.int64)
+
+        predicted = np.concatenate((self.states[:, :2] - self.states[:, 2:4] / 2, self.states[:, :2] + self.states[:, 2:4] / 2), 1)
+        top_left = np.maximum(predicted[:, None, :2], boxes[None, :, :2])
+        bottom_right = np.minimum(predicted[:, None, 2:], boxes[None, :, 2:])
+        intersections = np.prod((bottom_right - top_left).clip(0), 2)
+        areas = np.prod(predicted[:, 2:] - predicted[:, :2], 1)[:, None] + np.prod(boxes[:, 2:] - boxes[:, :2], 1)[None, :]
+        ious = intersections / np.maximum(areas - intersections, 1e-9)
+
+        tracks, matched = [], []
+        for track, detection in zip(*np.unravel_index(np.argsort(-ious, None), ious.shape)):
+            if ious[track, detection] <= self.iou:
+                break
+            if track not in tracks and detection not in matched:
+                tracks.append(track)
+                matched.append(detection)
+        return np.array(tracks, np.int64), np.array(matched, np.int64)
+
+    def __select_target(self):
+        confirmed = self.hits >= self.min_hits
+        index = np.flatnonzero(confirmed & (self.ids == self.target_id))
+        if len(index) == 0:
+            if not confirmed.any():
+                self.target_id = -1
+                self.target = None
+                return None
+            index = np.flatnonzero(confirmed)[np.argmax(np.prod(self.states[confirmed, 2:4], 1))]
+        else:
+            index = index[0]
+
+        self.target_id = int(self.ids[index])
+        x, y, width, height, velocity_x = self.states[index, :5]
+        self.target = BallTarget(self.target_id, x, y, width, height, velocity_x, int(np.argmax(self.votes[index])))
+        return self.target
@@ -1,9 +1,11 @@
 import random
+from collections import deque, namedtuple
+from enum import Enum
 from math import isclose, pow
 
 from gpiozero import Button, LED, PWMLED
 
-from Managers import Timer
+from Managers import ControlScheduler, PidController, StateMachine, Timer
 from line_cam import camera_x, camera_y
 from mp_manager import *
 
@@ -15,6 +17,19 @@ wait_time_red = 9
 
 max_turn_angle = 110
 
+# mm/s driving straight at speed 1, not measured yet, only scales the commanded distances of the motion primitives
+full_speed = config_manager.read_variable('motion', 'full_speed')
+
+# Line following: feed forward of line_angle plus a PID on it, turning on the spot (|angle| > max_turn_angle) stays as it is
+# The shipped line gains are 0 (line_kff = 1 only), so the line PID is disabled and steering follows line_angle as before
+# until line_kp / line_ki / line_kd are tuned on the robot with line_pid.csv
+# Turns: a PID on the angle left to turn gives the speed of turn_to_angle
+gains = config_manager.read_section('control')
+line_controller = PidController(gains['line_kp'], gains['line_ki'], gains['line_kd'], gains['line_kff'], max_turn_angle, gains['line_integral_limit'], gains['line_d_filter'])
+line_pid_enabled = any(gains[gain] != 0 for gain in ('line_kp', 'line_ki', 'line_kd'))
+heading_controller = PidController(gains['heading_kp'], gains['heading_ki'], gains['heading_kd'], limit=1, integral_limit=gains['heading_integral_limit'])
+heading_min_speed = gains['heading_min_speed']
+
 last_turn_dir = "l"
 
 obstacle_dir = ["l", "r"]
@@ -51,6 +66,35 @@ time_victim_type = empty_time_arr(1200)
 
 timer = Timer()
 
+# wakes the loops below on new camera frames / sensor values, at the latest every 1 / 60 s
+scheduler = ControlScheduler(state, 1 / 60)
+
+
+# values of line_status / zone_status
+class LineState(Enum):
+    LINE_DETECTED = "line_detected"
+    GAP_DETECTED = "gap_detected"
+    GAP_AVOID = "gap_avoid"
+    OBSTACLE_DETECTED = "obstacle_detected"
+    OBSTACLE_AVOID = "obstacle_avoid"
+    OBSTACLE_ORIENTATE = "obstacle_orientate"
+    CHECK_SILVER = "check_silver"
+    POSITION_ENTRY = "position_entry"
+    POSITION_ENTRY_1 = "position_entry_1"
+    POSITION_ENTRY_2 = "position_entry_2"
+    STOP = "stop"
+
+
+class ZoneState(Enum):
+    BEGIN = "begin"
+    FIND_BALLS = "find_balls"
+    PICKUP_BALL = "pickup_ball"
+    DEPOSIT_GREEN = "deposit_green"
+    DEPOSIT_RED = "deposit_red"
+    EXIT = "exit"
+    CHECK_SILVER = "check_silver"
+    GET_EXIT_ANGLE = "get_exit_angle"
+
 run = True
 zone_done = False
 dumped_alive_victims = False
@@ -88,6 +132,10 @@ def switch_lights(light_on):
 
 
 def servo_pos(pos):
+    return run_maneuver(servo_pos_steps(pos), "servo_pos")
+
+
+def servo_pos_steps(pos):
     servo_states = ["lower arm", "raise arm left", "raise arm right", "open gate 1", "close gate 1", "open gate 2", "close gate 2"]
     print(f"Servo position: {servo_states[pos - 1]}")
     # lower arm
@@ -127,8 +175,10 @@ def servo_pos(pos):
         servo_3.on()
 
     servo_control.off()
-    time.sleep(0.4)
-    servo_control.on()
+    try:
+        yield from pause(.4)
+    finally:
+        servo_control.on()
 
 
 def steer(angle=190., speed=0.8):
@@ -192,37 +242,40 @@ def program_continue():
     return switch.value and not terminate.value
 
 
-def update_sensor_average():
+def update_sensor_average(frame=None):
     global time_sensor_one, time_sensor_two, time_sensor_three, time_sensor_four, time_sensor_five, time_sensor_six, time_sensor_seven, time_last_gyro_y, time_last_gyro_x, time_last_gyro_z, time_silver_detected, time_silver_angle, time_victim_type, time_line_similarity, time_zone_similarity, last_update_time, time_exit_angle
 
     if time.perf_counter() - last_update_time > 1 / 90:
-        if sensor_one.value > 25 or objective.value == "zone":
-            time_sensor_one = add_time_value(time_sensor_one, sensor_one.value)
-        if sensor_two.value > 25 or objective.value == "zone":
-            time_sensor_two = add_time_value(time_sensor_two, sensor_two.value)
-        time_sensor_three = add_time_value(time_sensor_three, sensor_three.value)
-        time_sensor_four = add_time_value(time_sensor_four, sensor_four.value)
-        if sensor_five.value > 25 or objective.value == "zone":
-            time_sensor_five = add_time_value(time_sensor_five, sensor_five.value)
-        time_sensor_six = add_time_value(time_sensor_six, sensor_six.value)
-        time_sensor_seven = add_time_value(time_sensor_seven, sensor_seven.value)
-
-        time_last_gyro_y = add_time_value(time_last_gyro_y, sensor_y.value)
-        time_last_gyro_x = add_time_value(time_last_gyro_x, sensor_x.value)
-        time_last_gyro_z = add_time_value(time_last_gyro_z, sensor_z.value)
-
-        time_silver_detected = add_time_value(time_silver_detected, silver_value.value)
-
-        time_silver_angle = add_time_value(time_silver_angle, silver_angle.value)
-        time_exit_angle = add_time_value(time_exit_angle, exit_angle.value)
-
-        if ball_type.value == 'silver ball':
+        if frame is None:
+            frame = snapshot()
+
+        if frame.sensor_one > 25 or frame.objective == "zone":
+            time_sensor_one = add_time_value(time_sensor_one, frame.sensor_one)
+        if frame.sensor_two > 25 or frame.objective == "zone":
+            time_sensor_two = add_time_value(time_sensor_two, frame.sensor_two)
+        time_sensor_three = add_time_value(time_sensor_three, frame.sensor_three)
+        time_sensor_four = add_time_value(time_sensor_four, frame.sensor_four)
+        if frame.sensor_five > 25 or frame.objective == "zone":
+            time_sensor_five = add_time_value(time_sensor_five, frame.sensor_five)
+        time_sensor_six = add_time_value(time_sensor_six, frame.sensor_six)
+        time_sensor_seven = add_time_value(time_sensor_seven, frame.sensor_seven)
+
+        time_last_gyro_y = add_time_value(time_last_gyro_y, frame.sensor_y)
+        time_last_gyro_x = add_time_value(time_last_gyro_x, frame.sensor_x)
+        time_last_gyro_z = add_time_value(time_last_gyro_z, frame.sensor_z)
+
+        time_silver_detected = add_time_value(time_silver_detected, frame.silver_value)
+
+        time_silver_angle = add_time_value(time_silver_angle, frame.silver_angle)
+        time_exit_angle = add_time_value(time_exit_angle, frame.exit_angle)
+
+        if frame.ball_type == 'silver ball':
             time_victim_type = add_time_value(time_victim_type, 1)
-        elif ball_type.value == 'black ball':
+        elif frame.ball_type == 'black ball':
             time_victim_type = add_time_value(time_victim_type, 0)
 
-        time_line_similarity = add_time_value(time_line_similarity, line_similarity.value)
-        time_zone_similarity = add_time_value(time_zone_similarity, zone_similarity.value)
+        time_line_similarity = add_time_value(time_line_similarity, frame.line_similarity)
+        time_zone_similarity = add_time_value(time_zone_similarity, frame.zone_similarity)
         zone_similarity_average.value = round(get_time_average(time_zone_similarity, 15), 2)
 
         last_update_time = time.perf_counter()
@@ -258,6 +311,7 @@ def get_rotation():
 
 
 def get_speed(angle):
+    # angle: the steering angle the line controller commands, the tiers slow down by how hard it steers, not by line_angle
     if rotation_y.value == "ramp_up":
         if abs(angle) > max_turn_angle:
             if not timer.get_timer("stuck_detected"):
@@ -297,6 +351,112 @@ def get_speed(angle):
     return 1
 
 
+def run_maneuver(maneuver, name):
+    # Runs a maneuver to its end, for the callers outside of the state machines
+    while True:
+        try:
+            wake = next(maneuver)
+        except StopIteration as stop:
+            return stop.value
+        scheduler.wait(wake, name)
+
+
+def pause(duration):
+    # time.sleep for maneuvers, control_loop keeps running while it waits
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        yield end
+
+
+# Motion primitives are maneuvers too. They end after their time, when their event comes or when the button is released,
+# leave the motors running for the next step and keep what they actually did in motions (written to motions.csv)
+Motion = namedtuple("Motion", ["start", "name", "angle", "speed", "planned", "reason", "duration", "commanded", "turned"])
+motions = deque(maxlen=10000)
+
+
+def commanded_distance(angle, speed, duration):
+    # Commanded speed times time in mm from the wheel speeds steer() sets, not a measured distance, turning on the spot counts as 0
+    speed = min(speed, 1)
+    if angle == 200:
+        return -full_speed * speed * duration
+    elif angle == 190 or abs(angle) > max_turn_angle:
+        return 0.
+    return full_speed * speed * min((1 + (max_turn_angle - abs(angle)) / (max_turn_angle - 1)) / 2, 1) * duration
+
+
+def record_motion(name, angle, speed, planned, reason, start_time, start_heading):
+    duration = time.perf_counter() - start_time
+    motion = Motion(start_time, name, angle, speed, planned, reason, duration, commanded_distance(angle, speed, duration), (sensor_x.value - start_heading + 540) % 360 - 180)
+    motions.append(motion)
+    return motion
+
+
+def drive_until(event, angle, speed, timeout, name="drive_until", wake=("line", "distance")):
+    # steer(angle, speed) until event() is true or timeout has passed
+    start_time = time.perf_counter()
+    start_heading = sensor_x.value
+    end = start_time + timeout
+    wake = wake + (end,) if event is not None else end
+
+    steer(angle, speed)
+    reason = "cancelled"
+    try:
+        while True:
+            if event is not None and event():
+                reason = "event"
+                break
+            elif time.perf_counter() >= end:
+                reason = "time"
+                break
+            elif not program_continue():
+                reason = "stopped"
+                break
+            yield wake
+    finally:
+        motion = record_motion(name, angle, speed, timeout, reason, start_time, start_heading)
+
+    return motion
+
+
+def drive_for(angle, speed, duration, cancel=None, name="drive_for"):
+    # steer(angle, speed) for duration, unless cancel() gets true before
+    return (yield from drive_until(cancel, angle, speed, duration, name))
+
+
+def turn_by(angle, cancel=None, name="turn_by", **turn_options):
+    # Turns angle degrees (positive to the right) with turn_to_angle, stops when cancel() gets true
+    start_time = time.perf_counter()
+    start_heading = sensor_x.value
+    turn = turn_to_angle_steps(add_angle(start_heading, angle), direction="r" if angle > 0 else "l", **turn_options)
+
+    reason = "cancelled"
+    try:
+        while True:
+            if cancel is not None and cancel():
+                turn.close()
+                steer()
+                reason = "event"
+                break
+
+            try:
+                wake = next(turn)
+            except StopIteration as stop:
+                reason = "angle" if stop.value == "none" else stop.value or "stopped"
+                break
+            yield wake
+    finally:
+        motion = record_motion(name, 180 if angle > 0 else -180, turn_options.get("speed", 0), angle, reason, start_time, start_heading)
+
+    return motion
+
+
+def dump_motions(path):
+    with open(path, "w") as dump_file:
+        dump_file.write("time,name,angle,speed,planned,reason,duration_s,commanded_mm,turned_deg\n")
+        for motion in motions:
+            dump_file.write(f"{motion.start:.3f},{motion.name},{motion.angle},{motion.speed},{motion.planned},{motion.reason},{motion.duration:.3f},{motion.commanded:.0f},{motion.turned:.1f}\n")
+
+
 def add_angle(angle, addition):
     return (angle + addition) % 360
 
@@ -305,76 +465,87 @@ def sub_angle(angle, subtraction):
     return (angle - subtraction) % 360
 
 
-def turn_to_angle(angle, tolerance=1.5, stop_on_black=False, stop_on_victim=False, direction="n", speed=0, correct_overturn=True, stop_on_corner=False):
+def turn_to_angle(*args, **kwargs):
+    return run_maneuver(turn_to_angle_steps(*args, **kwargs), "turn_to_angle")
+
+
+def turn_to_angle_steps(angle, tolerance=1.5, stop_on_black=False, stop_on_victim=False, direction="n", speed=0, correct_overturn=True, stop_on_corner=False):
     global time_last_gyro_x
 
     start_angle = sensor_x.value
     last_angle = 400
     timer.set_timer("detect_stuck", 1.5)
-    while abs((angle - sensor_x.value + 540) % 360 - 180) > tolerance:
-        update_sensor_average()
+    heading_controller.reset()
+    while True:
+        frame = snapshot()
+        if abs((angle - frame.sensor_x + 540) % 360 - 180) <= tolerance:
+            break
+
+        update_sensor_average(frame)
 
         if direction == "n":
-            angle_to_turn = (angle - sensor_x.value + 540) % 360 - 180
+            angle_to_turn = (angle - frame.sensor_x + 540) % 360 - 180
         elif direction == "r":
-            angle_to_turn = (angle - sensor_x.value) % 360
+            angle_to_turn = (angle - frame.sensor_x) % 360
             if last_angle < (angle_to_turn - 10):
                 direction = "n"
         elif direction == "l":
-            angle_to_turn = (angle - sensor_x.value) % -360
+            angle_to_turn = (angle - frame.sensor_x) % -360
             if -last_angle > (angle_to_turn + 10):
                 direction = "n"
 
         turn_direction = 180 if angle_to_turn > 0 else -180
 
         if angle_to_turn <= 0 and turn_direction == 180:
-            time.sleep(.2)
+            yield from pause(.2)
             turn_direction = -180
         elif angle_to_turn > 0 and turn_direction == -180:
-            time.sleep(.2)
+            yield from pause(.2)
             turn_direction = 180
 
         if speed == 0:
-            steer(turn_direction, max(1 - pow(abs(abs(angle_to_turn) / 360 - 1), 7), 0.4))
+            steer(turn_direction, max(abs(heading_controller.update(angle_to_turn, frame.pose_time)), heading_min_speed))
         else:
             steer(turn_direction, speed)
 
         last_angle = abs(angle_to_turn)
 
         # if stuck
-        if isclose(get_time_average(time_last_gyro_x, .5), sensor_x.value, abs_tol=.5) and not get_time_average(time_last_gyro_x, 1) == -1 and abs((angle - sensor_x.value + 540) % 360 - 180) > 20 and timer.get_timer("detect_stuck"):
+        if isclose(get_time_average(time_last_gyro_x, .5), frame.sensor_x, abs_tol=.5) and not get_time_average(time_last_gyro_x, 1) == -1 and abs((angle - frame.sensor_x + 540) % 360 - 180) > 20 and timer.get_timer("detect_stuck"):
             steer(-turn_direction, .9)
-            time.sleep(.5)
+            yield from pause(.5)
             steer(turn_direction, .9)
-            time.sleep(.8)
+            yield from pause(.8)
             steer()
 
             timer.set_timer("detect_stuck", 2)
 
-        if stop_on_black and line_detected.value:
+        if stop_on_black and frame.line_detected:
             steer()
             return "black"
 
-        if stop_on_victim and ball_type.value != "none":
+        if stop_on_victim and frame.ball_type != "none":
             steer()
             return "victim"
 
-        if stop_on_corner and corner_distance.value != -181:
+        if stop_on_corner and frame.corner_distance != -181:
             steer()
             return "corner"
 
-        if not correct_overturn and abs((angle - sensor_x.value + 540) % 360 - 180) < (2 * tolerance):
+        if not correct_overturn and abs((angle - frame.sensor_x + 540) % 360 - 180) < (2 * tolerance):
             steer()
             return "none"
 
         if not program_continue():
             return
 
+        yield ("pose", "line", "zone", "corner")
+
     steer()
     return "none"
 
 
-def turn_360(speed=0.6, stop_when_victim=False, stop_when_corner=False):
+def turn_360_steps(speed=0.6, stop_when_victim=False, stop_when_corner=False):
     timer.set_timer("turn_360_stuck", 15)
     for _ in range(2):
         current_angle = (sensor_x.value - 3) % 360
@@ -390,17 +561,23 @@ def turn_360(speed=0.6, stop_when_victim=False, stop_when_corner=False):
                 return True
 
             if zone_stuck_detected() or timer.get_timer("turn_360_stuck"):
-                avoid_stuck_zone()
+                yield from avoid_stuck_zone_steps()
                 return False
 
             steer(180, speed)
 
+            yield ("pose", "zone", "corner")
+
     steer()
     if stop_when_victim or stop_when_corner:
         return False
 
 
-def drive_until_wall(time_to_drive, speed=0.65, stop_when_wall=True, stop_when_near_wall=False, stop_when_near_corner=False, stop_when_corner=False, stop_when_black=False, stop_when_silver=False, stop_when_victim=False, stop_when_exit=False, exit_cooldown_time=0, return_driven_time=False, drift=0):
+def drive_until_wall(*args, **kwargs):
+    return run_maneuver(drive_until_wall_steps(*args, **kwargs), "drive_until_wall")
+
+
+def drive_until_wall_steps(time_to_drive, speed=0.65, stop_when_wall=True, stop_when_near_wall=False, stop_when_near_corner=False, stop_when_corner=False, stop_when_black=False, stop_when_silver=False, stop_when_victim=False, stop_when_exit=False, exit_cooldown_time=0, return_driven_time=False, drift=0):
     global time_sensor_four
 
     corner_distance.value = -181
@@ -411,7 +588,8 @@ def drive_until_wall(time_to_drive, speed=0.65, stop_when_wall=True, stop_when_n
 
     reason = "none"
     while not timer.get_timer("drive_until_wall"):
-        update_sensor_average()
+        frame = snapshot()
+        update_sensor_average(frame)
         steer(drift, speed)
 
         if stop_when_wall and wall_detected():
@@ -423,16 +601,16 @@ def drive_until_wall(time_to_drive, speed=0.65, stop_when_wall=True, stop_when_n
         if stop_when_near_corner and get_time_average(time_sensor_five, 0.25) < 350:
             reason = "near_corner"
 
-        if stop_when_corner and (zone_found_green.value or zone_found_red.value):
+        if stop_when_corner and (frame.zone_found_green or frame.zone_found_red):
             reason = "corner"
 
-        if stop_when_black and zone_found_black.value:
+        if stop_when_black and frame.zone_found_black:
             reason = "black"
 
         if stop_when_silver and silver_detected() and False:
             reason = "silver"
 
-        if stop_when_victim and ball_type.value != "none":
+        if stop_when_victim and frame.ball_type != "none":
             reason = "ball"
 
         if timer.get_timer("exit_cooldown"):
@@ -444,33 +622,35 @@ def drive_until_wall(time_to_drive, speed=0.65, stop_when_wall=True, stop_when_n
         if not program_continue() or not reason == "none":
             break
 
+        yield ("distance", "line", "zone")
+
     steer()
 
     return reason if not return_driven_time else (reason, time.perf_counter() - start_time)
 
 
-def drive_back_until_line(max_time, speed=.7):
+def drive_back_until_line_steps(max_time, speed=.7):
 
     timer.set_timer("find_line_again", max_time)
     while not line_detected.value and not timer.get_timer("find_line_again"):
         steer(200, speed)
-        time.sleep(.001)
+        yield ("line",)
     min_line_size.value = 3000
 
     steer(0, .7)
-    time.sleep(.2)
+    yield from pause(.2)
     steer()
 
     return line_detected.value
 
 
-def ensure_line_detected():
-    time.sleep(.25)
+def ensure_line_detected_steps():
+    yield from pause(.25)
     if not line_detected.value:
         steer(200, .7)
-        time.sleep(.15)
+        yield from pause(.15)
         steer()
-        time.sleep(.1)
+        yield from pause(.1)
 
         if not line_detected.value:
             return False
@@ -478,34 +658,34 @@ def ensure_line_detected():
     return True
 
 
-def orientate_gap():
+def orientate_gap_steps():
     update_sensor_average()
     if (not line_detected.value or line_detected.value and line_size.value < 17000) and not silver_detected():
         status.value = f'Validating gap'
 
         steer(200, .7)
-        time.sleep(.15)
+        yield from pause(.15)
         steer()
-        time.sleep(.2)
+        yield from pause(.2)
 
         update_sensor_average()
         if silver_detected():
             steer(0, .7)
-            time.sleep(.15)
+            yield from pause(.15)
             steer()
-            time.sleep(.2)
+            yield from pause(.2)
             return False
 
         if obstacle_detected():
             return False
 
         steer(200, .7)
-        time.sleep(.3)
+        yield from pause(.3)
         if not line_detected.value:
-            time.sleep(.2)
+            yield from pause(.2)
 
         steer(0, .7)
-        time.sleep(.25)
+        yield from pause(.25)
         steer()
 
     update_sensor_average()
@@ -543,17 +723,17 @@ def orientate_gap():
 
             if not (0 >= angle > -1 or angle > 179):
                 steer(0, .7)
-                time.sleep(time_foreward)
+                yield from pause(time_foreward)
 
                 if not program_continue():
                     return False
 
                 if angle > 0:
                     steer(180, .65)
-                    time.sleep(abs(.9 - .85 * ((angle - 90) / 90)))
+                    yield from pause(abs(.9 - .85 * ((angle - 90) / 90)))
                 else:
                     steer(-180, .65)
-                    time.sleep(abs(.05 + .85 * abs(-angle / 90)))
+                    yield from pause(abs(.05 + .85 * abs(-angle / 90)))
 
                 steer()
 
@@ -562,18 +742,18 @@ def orientate_gap():
 
                 min_line_size.value = 9000
                 steer(200, .7)
-                time.sleep(time_foreward + np.clip(((time_foreward - .25) / .4) * .15, 0, .15))
+                yield from pause(time_foreward + np.clip(((time_foreward - .25) / .4) * .15, 0, .15))
 
-                if not drive_back_until_line(.6, .7):
+                if not (yield from drive_back_until_line_steps(.6, .7)):
                     return False
 
                 if line_size.value > 17000:
                     steer(200, .7)
-                    time.sleep(.2)
+                    yield from pause(.2)
                     steer()
                     return False
 
-            if not ensure_line_detected() or not program_continue():
+            if not (yield from ensure_line_detected_steps()) or not program_continue():
                 return False
 
             angle = gap_angle.value
@@ -584,41 +764,41 @@ def orientate_gap():
 
             if abs(x_gap) > 55:
                 steer(180 if x_gap > 0 else -180, .6)
-                time.sleep(.4)
+                yield from pause(.4)
                 steer()
-                time.sleep(.2)
+                yield from pause(.2)
 
                 time_foreward = .35 + .35 * ((abs(x_gap) - 55) / 100)
 
                 steer(0, .7)
-                time.sleep(time_foreward)
+                yield from pause(time_foreward)
                 steer()
 
                 if not program_continue():
                     return False
 
                 steer(-180 if x_gap > 0 else 180, .6)
-                time.sleep(.3)
+                yield from pause(.3)
                 steer()
-                time.sleep(.2)
+                yield from pause(.2)
 
                 if not program_continue():
                     return False
 
                 min_line_size.value = 9000
                 steer(200, .7)
-                time.sleep(time_foreward + np.clip(((time_foreward - .35) / .35) * .2, 0, .2))
+                yield from pause(time_foreward + np.clip(((time_foreward - .35) / .35) * .2, 0, .2))
 
-                if not drive_back_until_line(.5, .7):
+                if not (yield from drive_back_until_line_steps(.5, .7)):
                     return False
 
                 if line_size.value > 17000:
                     steer(200, .7)
-                    time.sleep(.2)
+                    yield from pause(.2)
                     steer()
                     return False
 
-                if not ensure_line_detected() or not program_continue():
+                if not (yield from ensure_line_detected_steps()) or not program_continue():
                     return False
 
                 angle = gap_angle.value
@@ -636,17 +816,17 @@ def orientate_gap():
             correction_counter += 1
 
         status.value = f'Gap orientated'
-        line_status.value = "gap_avoid"
+        line_machine.goto(LineState.GAP_AVOID)
         min_line_size.value = 4000
         steer(0, .7)
-        time.sleep(.8)
+        yield from pause(.8)
         return True
 
     elif (line_detected.value and black_average.value > 40) or silver_detected():
         status.value = f'Validation failed'
         if line_detected.value and black_average.value > 40:
             steer(200, .7)
-            time.sleep(.2)
+            yield from pause(.2)
             steer()
         return False
 
@@ -655,78 +835,56 @@ def orientate_gap():
 
         start_angle = sensor_x.value
 
-        reason = turn_to_angle(add_angle(sensor_x.value, 45), 1.5, True, False, "r", 0.6, False)
+        reason = yield from turn_to_angle_steps(add_angle(sensor_x.value, 45), 1.5, True, False, "r", 0.6, False)
 
         if reason == "black" or not program_continue():
             return False
 
-        reason = turn_to_angle(sub_angle(sensor_x.value, 90), 1.5, True, False, "l", 0.6, False)
+        reason = yield from turn_to_angle_steps(sub_angle(sensor_x.value, 90), 1.5, True, False, "l", 0.6, False)
 
         if reason == "black" or not program_continue():
             return False
 
-        turn_to_angle(start_angle, 1.5)
+        yield from turn_to_angle_steps(start_angle, 1.5)
 
         timer.set_timer("line_search", 1.2)
         while not line_detected.value and not timer.get_timer("line_search") and program_continue():
             steer(0, .7)
-            time.sleep(.001)
+            yield ("line",)
 
         steer()
         return False
 
 
-def turn_around():
+# (angle, speed, duration) of the wiggle that turns the robot around on the side of a ramp
+turn_around_ramp_steps = [(0, .7, .15), (-180, .6, .15), (0, .8, .15), (-180, .6, .2), (0, .8, .2), (-180, .6, .4), (0, .8, .3), (-180, .6, .4),
+                          (0, .8, .6), (-180, .6, .4), (0, .8, .4), (-180, .6, .4), (0, .8, .2), (-180, .6, .4)]
+
+
+def turn_around_steps():
+    global last_turn_dir
+
     average_sensor_z = get_time_average(time_last_gyro_z, 1)
     if (-135 > average_sensor_z > -165 or 130 < average_sensor_z < 160) and turn_around_ramp_side and rotation_y.value == "none":
-        steer(0, .7)
-        time.sleep(.15)
-        steer(-180, .6)
-        time.sleep(.15)
-        steer(0, .8)
-        time.sleep(.15)
-        steer(-180, .6)
-        time.sleep(.2)
-        steer(0, .8)
-        time.sleep(.2)
-        steer(-180, .6)
-        time.sleep(.4)
-        steer(0, .8)
-        time.sleep(.3)
-        steer(-180, .6)
-        time.sleep(.4)
-        steer(0, .8)
-        time.sleep(.6)
-        steer(-180, .6)
-        time.sleep(.4)
-        steer(0, .8)
-        time.sleep(.4)
-        steer(-180, .6)
-        time.sleep(.4)
-        steer(0, .8)
-        time.sleep(.2)
-        steer(-180, .6)
-        time.sleep(.4)
+        for angle, speed, duration in turn_around_ramp_steps:
+            yield from drive_for(angle, speed, duration, name="turn_around")
 
     else:
         was_ramp_up = rotation_y.value == "ramp_up" or not timer.get_timer("was_ramp_up")
-        steer(0, .7)
-        time.sleep(.85 if was_ramp_up else .55)
+        yield from drive_for(0, .7, .85 if was_ramp_up else .55, name="turn_around")
 
-        turn_to_angle(round_angle(sensor_x.value, 180, 90 if not turn_around_45 else 45), direction=last_turn_dir)
+        yield from turn_to_angle_steps(round_angle(sensor_x.value, 180, 90 if not turn_around_45 else 45), direction=last_turn_dir)
 
-        steer(200, .7)
-        time.sleep(.2 if was_ramp_up else .3)
+        yield from drive_for(200, .7, .2 if was_ramp_up else .3, name="turn_around")
         steer()
 
         if line_size.value < 5500:
-            steer(200, .7)
-            time.sleep(.4)
+            yield from drive_until(lambda: line_size.value >= 5500, 200, .7, .4, name="turn_around")
             steer()
 
     timer.set_timer("stuck_cooldown", 5)
 
-    return "r" if last_turn_dir == "l" else "l"
+    last_turn_dir = "r" if last_turn_dir == "l" else "l"
 
 
 def obstacle_detected():
@@ -757,15 +915,18 @@ def distance_right():
     return (get_time_average(time_sensor_four, 0.25))
 
 
-def turn_for_obstacle():
+def turn_for_obstacle_steps():
     global time_sensor_one, time_sensor_two, time_sensor_five
 
-    if rotation_y.value == "none":
+    # control_loop keeps updating rotation_y while the maneuver runs
+    rotation = rotation_y.value
+
+    if rotation == "none":
         sensor_one_avg = get_time_average(time_sensor_one, 0.15)
         sensor_two_avg = get_time_average(time_sensor_two, 0.15)
 
         steer(200, .7)
-        time.sleep(.15)
+        yield from pause(.15)
         steer()
 
         # centering in front of obstacle
@@ -787,11 +948,13 @@ def turn_for_obstacle():
                 if not program_continue():
                     return False
 
+                yield ("distance",)
+
             steer(-turn_direction, .55)
-            time.sleep(.15)
+            yield from pause(.15)
 
         steer()
-        time.sleep(.5)
+        yield from pause(.5)
 
         # correcting distance to obstacle
         update_sensor_average()
@@ -813,6 +976,8 @@ def turn_for_obstacle():
                 if not program_continue():
                     return False
 
+                yield ("distance",)
+
             steer()
 
         turn_direction = -180 if obstacle_dir[obstacle_count % len(obstacle_dir)] == "l" else 180
@@ -833,11 +998,13 @@ def turn_for_obstacle():
                 if not program_continue():
                     return False
 
+                yield ("distance",)
+
             steer(turn_direction, .65)
-            time.sleep(.3)
+            yield from pause(.3)
 
             steer(0, .55)
-            time.sleep(.45)
+            yield from pause(.45)
 
             steer()
             return True
@@ -847,37 +1014,37 @@ def turn_for_obstacle():
 
     else:
 
-        if rotation_y.value == "ramp_down":
+        if rotation == "ramp_down":
             steer(200, .5)
-            time.sleep(.3)
+            yield from pause(.3)
             steer(200, .2)
-        elif rotation_y.value == "ramp_up":
+        elif rotation == "ramp_up":
             steer()
-            time.sleep(.5)
+            yield from pause(.5)
             steer(200, .25)
-            time.sleep(.3)
+            yield from pause(.3)
             steer(0, .15)
 
-        time.sleep(.5)
+        yield from pause(.5)
 
         update_sensor_average()
         if obstacle_detected_again():
             turn_direction = -180 if obstacle_dir[obstacle_count % len(obstacle_dir)] == "l" else 180
 
-            if rotation_y.value == "ramp_down":
+            if rotation == "ramp_down":
                 steer(200, .7)
-                time.sleep(.7)
+                yield from pause(.7)
 
             steer(turn_direction, .75)
 
-            if rotation_y.value == "ramp_up":
-                time.sleep(.5)
+            if rotation == "ramp_up":
+                yield from pause(.5)
             else:
-                time.sleep(.65)
+                yield from pause(.65)
 
-            if rotation_y.value == "ramp_up":
+            if rotation == "ramp_up":
                 steer(0, .8)
-                time.sleep(.3)
+                yield from pause(.3)
 
             steer()
             return True
@@ -886,81 +1053,78 @@ def turn_for_obstacle():
             return False
 
 
-def return_after_failed_obstacle(start_angle):
-    turn_to_angle(start_angle, 1.5)
+def return_after_failed_obstacle_steps(start_angle):
+    yield from turn_to_angle_steps(start_angle, 1.5)
     steer(200, .7)
-    time.sleep(.25)
+    yield from pause(.25)
     steer()
 
 
-def orientate_after_obstacle(direction):
-    steer(0, .7)
-    time.sleep(.1)
+def orientate_after_obstacle_steps(direction):
+    yield from drive_for(0, .7, .1, name="orientate_after_obstacle")
     steer()
 
     start_angle = sensor_x.value
 
-    steer(180 if direction == "l" else -180, .7)
-    time.sleep(.4)
+    yield from drive_for(180 if direction == "l" else -180, .7, .4, name="orientate_after_obstacle")
     steer()
-    time.sleep(.2)
+    yield from pause(.2)
 
-    steer(0, .7)
-    time.sleep(.75)
+    yield from drive_for(0, .7, .75, name="orientate_after_obstacle")
     steer()
-    time.sleep(.2)
+    yield from pause(.2)
 
-    steer(-180 if direction == "l" else 180, .7)
-    time.sleep(.4)
-    timer.set_timer("obstacle_turn", 3)
-    while not line_detected.value and not timer.get_timer("obstacle_turn"):
-        time.sleep(.01)
-
-        if not program_continue():
-            return
+    yield from drive_for(-180 if direction == "l" else 180, .7, .4, name="orientate_after_obstacle")
+    search = yield from drive_until(lambda: line_detected.value, -180 if direction == "l" else 180, .7, 3, name="orientate_after_obstacle")
+    if search.reason == "stopped":
+        return
 
-    if not timer.get_timer("obstacle_turn"):
-        time.sleep(.35)
+    if search.reason == "event":
+        yield from pause(.35)
         steer()
-        time.sleep(.2)
+        yield from pause(.2)
 
         if line_detected.value:
             return
 
-        steer(180 if direction == "l" else -180, .7)
-        time.sleep(.2)
+        yield from drive_for(180 if direction == "l" else -180, .7, .2, name="orientate_after_obstacle")
         steer()
-        time.sleep(.2)
+        yield from pause(.2)
 
         if line_detected.value:
             return
 
-    turn_to_angle(start_angle, 1.5)
+    yield from turn_to_angle_steps(start_angle, 1.5)
 
     if line_detected.value:
         return
 
-    steer(200, .7)
-    time.sleep(.85)
+    yield from drive_for(200, .7, .85, name="orientate_after_obstacle")
     steer()
-    time.sleep(.2)
-    return
+    yield from pause(.2)
 
 
 def seesaw_detected():
     return get_time_average(time_last_gyro_y, .6) > 6.5 and sensor_y.value < -10
 
 
-def avoid_seesaw():
-    steer(200, .7)
-    time.sleep(.15)
-    steer(200, .1)
-    time.sleep(2)
+def avoid_seesaw_steps():
+    global time_last_gyro_y, time_sensor_one, time_sensor_two, time_sensor_five
 
-    steer(200, .7)
-    time.sleep(.2)
+    yield from drive_for(200, .7, .15, name="avoid_seesaw")
+    yield from drive_for(200, .1, 2, name="avoid_seesaw")
+
+    yield from drive_for(200, .7, .2, name="avoid_seesaw")
     if not line_detected.value:
-        time.sleep(.3)
+        yield from drive_until(lambda: line_detected.value, 200, .7, .3, name="avoid_seesaw")
+
+    time_last_gyro_y = fill_array(0)
+    time_sensor_one = fill_array(0)
+    time_sensor_two = fill_array(0)
+    time_sensor_five = fill_array(0)
+
+    timer.set_timer("obstacle_detect_cooldown", 1.5)
+    timer.set_timer("stuck_cooldown", 4)
 
 
 last_rotation = "none"
@@ -974,54 +1138,56 @@ def ramp_down_detected():
 
 
 def zone_stuck_detected():
-    return get_time_average(time_zone_similarity, 15) >= .95 and timer.get_timer("zone_stuck_cooldown")
+    # SimilarityDetector scale, between its moving maximum and stuck minimum in debug/similarity_benchmark.py
+    return get_time_average(time_zone_similarity, 15) >= .96 and timer.get_timer("zone_stuck_cooldown")
 
 
-def avoid_stuck():
+def avoid_stuck_steps():
     status.value = f'Line similarity too high, stuck detected'
 
     angle = line_angle.value
 
     if rotation_y.value == "none" and line_status.value == "line_detected" and abs(angle) > 120:
         steer()
-        time.sleep(1)
+        yield from pause(1)
         steer(180 if angle < 0 else -180, .7)
-        time.sleep(.35)
+        yield from pause(.35)
         steer(0, .7)
-        time.sleep(.45)
+        yield from pause(.45)
         steer(-180 if angle < 0 else 180, .7)
-        time.sleep(.45)
+        yield from pause(.45)
         steer(200, .7)
-        time.sleep(.5)
+        yield from pause(.5)
 
     elif rotation_y.value == "ramp_down":
         steer()
-        time.sleep(1)
+        yield from pause(1)
         steer(200, .7)
-        time.sleep(.5)
+        yield from pause(.5)
         steer()
 
     else:
         steer()
-        time.sleep(.5)
+        yield from pause(.5)
 
     timer.set_timer("stuck_detected", 1.2 if rotation_y.value == "ramp_up" else .85)
+    timer.set_timer("stuck_cooldown", 4 if rotation_y.value == "none" else 8)
 
 
-def avoid_stuck_zone():
+def avoid_stuck_zone_steps():
     status.value = f'Image similarity too high, stuck detected'
     steer()
-    time.sleep(1)
+    yield from pause(1)
     steer(200, .7)
-    time.sleep(.5)
+    yield from pause(.5)
     steer()
     steer(random.choice([-180, 180]), .6)
-    time.sleep(1)
-    drive_until_wall(1.5, .7, stop_when_black=True, stop_when_silver=True)
+    yield from pause(1)
+    yield from drive_until_wall_steps(1.5, .7, stop_when_black=True, stop_when_silver=True)
     timer.set_timer("zone_stuck_cooldown", 4)
 
 
-def stop_for_red():
+def stop_for_red_steps():
     steer()
     for i in range(wait_time_red):
         if not program_continue():
@@ -1031,15 +1197,14 @@ def stop_for_red():
             run_start_time.value = -1
 
         status.value = f'Waiting for red: {wait_time_red - i} seconds left'
-        time.sleep(1)
+        yield from pause(1)
 
         if i == wait_time_red - 1:
-            steer(0, 55)
-            time.sleep(.5)
+            yield from drive_for(0, 55, .5, name="stop_for_red")
             steer()
 
 
-def wait_time(time_to_wait, message, rotation="n"):
+def wait_time_steps(time_to_wait, message, rotation="n"):
     if rotation == "u":
         steer(0, .2)
     elif rotation == "d":
@@ -1052,7 +1217,7 @@ def wait_time(time_to_wait, message, rotation="n"):
             return False
 
         status.value = f'Waiting for {message}: {time_to_wait - i} seconds left'
-        time.sleep(1)
+        yield from pause(1)
 
     return program_continue()
 
@@ -1061,22 +1226,18 @@ def silver_detected():
     return get_time_average(time_silver_detected, .15 if rotation_y.value == "ramp_down" else .25) > .7 and not zone_done and timer.get_timer("silver_cooldown")
 
 
-def validate_silver():
+def validate_silver_steps():
     status.value = f'Validating silver line'
 
     if rotation_y.value == "ramp_down":
-        steer(200, .5)
-        time.sleep(.3)
-        steer(200, .2)
-        time.sleep(.7)
-        steer(200, .6)
-        time.sleep(.45)
+        yield from drive_for(200, .5, .3, name="validate_silver")
+        yield from drive_for(200, .2, .7, name="validate_silver")
+        yield from drive_for(200, .6, .45, name="validate_silver")
         steer()
     elif rotation_y.value == "ramp_up":
         pass
     else:
-        steer(200, .7)
-        time.sleep(.15)
+        yield from drive_for(200, .7, .15, name="validate_silver")
         steer()
 
     if rotation_y.value == "ramp_down":
@@ -1086,29 +1247,29 @@ def validate_silver():
     else:
         steer()
 
-    time.sleep(.25 if speed_zone else .5)
+    yield from pause(.25 if speed_zone else .5)
 
     prev_line_size = black_average.value
 
-    line_status.value = "check_silver"
+    line_machine.goto(LineState.CHECK_SILVER)
 
     switch_lights(False)
 
-    time.sleep(1.5 if speed_zone else 1.7)
+    yield from pause(1.5 if speed_zone else 1.7)
 
     # print(f"Prev: {prev_line_size}, Current: {black_average.value}")
     if black_average.value > max(prev_line_size - 23, 0):
         status.value = f'Validating silver line failed'
-        line_status.value = "line_detected"
+        line_machine.goto(LineState.LINE_DETECTED)
         switch_lights(True)
 
-        time.sleep(1)
+        yield from pause(1)
 
         return False
     else:
         status.value = f'Validating silver line successful'
         if not speed_zone:
-            time.sleep(.4)
+            yield from pause(.4)
         return True
 
 
@@ -1117,7 +1278,7 @@ def calculate_distance_nearest_90(current_angle):
     return nearest_90 - current_angle
 
 
-def position_for_entry():
+def position_for_entry_steps():
     tolerance = 10
     status.value = f'Centering silver line'
 
@@ -1126,29 +1287,31 @@ def position_for_entry():
         while not line_detected.value and line_angle_y.value < camera_y * .1 and not timer.get_timer("entry") and program_continue():
             steer_direction = 200 if not line_detected.value else 0
             steer(steer_direction, .4)
+            yield ("line",)
 
         steer(0, .1)
-        time.sleep(.3)
+        yield from pause(.3)
         steer()
 
     direction = 0
     if abs(calculate_distance_nearest_90(sensor_x.value)) > 15:
         status.value = f'Rotation not straight, determining silver angle'
 
-        line_status.value = "position_entry_1"
-        time.sleep(1.5)
-        line_status.value = "position_entry"
+        line_machine.goto(LineState.POSITION_ENTRY_1)
+        yield from pause(1.5)
+        line_machine.goto(LineState.POSITION_ENTRY)
         switch_lights(True)
-        time.sleep(1)
-        line_status.value = "position_entry_2"
-        time.sleep(1.3)
+        yield from pause(1)
+        line_machine.goto(LineState.POSITION_ENTRY_2)
+        yield from pause(1.3)
 
         start_time = time.perf_counter()
         while not time.perf_counter() - start_time > .7:
             update_sensor_average()
+            yield ("line",)
 
         angle_silver = get_time_average(time_silver_angle, .25)
-        line_status.value = "position_entry"
+        line_machine.goto(LineState.POSITION_ENTRY)
 
         if angle_silver > 20:
             direction = -35
@@ -1157,7 +1320,7 @@ def position_for_entry():
 
         status.value = f'Got silver angle: {round(angle_silver, 2)}°'
         switch_lights(False)
-        time.sleep(1)
+        yield from pause(1)
 
     status.value = f'Centering black line'
 
@@ -1179,11 +1342,13 @@ def position_for_entry():
         if not program_continue():
             return False
 
+        yield ("line",)
+
     steer(0, .65)
-    time.sleep(.35)
+    yield from pause(.35)
 
     status.value = f'Turning into entry'
-    turn_to_angle(round_angle(sensor_x.value, direction=direction))
+    yield from turn_to_angle_steps(round_angle(sensor_x.value, direction=direction))
 
     return True
 
@@ -1191,11 +1356,11 @@ def position_for_entry():
 turn_360_counter = 0
 
 
-def search_for_victims():
+def search_for_victims_steps():
     global turn_360_counter
 
     while program_continue():
-        if turn_360(speed=.7 if speed_zone else .6, stop_when_victim=True) and turn_360_counter < 4:
+        if (yield from turn_360_steps(speed=.7 if speed_zone else .6, stop_when_victim=True)) and turn_360_counter < 4:
             turn_360_counter += 1
             break
         elif timer.get_timer("max_search_time"):
@@ -1209,23 +1374,24 @@ def search_for_victims():
                 if ball_type.value != "none":
                     steer()
                     break
+                yield ("zone",)
 
-            stop_reason = drive_until_wall(random.uniform(1, 2), stop_when_black=True, stop_when_silver=True, stop_when_victim=True)
+            stop_reason = yield from drive_until_wall_steps(random.uniform(1, 2), stop_when_black=True, stop_when_silver=True, stop_when_victim=True)
 
             if stop_reason in ["silver", "black", "wall"] and program_continue():
                 steer(200, .6)
-                time.sleep(1)
-                turn_to_angle(angle=add_angle(sensor_x.value, 120), tolerance=7, stop_on_victim=True)
-                drive_until_wall(1, stop_when_black=True, stop_when_silver=True, stop_when_victim=True)
+                yield from pause(1)
+                yield from turn_to_angle_steps(angle=add_angle(sensor_x.value, 120), tolerance=7, stop_on_victim=True)
+                yield from drive_until_wall_steps(1, stop_when_black=True, stop_when_silver=True, stop_when_victim=True)
 
     steer()
 
 
-def search_for_corner():
+def search_for_corner_steps():
     while program_continue():
         global turn_360_counter
 
-        if turn_360(speed=.85 if speed_zone else .65, stop_when_corner=True) and turn_360_counter < 4:
+        if (yield from turn_360_steps(speed=.85 if speed_zone else .65, stop_when_corner=True)) and turn_360_counter < 4:
             turn_360_counter += 1
             break
         else:
@@ -1237,19 +1403,20 @@ def search_for_corner():
                 if corner_distance.value != -181:
                     steer()
                     break
+                yield ("corner",)
 
-            stop_reason = drive_until_wall(random.uniform(1.5, 2.5), stop_when_black=True, stop_when_silver=True)
+            stop_reason = yield from drive_until_wall_steps(random.uniform(1.5, 2.5), stop_when_black=True, stop_when_silver=True)
 
             if stop_reason in ["silver", "black", "wall"] and program_continue():
                 steer(200, .6)
-                time.sleep(.4)
-                turn_to_angle(angle=add_angle(sensor_x.value, 120), tolerance=7, stop_on_corner=True)
-                drive_until_wall(1, stop_when_black=True, stop_when_silver=True)
+                yield from pause(.4)
+                yield from turn_to_angle_steps(angle=add_angle(sensor_x.value, 120), tolerance=7, stop_on_corner=True)
+                yield from drive_until_wall_steps(1, stop_when_black=True, stop_when_silver=True)
 
     steer()
 
 
-def turn_to_victim(tolerance=10):
+def turn_to_victim_steps(tolerance=10):
     timer.set_timer("turn_to_victim_stuck", 15)
     timer.set_timer("turn_to_victim", .6)
     while program_continue() and not -tolerance <= ball_distance.value <= tolerance and (ball_type.value != "none" or not timer.get_timer("turn_to_victim")):
@@ -1262,25 +1429,27 @@ def turn_to_victim(tolerance=10):
         steer(direction, max(1 - pow(abs(abs(ball_distance.value / 2) / (camera_x / 2) - 1), 3), 0.4))
 
         if zone_stuck_detected() or timer.get_timer("turn_to_victim_stuck"):
-            avoid_stuck_zone()
+            yield from avoid_stuck_zone_steps()
             return False
 
         if ball_type.value != "none":
             timer.set_timer("turn_to_victim", .6)
 
+        yield ("zone", "pose")
+
     steer()
 
     if not program_continue() or ball_type.value == "none":
         if program_continue():
             steer(0)
-            time.sleep(.3)
+            yield from pause(.3)
             steer()
         return False
     else:
         return True
 
 
-def turn_to_corner(color, tolerance=10):
+def turn_to_corner_steps(color, tolerance=10):
     timer.set_timer("turn_to_corner_stuck", 15)
     timer.set_timer("turn_to_corner", .6)
     while program_continue() and not -tolerance <= corner_distance.value <= tolerance and (corner_distance.value != -181 or not timer.get_timer("turn_to_corner")):
@@ -1293,24 +1462,26 @@ def turn_to_corner(color, tolerance=10):
         steer(direction, max(1 - pow(abs(abs(corner_distance.value) / (camera_x / 2) - 1), 5), 0.4))
 
         if zone_stuck_detected() or timer.get_timer("turn_to_corner_stuck"):
-            avoid_stuck_zone()
+            yield from avoid_stuck_zone_steps()
             return False
 
         if corner_distance.value != -181:
             timer.set_timer("turn_to_corner", .6)
 
+        yield ("corner", "pose")
+
     steer()
 
     if not program_continue() or corner_distance.value == -181:
         steer(0)
-        time.sleep(.3)
+        yield from pause(.3)
         steer()
         return False
     else:
         return True
 
 
-def drive_to_victim(speed=0.6):
+def drive_to_victim_steps(speed=0.6):
     timer.set_timer("drive_to_victim_stuck", 15)
     timer.set_timer("drive_to_victim", .6)
     while ball_width.value < 140 if speed_zone else 200:
@@ -1326,17 +1497,19 @@ def drive_to_victim(speed=0.6):
             return False
 
         if zone_stuck_detected() or timer.get_timer("drive_to_victim_stuck"):
-            avoid_stuck_zone()
+            yield from avoid_stuck_zone_steps()
             return False
 
         if ball_type.value != "none":
             timer.set_timer("drive_to_victim", .6)
 
+        yield ("zone", "distance")
+
     steer()
     return True
 
 
-def drive_to_corner(color, speed=0.6):
+def drive_to_corner_steps(color, speed=0.6):
     status.value = f'Driving to {color} evacuation point'
 
     timer.set_timer("drive_to_corner_stuck", 15)
@@ -1353,28 +1526,30 @@ def drive_to_corner(color, speed=0.6):
             return False
 
         if zone_stuck_detected() or timer.get_timer("drive_to_corner_stuck"):
-            avoid_stuck_zone()
+            yield from avoid_stuck_zone_steps()
             return False
 
         if corner_distance.value != -181:
             timer.set_timer("drive_to_corner", .6)
 
+        yield ("corner", "distance")
+
     steer(200, .7)
-    time.sleep(.15)
+    yield from pause(.15)
     steer()
 
     return True
 
 
-def pick_up_victim(alive):
+def pick_up_victim_steps(alive):
 
-    servo_pos(1)
+    yield from servo_pos_steps(1)
 
     steer(200, .7)
-    time.sleep(.45)
+    yield from pause(.45)
     steer()
 
-    time.sleep(.6 if speed_zone else 1.5)
+    yield from pause(.6 if speed_zone else 1.5)
 
     timer.set_timer("pickup", .5 if speed_zone else 1.15)
     while (get_time_average(time_sensor_seven, .2) > 75 or get_time_average(time_sensor_seven, .2) == -1) and not timer.get_timer("pickup"):
@@ -1385,11 +1560,13 @@ def pick_up_victim(alive):
         if not program_continue():
             return False
 
-    servo_pos(3 if alive and picked_up_alive_count.value < 2 else 2)
-    time.sleep(.05)
+        yield ("distance",)
+
+    yield from servo_pos_steps(3 if alive and picked_up_alive_count.value < 2 else 2)
+    yield from pause(.05)
 
     steer(200, 1)
-    time.sleep(.25)
+    yield from pause(.25)
     steer()
 
     timer.set_timer("pickup", 1 if not speed_zone else .6)
@@ -1399,80 +1576,82 @@ def pick_up_victim(alive):
         if not program_continue():
             return False
 
+        yield ("distance",)
+
     return get_time_average(time_sensor_seven, .2) < 50
 
 
-def dump_victims(alive, dumped_victims=False):
+def dump_victims_steps(alive, dumped_victims=False):
     status.value = f"Positioning in front of evacuation point"
 
     if speed_zone:
-        reason = drive_until_wall(2, speed=.9, stop_when_near_wall=True)
+        reason = yield from drive_until_wall_steps(2, speed=.9, stop_when_near_wall=True)
 
     else:
         switch_lights(True)
-        time.sleep(1.5)
+        yield from pause(1.5)
 
-        reason = drive_until_wall(2, stop_when_wall=False, stop_when_corner=True)
+        reason = yield from drive_until_wall_steps(2, stop_when_wall=False, stop_when_corner=True)
         switch_lights(False)
 
         if reason != "corner":
             return False
 
-    turn_to_angle(angle=add_angle(sensor_x.value, 180), direction=random.choice(["r", "l"]), tolerance=7 if speed_zone else 1.5)
+    yield from turn_to_angle_steps(angle=add_angle(sensor_x.value, 180), direction=random.choice(["r", "l"]), tolerance=7 if speed_zone else 1.5)
 
     if program_continue():
         status.value = f"Dumping {'alive' if alive else 'dead'} victims"
         steer(200, 1)
-        time.sleep(.8 if speed_zone else 2.75)
+        yield from pause(.8 if speed_zone else 2.75)
         steer()
 
         if program_continue():
             if not dumped_victims:
-                servo_pos(4)
-                time.sleep(.6)
+                yield from servo_pos_steps(4)
+                yield from pause(.6)
 
                 if not speed_zone:
-                    time.sleep(.9)
+                    yield from pause(.9)
 
                     steer(0, .7)
-                    time.sleep(.35)
+                    yield from pause(.35)
                     steer(200, 1)
-                    time.sleep(.3)
+                    yield from pause(.3)
                     steer()
 
-                    time.sleep(1)
+                    yield from pause(1)
 
-                servo_pos(5)
+                yield from servo_pos_steps(5)
 
                 if alive:
-                    drive_until_wall(.7)
-                    servo_pos(6)
+                    yield from drive_until_wall_steps(.7)
+                    yield from servo_pos_steps(6)
 
-            drive_until_wall(.15 if speed_zone else .3, speed=.9 if speed_zone else .65)
+            yield from drive_until_wall_steps(.15 if speed_zone else .3, speed=.9 if speed_zone else .65)
 
             return True
 
     return False
 
 
-def validate_exit():
+def validate_exit_steps():
     status.value = f'Validating black line'
 
     steer()
-    time.sleep(.3 if speed_zone else 1)
+    yield from pause(.3 if speed_zone else 1)
 
     prev_line_size = black_average.value
 
-    zone_status.value = "check_silver"
+    zone_machine.goto(ZoneState.CHECK_SILVER)
 
     switch_lights(False)
 
-    time.sleep(1 if speed_zone else 1.5)
+    yield from pause(1 if speed_zone else 1.5)
 
     if black_average.value > max(prev_line_size - 23, 0):
         status.value = f'Validating black line successful'
         if not speed_zone:
-            time.sleep(.5)
+            yield from pause(.5)
         return True
 
     else:
@@ -1481,20 +1660,20 @@ def validate_exit():
         switch_lights(True)
 
         steer(200, .65)
-        time.sleep(.15)
+        yield from pause(.15)
         steer()
 
-        turn_to_angle(round_angle(sensor_x.value, direction=-90))
-        zone_status.value = "exit"
+        yield from turn_to_angle_steps(round_angle(sensor_x.value, direction=-90))
+        zone_machine.goto(ZoneState.EXIT)
         return False
 
 
-def find_exit():
+def find_exit_steps():
     status.value = f'Searching next wall'
 
     steer(200, .65)
-    time.sleep(.5)
-    turn_to_angle(round_angle(sensor_x.value, direction=90, rounding_value=90, round_45_only=True), tolerance=7 if speed_zone else 1.5)
+    yield from pause(.5)
+    yield from turn_to_angle_steps(round_angle(sensor_x.value, direction=90, rounding_value=90, round_45_only=True), tolerance=7 if speed_zone else 1.5)
 
     check_exit = False
     drift_amount = 75
@@ -1503,22 +1682,22 @@ def find_exit():
     first_run = True
 
     while program_continue():
-        return_reason = drive_until_wall(10, speed=1 if speed_zone else .9, stop_when_corner=True, stop_when_black=True, stop_when_silver=True, stop_when_exit=check_exit, exit_cooldown_time=exit_cooldown_time, drift=drift_amount)
+        return_reason = yield from drive_until_wall_steps(10, speed=1 if speed_zone else .9, stop_when_corner=True, stop_when_black=True, stop_when_silver=True, stop_when_exit=check_exit, exit_cooldown_time=exit_cooldown_time, drift=drift_amount)
 
         if return_reason in ["black", "silver"]:
             status.value = f'Detected {return_reason} line in front'
 
             steer(200, .65)
-            time.sleep(.1)
+            yield from pause(.1)
             steer()
-            time.sleep(.2)
+            yield from pause(.2)
 
             steer(0, .6)
-            time.sleep(.15)
+            yield from pause(.15)
             steer()
-            time.sleep(.3)
+            yield from pause(.3)
 
-            if validate_exit():
+            if (yield from validate_exit_steps()):
                 return True
 
             status.value = f'Silver line detected, continuing to search for exit'
@@ -1534,27 +1713,27 @@ def find_exit():
         elif return_reason == "exit":
             status.value = f'Detected exit on the right side'
 
-            turn_to_angle(round_angle(sensor_x.value, direction=90), tolerance=7 if speed_zone else 1.5)
+            yield from turn_to_angle_steps(round_angle(sensor_x.value, direction=90), tolerance=7 if speed_zone else 1.5)
 
             steer(200, .65)
-            time.sleep(.6 if speed_zone else 1)
+            yield from pause(.6 if speed_zone else 1)
 
-            reason = drive_until_wall(2.5, stop_when_wall=True, stop_when_black=True, stop_when_silver=True)
+            reason = yield from drive_until_wall_steps(2.5, stop_when_wall=True, stop_when_black=True, stop_when_silver=True)
 
             if reason in ["silver", "black"]:
                 status.value = f'Detected {return_reason} line in front'
 
                 steer(200, .65)
-                time.sleep(.1)
+                yield from pause(.1)
                 steer()
-                time.sleep(.2)
+                yield from pause(.2)
 
                 steer(0, .6)
-                time.sleep(.15)
+                yield from pause(.15)
                 steer()
-                time.sleep(.3)
+                yield from pause(.3)
 
-                if validate_exit():
+                if (yield from validate_exit_steps()):
                     return True
 
                 status.value = f'Silver line detected, continuing to search for exit'
@@ -1566,7 +1745,7 @@ def find_exit():
             elif reason == "wall":
                 status.value = f'Wall detected, turning 90°'
 
-                turn_to_angle(round_angle(sensor_x.value, direction=-90, final_addition=10), tolerance=7 if speed_zone else 1.5)
+                yield from turn_to_angle_steps(round_angle(sensor_x.value, direction=-90, final_addition=10), tolerance=7 if speed_zone else 1.5)
 
                 check_exit = True
                 drift_amount = 35
@@ -1575,7 +1754,7 @@ def find_exit():
             elif reason == "none":
                 status.value = f'Maximum distance reached, obstacle detected'
 
-                turn_to_angle(round_angle(sensor_x.value, direction=90, final_addition=-15), tolerance=7 if speed_zone else 1.5)
+                yield from turn_to_angle_steps(round_angle(sensor_x.value, direction=90, final_addition=-15), tolerance=7 if speed_zone else 1.5)
 
                 check_exit = False
                 drift_amount = 0
@@ -1584,7 +1763,7 @@ def find_exit():
         elif return_reason == "wall":
             status.value = f'Wall detected, turning 90°'
 
-            turn_to_angle(round_angle(sensor_x.value, direction=-90, final_addition=10), tolerance=7 if speed_zone else 1.5)
+            yield from turn_to_angle_steps(round_angle(sensor_x.value, direction=-90, final_addition=10), tolerance=7 if speed_zone else 1.5)
 
             check_exit = True
             drift_amount = 35
@@ -1593,14 +1772,14 @@ def find_exit():
         elif return_reason == "corner":
             status.value = f'Evacuation point detected, turning 45°'
 
-            turn_to_angle(round_angle(sensor_x.value, direction=-90, final_addition=30), tolerance=7 if speed_zone else 1.5)
+            yield from turn_to_angle_steps(round_angle(sensor_x.value, direction=-90, final_addition=30), tolerance=7 if speed_zone else 1.5)
 
-            reason = drive_until_wall(5, speed=.9, stop_when_black=True, stop_when_silver=True, drift=75)
+            reason = yield from drive_until_wall_steps(5, speed=.9, stop_when_black=True, stop_when_silver=True, drift=75)
 
             if reason == "wall":
                 status.value = f'Wall detected, turning 90°'
 
-                turn_to_angle(round_angle(sensor_x.value, direction=-55, final_addition=10), tolerance=7 if speed_zone else 1.5)
+                yield from turn_to_angle_steps(round_angle(sensor_x.value, direction=-55, final_addition=10), tolerance=7 if speed_zone else 1.5)
 
                 check_exit = True
                 drift_amount = 35
@@ -1610,28 +1789,28 @@ def find_exit():
                 status.value = f'Detected {reason} line in front'
 
                 steer(0, .65)
-                time.sleep(.25)
-                turn_to_angle(round_angle(sensor_x.value, direction=30), tolerance=7 if speed_zone else 1.5)
+                yield from pause(.25)
+                yield from turn_to_angle_steps(round_angle(sensor_x.value, direction=30), tolerance=7 if speed_zone else 1.5)
 
                 steer(200, .65)
-                time.sleep(1.4)
+                yield from pause(1.4)
 
-                reason = drive_until_wall(2.8, stop_when_wall=True, stop_when_black=True, stop_when_silver=True)
+                reason = yield from drive_until_wall_steps(2.8, stop_when_wall=True, stop_when_black=True, stop_when_silver=True)
 
                 if reason in ["silver", "black"]:
                     status.value = f'Detected {return_reason} line in front'
 
                     steer(200, .65)
-                    time.sleep(.1)
+                    yield from pause(.1)
                     steer()
-                    time.sleep(.2)
+                    yield from pause(.2)
 
                     steer(0, .6)
-                    time.sleep(.15)
+                    yield from pause(.15)
                     steer()
-                    time.sleep(.3)
+                    yield from pause(.3)
 
-                    if validate_exit():
+                    if (yield from validate_exit_steps()):
                         return True
 
                     status.value = f'Silver line detected, continuing to search for exit'
@@ -1643,7 +1822,7 @@ def find_exit():
                 elif reason == "wall":
                     status.value = f'Wall detected, turning 90°'
 
-                    turn_to_angle(round_angle(sensor_x.value, direction=-90, final_addition=10), tolerance=7 if speed_zone else 1.5)
+                    yield from turn_to_angle_steps(round_angle(sensor_x.value, direction=-90, final_addition=10), tolerance=7 if speed_zone else 1.5)
 
                     check_exit = True
                     drift_amount = 35
@@ -1652,7 +1831,7 @@ def find_exit():
                 elif reason == "none":
                     status.value = f'Maximum distance reached, obstacle detected'
 
-                    turn_to_angle(round_angle(sensor_x.value, direction=90, final_addition=10), tolerance=7 if speed_zone else 1.5)
+                    yield from turn_to_angle_steps(round_angle(sensor_x.value, direction=90, final_addition=10), tolerance=7 if speed_zone else 1.5)
 
                     check_exit = False
                     drift_amount = 0
@@ -1661,13 +1840,13 @@ def find_exit():
         elif return_reason == "none":
             status.value = f'Stuck detected'
 
-            time.sleep(.5)
+            yield from pause(.5)
             steer(200, 1)
-            time.sleep(.4)
+            yield from pause(.4)
             steer()
-            time.sleep(.5)
+            yield from pause(.5)
             steer(0, 1)
-            time.sleep(.7)
+            yield from pause(.7)
             steer()
 
         first_run = False
@@ -1675,11 +1854,12 @@ def find_exit():
     return False
 
 
-def position_exit():
+def position_exit_steps():
     start_time = time.perf_counter()
 
     while not time.perf_counter() - start_time > .7:
         update_sensor_average()
+        yield ("line",)
 
     angle_exit = get_time_average(time_exit_angle, .25)
 
@@ -1696,10 +1876,10 @@ def position_exit():
 
     if direction != 0:
         status.value = f'Angle too high, turning into exit'
-        turn_to_angle(round_angle(sensor_x.value, direction=direction))
+        yield from turn_to_angle_steps(round_angle(sensor_x.value, direction=direction))
 
     steer(0, .65)
-    time.sleep(.35)
+    yield from pause(.35)
     steer()
 
 
@@ -1727,10 +1907,473 @@ def calibrate_turn_time():
 # Main Control Loop
 ########################################################################################################################
 
+# Handlers of the line_status / zone_status states, they return the next state, None to stay, or a maneuver
+
+obstacle_is_ramp = "none"
+
+
+def line_steer_angle(frame):
+    if abs(frame.line_angle) > max_turn_angle:
+        line_controller.reset()
+        return frame.line_angle
+    return round(line_controller.update(frame.line_angle, frame.line_frame_time, frame.line_angle))
+
+
+def line_detected_state(frame):
+    global time_silver_detected, time_last_angles
+
+    next_state = None
+    if not frame.line_detected and rotation_y.value == "none" and not frame.ramp_ahead:
+        next_state = LineState.GAP_DETECTED
+
+    if frame.red_detected:
+        next_state = LineState.STOP
+
+    if obstacle_detected() or (obstacle_detected_again() and rotation_y.value == "ramp_up"):
+        next_state = LineState.OBSTACLE_DETECTED
+
+    if silver_detected():
+        return silver_steps()
+
+    if next_state is not None:
+        return next_state
+
+    if frame.turn_dir == "turn_around":
+        status.value = f'Turning around {"right" if last_turn_dir == "r" else "left"}'
+
+        return turn_around_steps()
+
+    status.value = f'Following Line'
+
+    steer_angle = line_steer_angle(frame)
+    steer(steer_angle, get_speed(steer_angle))
+
+    time_silver_detected = add_time_value(time_silver_detected, frame.silver_value)
+    time_last_angles = add_time_value(time_last_angles, frame.line_angle)
+
+    # SimilarityDetector scale, .88 of skimage mapped with the fit of debug/similarity_benchmark.py
+    if get_time_average(time_line_similarity, 15) > .74 and timer.get_timer("stuck_cooldown"):
+        return avoid_stuck_steps()
+
+
+def silver_steps():
+    next_state = None
+    if (yield from validate_silver_steps()):
+        if program_continue():
+            if zone_start_time.value == -1:
+                zone_start_time.value = time.perf_counter()
+
+            next_state = LineState.POSITION_ENTRY
+    else:
+        yield from drive_for(0, .7, .3, name="silver")
+        steer()
+        next_state = LineState.LINE_DETECTED
+
+    timer.set_timer("silver_cooldown", 1.3)
+    timer.set_timer("stuck_cooldown", 6)
+    return next_state
+
+
+def stop_steps(frame):
+    yield from stop_for_red_steps()
+    return LineState.LINE_DETECTED
+
+
+def gap_detected_steps(frame):
+    verified_gap = yield from orientate_gap_steps()
+
+    if verified_gap:
+        timer.set_timer("gap_avoid", .4)
+    else:
+        line_machine.goto(LineState.LINE_DETECTED)
+        min_line_size.value = 3000
+        yield from pause(.1)
+
+    timer.set_timer("stuck_cooldown", 4)
+
+
+def gap_avoid_state(frame):
+    status.value = f'Avoiding gap'
+
+    if line_detected.value or silver_detected() or obstacle_detected():
+        min_line_size.value = 3000
+        timer.set_timer("stuck_cooldown", 4)
+        return LineState.LINE_DETECTED
+    else:
+        steer(0, .6)
+
+    if timer.get_timer("gap_avoid"):
+        return gap_return_steps()
+
+
+def gap_return_steps():
+    min_line_size.value = 4500
+    steer(200, .6)
+    yield from pause(1.35)
+    yield from drive_back_until_line_steps(.3, .6)
+
+    line_machine.goto(LineState.LINE_DETECTED)
+    yield from pause(.1)
+    timer.set_timer("stuck_cooldown", 4)
+
+
+def obstacle_detected_steps(frame):
+    global obstacle_is_ramp, time_line_similarity
+
+    status.value = f'Obstacle detected'
+
+    start_angle = sensor_x.value
+    obstacle_is_ramp = rotation_y.value
+    if (yield from turn_for_obstacle_steps()):
+        line_machine.goto(LineState.OBSTACLE_AVOID)
+
+        if obstacle_is_ramp == "none":
+            timer.set_timer("obstacle_avoid", 1.6)
+        elif obstacle_is_ramp == "ramp_up":
+            timer.set_timer("obstacle_avoid", 3.5)
+        elif obstacle_is_ramp == "ramp_down":
+            timer.set_timer("obstacle_avoid", 1)
+
+        timer.set_timer("obstacke_cooldown", .45)
+
+        obstacle_direction.value = obstacle_dir[obstacle_count % len(obstacle_dir)]
+
+        time_line_similarity = fill_array(0, 1200)
+        min_line_size.value = 6500
+        yield from pause(.1)
+    else:
+        status.value = f'Obstacle failed, returning to {start_angle}°'
+        if program_continue():
+            yield from return_after_failed_obstacle_steps(start_angle)
+        return LineState.LINE_DETECTED
+
+
+def obstacle_avoid_steps(frame):
+    global obstacle_count, time_sensor_one, time_sensor_two, time_sensor_five
+
+    status.value = f'Avoiding obstacle'
+
+    if obstacle_dir[obstacle_count % len(obstacle_dir)] == "l" and not timer.get_timer("obstacle_avoid"):
+        if rotation_y.value == "none":
+            steer(max_turn_angle, .7)
+        elif rotation_y.value == "ramp_up":
+            steer(max_turn_angle - 40, 1)
+        elif rotation_y.value == "ramp_down":
+            steer(max_turn_angle, .3)
+
+    elif obstacle_dir[obstacle_count % len(obstacle_dir)] == "l" and timer.get_timer("obstacle_avoid") and not rotation_y.value == "ramp_up":
+        steer(180, .6)
+        yield from pause(.1)
+        if rotation_y.value == "none":
+            timer.set_timer("obstacle_avoid", .7)
+        elif rotation_y.value == "ramp_up":
+            timer.set_timer("obstacle_avoid", 1.9)
+        elif rotation_y.value == "ramp_down":
+            timer.set_timer("obstacle_avoid", .75)
+
+    elif obstacle_dir[obstacle_count % len(obstacle_dir)] == "r" and not timer.get_timer("obstacle_avoid"):
+        if rotation_y.value == "none":
+            steer(-max_turn_angle, .7)
+        elif rotation_y.value == "ramp_up":
+            steer(-max_turn_angle + 40, 1)
+        elif rotation_y.value == "ramp_down":
+            steer(-max_turn_angle, .3)
+
+    elif obstacle_dir[obstacle_count % len(obstacle_dir)] == "r" and timer.get_timer("obstacle_avoid") and not rotation_y.value == "ramp_up":
+        steer(-180, .6)
+        yield from pause(.1)
+        if rotation_y.value == "none":
+            timer.set_timer("obstacle_avoid", .7)
+        elif rotation_y.value == "ramp_up":
+            timer.set_timer("obstacle_avoid", 1.9)
+        elif rotation_y.value == "ramp_down":
+            timer.set_timer("obstacle_avoid", .75)
+
+    if get_time_average(time_line_similarity, 15) > .74 and timer.get_timer("stuck_cooldown"):
+        steer(180 if obstacle_dir[obstacle_count % len(obstacle_dir)] == "r" else -180, .7)
+        yield from pause(.4)
+        steer()
+        yield from pause(.2)
+        timer.set_timer("stuck_cooldown", 10)
+
+    if line_detected.value and timer.get_timer("obstacke_cooldown"):
+        min_line_size.value = 3000
+        line_machine.goto(LineState.OBSTACLE_ORIENTATE)
+
+        if obstacle_is_ramp == "none":
+            yield from orientate_after_obstacle_steps(obstacle_dir[obstacle_count % len(obstacle_dir)])
+
+            if line_detected.value:
+                steer(200, .7)
+                yield from pause(1)
+                steer()
+        else:
+            steer(0, .3 if obstacle_is_ramp == "ramp_down" else .8)
+            yield from pause(.6 if obstacle_is_ramp == "ramp_down" else 1)
+            steer(180 if obstacle_dir[obstacle_count % len(obstacle_dir)] == "r" else -180, .7)
+            yield from pause(.3)
+
+        time_sensor_one = fill_array(300)
+        time_sensor_two = fill_array(300)
+        time_sensor_five = fill_array(300)
+
+        obstacle_count += 1
+        timer.set_timer("stuck_cooldown", 4)
+        return LineState.LINE_DETECTED
+
+
+def position_entry_steps(frame):
+    status.value = f'Positioning for entry'
+    if not speed_zone:
+        yield from pause(.5)
+
+    if rotation_y.value == "none":
+        if (yield from position_for_entry_steps()):
+            line_machine.goto(LineState.LINE_DETECTED)
+            objective.value = "zone"
+    else:
+        line_machine.goto(LineState.LINE_DETECTED)
+        objective.value = "zone"
+
+
+def zone_begin_steps(frame):
+    global time_zone_similarity
+
+    if not (yield from wait_time_steps(2 if speed_zone else 4, "AI model to load", rotation="u" if rotation_y.value == "ramp_up" else "n")):
+        return None
+
+    status.value = f'Driving into zone'
+
+    if rotation_y.value == "none":
+        gyro_x_offset(0)
+        gyro_y_offset(0)
+
+    if not speed_zone:
+        yield from drive_until_wall_steps(2.4 if rotation_y.value == "ramp_up" else .7)
+
+        avoid_angle = -361
+        if distance_left() < 200 or distance_right() < 200 and not (distance_left() < 200 and distance_right() < 200):
+            if distance_left() > distance_right():
+                avoid_angle = add_angle(sensor_x.value, -90)
+            else:
+                avoid_angle = add_angle(sensor_x.value, 90)
+
+        yield from drive_until_wall_steps(1.3)
+
+        if distance_left() < 200 or distance_right() < 200 and not (distance_left() < 200 and distance_right() < 200):
+            if distance_left() > distance_right():
+                avoid_angle = add_angle(sensor_x.value, -90)
+            else:
+                avoid_angle = add_angle(sensor_x.value, 90)
+
+        if avoid_angle != -361:
+            yield from turn_to_angle_steps(avoid_angle, tolerance=5)
+
+            reason, time_driven = yield from drive_until_wall_steps(1, stop_when_black=True, stop_when_silver=True, stop_when_victim=True, return_driven_time=True, speed=.9)
+
+            if reason in ["black", "silver"]:
+                steer(200, .7)
+                yield from pause(.3)
+                yield from turn_to_angle_steps(add_angle(sensor_x.value, 180), tolerance=5, direction="r")
+
+                yield from drive_until_wall_steps(time_driven + 1.8, stop_when_black=True, stop_when_silver=True)
+
+    else:
+        yield from drive_until_wall_steps(2 if rotation_y.value == "ramp_up" else 1, speed=1)
+
+    timer.set_timer("max_search_time", 240)
+    time_zone_similarity = fill_array(0.7, 1200)
+
+    if dumped_dead_victims:
+        return ZoneState.DEPOSIT_RED
+    else:
+        return ZoneState.FIND_BALLS
+
+
+def find_balls_steps(frame):
+    status.value = f'Searching for victims'
+
+    if ball_type.value == "none":
+        yield from search_for_victims_steps()
+        if timer.get_timer("max_search_time"):
+            return ZoneState.DEPOSIT_GREEN
+    else:
+        return ZoneState.PICKUP_BALL
+
+
+def pickup_ball_steps(frame):
+    global time_victim_type
+
+    time_victim_type = empty_time_arr(1200)
+
+    if (yield from turn_to_victim_steps()):
+        if (yield from drive_to_victim_steps(speed=1 if speed_zone else .6)):
+            victim_type = "silver ball" if get_time_average(time_victim_type, 10) > 0.5 else "black ball"
+            status.value = f"Picking up {'alive' if victim_type == 'silver ball' else 'dead'} victim"
+
+            alive = victim_type == "silver ball"
+            if not alive and picked_up_dead_count.value > 0:
+                alive = True
+            elif alive and picked_up_alive_count.value > 1:
+                alive = False
+
+            if (yield from pick_up_victim_steps(alive)):
+                if alive and picked_up_alive_count.value < 2:
+                    picked_up_alive_count.value += 1
+                else:
+                    picked_up_dead_count.value += 1
+
+                status.value = f"Picked up {'alive' if alive else 'dead'} victim, new total: {picked_up_alive_count.value + picked_up_dead_count.value} victims"
+                if not speed_zone:
+                    yield from pause(1)
+            else:
+                status.value = f"Failed to pick up {'alive' if alive else 'dead'} victim"
+                if not speed_zone:
+                    yield from pause(1)
+
+            if picked_up_alive_count.value + picked_up_dead_count.value == 3:
+                return ZoneState.DEPOSIT_GREEN
+
+    return ZoneState.FIND_BALLS
+
+
+def deposit_green_steps(frame):
+    global dumped_alive_victims, time_zone_similarity
+
+    if not dumped_alive_victims:
+        status.value = f'Searching for green evacuation point'
+
+        yield from search_for_corner_steps()
+
+        if (yield from turn_to_corner_steps("green")):
+            if (yield from drive_to_corner_steps("green", speed=.75 if speed_zone else .6)):
+                if (yield from dump_victims_steps(True)):
+
+                    if speed_zone:
+                        dumped_alive_victims = True
+                    else:
+                        if (yield from wait_time_steps(6, "confirmation of successful dump", rotation="n")):
+                            dumped_alive_victims = True
+
+                    time_zone_similarity = fill_array(0.7, 1200)
+                    return ZoneState.DEPOSIT_RED
+    else:
+        yield from servo_pos_steps(6)
+        return ZoneState.DEPOSIT_RED
+
+
+def deposit_red_steps(frame):
+    global dumped_dead_victims, time_zone_similarity
+
+    status.value = f'Searching for red evacuation point'
+
+    yield from search_for_corner_steps()
+
+    if (yield from turn_to_corner_steps("red")):
+        if (yield from drive_to_corner_steps("red", speed=.75 if speed_zone else .6)):
+            if (yield from dump_victims_steps(False, dumped_dead_victims)):
+                if not dumped_dead_victims:
+                    if speed_zone:
+                        dumped_dead_victims = True
+                    else:
+                        if (yield from wait_time_steps(6, "confirmation of successful dump", rotation="n")):
+                            dumped_dead_victims = True
+                time_zone_similarity = fill_array(0.7, 1200)
+                return ZoneState.EXIT
+
+
+def zone_exit_steps(frame):
+    global zone_done, time_line_similarity
+
+    status.value = f'Searching for exit'
+
+    if orientate_at_corner:
+        gyro_x_offset(45)
+
+    switch_lights(True)
+
+    if (yield from find_exit_steps()):
+        status.value = f'Found zone exit'
+        if not speed_zone:
+            yield from pause(1)
+
+            zone_machine.goto(ZoneState.GET_EXIT_ANGLE)
+            yield from position_exit_steps()
+
+        else:
+            switch_lights(True)
+
+        zone_machine.goto(ZoneState.EXIT)
+
+        if not speed_zone:
+            if not (yield from wait_time_steps(6, "confirmation of exit position", rotation="n")):
+                return None
+
+        timer.set_timer("obstacle_detect_cooldown", 3)
+
+        objective.value = "follow_line"
+        line_machine.goto(LineState.LINE_DETECTED)
+        zone_machine.goto(ZoneState.BEGIN)
+
+        zone_done = True
+        time_line_similarity = fill_array(0, 1200)
+
+        if speed_zone:
+            steer(0, .6)
+
+        yield from pause(.7)
+        steer()
+        yield from pause(1)
+
+        zone_start_time.value = -1
+
+
+line_machine = StateMachine(LineState, line_status, {
+    LineState.LINE_DETECTED: line_detected_state,
+    LineState.STOP: stop_steps,
+    LineState.GAP_DETECTED: gap_detected_steps,
+    LineState.GAP_AVOID: gap_avoid_state,
+    LineState.OBSTACLE_DETECTED: obstacle_detected_steps,
+    LineState.OBSTACLE_AVOID: obstacle_avoid_steps,
+    LineState.POSITION_ENTRY: position_entry_steps,
+})
+
+zone_machine = StateMachine(ZoneState, zone_status, {
+    ZoneState.BEGIN: zone_begin_steps,
+    ZoneState.FIND_BALLS: find_balls_steps,
+    ZoneState.PICKUP_BALL: pickup_ball_steps,
+    ZoneState.DEPOSIT_GREEN: deposit_green_steps,
+    ZoneState.DEPOSIT_RED: deposit_red_steps,
+    ZoneState.EXIT: zone_exit_steps,
+})
+
+
+def active_machine():
+    # A running maneuver keeps its machine until it ends, even if it changed the objective
+    for machine in (line_machine, zone_machine):
+        if machine.maneuver is not None:
+            return machine
+    return zone_machine if objective.value == "zone" else line_machine
+
+
+def control_state():
+    # name the scheduler accounts the next tick to
+    if calibrate_color_status.value != "none":
+        return "calibrate"
+    elif not run:
+        return "stopped"
+    elif objective.value == "zone":
+        return f"zone/{zone_status.value}"
+    else:
+        return f"{objective.value}/{line_status.value}"
+
 
 def control_loop():
     global forward_right, backward_right, forward_left, backward_left, speed_right, speed_left, light, servo_control, servo_1, servo_2, servo_3, button
-    global run, zone_done, dumped_alive_victims, dumped_dead_victims, last_turn_dir, obstacle_count, time_last_gyro_y, time_last_gyro_x, time_last_gyro_z, time_last_angles, time_sensor_one, time_sensor_two, time_sensor_three, time_sensor_four, time_sensor_five, time_sensor_six, time_sensor_seven, time_silver_detected, time_line_similarity, time_zone_similarity, time_victim_type
+    global run, time_last_gyro_y, time_last_gyro_x, time_last_gyro_z, time_last_angles, time_sensor_one, time_sensor_two, time_sensor_three, time_sensor_four, time_sensor_five, time_sensor_six, time_sensor_seven, time_line_similarity, time_zone_similarity
+
+    if not line_pid_enabled:
+        print("Control: line PID disabled (line_kp, line_ki and line_kd are 0), steering follows line_angle")
 
     # gpio setup
     forward_right = LED(in_1)
@@ -1761,9 +2404,6 @@ def control_loop():
     time.sleep(.25)
 
     calibration_switched_light = False
-    obstacle_is_ramp = "none"
-    iteration_limit_time = time.perf_counter()
-    max_iterations = 60
     iteration_time = time.perf_counter()
     counter = 0
 
@@ -1776,19 +2416,29 @@ def control_loop():
     timer.set_timer("was_ramp_up", .01)
 
     while not terminate.value:
+        # one tick per new frame of the camera in use or whatever the running maneuver waits for, at the latest every 1 / 60 s
+        machine = active_machine()
+        scheduler.wait(machine.wake or (("zone", "corner") if machine is zone_machine else ("line",)), control_state())
+
         if calibrate_color_status.value == "none":
             if calibration_switched_light:
                 switch_lights(True)
                 calibration_switched_light = False
 
+            # read every perception output of the same camera frame
+            frame = snapshot()
+
             # update average time values
-            update_sensor_average()
+            update_sensor_average(frame)
 
             # update runtime variables
             switch.value = True if button.value == 1 else False
             rotation_y.value = get_rotation()
 
             if not switch.value and run and objective.value == "debug":
+                line_machine.cancel()
+                zone_machine.cancel()
+
                 status.value = f'Stopped (debug)'
                 steer()
                 servo_pos(3)
@@ -1797,6 +2447,9 @@ def control_loop():
                 run = False
 
             if not switch.value and run and not objective.value == "debug":
+                line_machine.cancel()
+                zone_machine.cancel()
+
                 status.value = f'Stopped'
                 steer()
                 servo_pos(3)
@@ -1815,8 +2468,8 @@ def control_loop():
                 switch_lights(True)
 
                 objective.value = "follow_line"  # follow_line
-                line_status.value = "line_detected"  # line_detected
-                zone_status.value = "begin"  # begin
+                line_machine.goto(LineState.LINE_DETECTED)
+                zone_machine.goto(ZoneState.BEGIN)
 
                 run = False
 
@@ -1866,424 +2519,21 @@ def control_loop():
                 run = True
 
             if run:
-                if objective.value == "follow_line":
-
-                    if seesaw_detected():
-                        status.value = f'Avoiding seesaw'
-
-                        avoid_seesaw()
-                        time_last_gyro_y = fill_array(0)
-                        time_sensor_one = fill_array(0)
-                        time_sensor_two = fill_array(0)
-                        time_sensor_five = fill_array(0)
-
-                        timer.set_timer("obstacle_detect_cooldown", 1.5)
-                        timer.set_timer("stuck_cooldown", 4)
-                        continue
-
-                    # detected line on last frame
-                    if line_status.value == "line_detected":
-
-                        if not line_detected.value and rotation_y.value == "none" and not ramp_ahead.value:
-                            line_status.value = "gap_detected"
-
-                        if red_detected.value:
-                            line_status.value = "stop"
-
-                        if obstacle_detected() or (obstacle_detected_again() and rotation_y.value == "ramp_up"):
-                            line_status.value = "obstacle_detected"
-
-                        if silver_detected():
-                            if validate_silver():
-                                if program_continue():
-                                    if zone_start_time.value == -1:
-                                        zone_start_time.value = time.perf_counter()
-
-                                    line_status.value = "position_entry"
-                            else:
-                                steer(0, .7)
-                                time.sleep(.3)
-                                steer()
-                                line_status.value = "line_detected"
-                            timer.set_timer("silver_cooldown", 1.3)
-                            timer.set_timer("stuck_cooldown", 6)
-                            continue
-
-                    # still line detected
-                    if line_status.value == "line_detected":
-                        if turn_dir.value == "turn_around":
-                            status.value = f'Turning around {"right" if last_turn_dir == "r" else "left"}'
-
-                            last_turn_dir = turn_around()
-                            continue
-
-                        status.value = f'Following Line'
-
-                        steer(line_angle.value, get_speed(line_angle.value))
-
-                        time_silver_detected = add_time_value(time_silver_detected, silver_value.value)
-                        time_last_angles = add_time_value(time_last_angles, line_angle.value)
-
-                        if get_time_average(time_line_similarity, 15) > .88 and timer.get_timer("stuck_cooldown"):
-                            avoid_stuck()
-                            timer.set_timer("stuck_cooldown", 4 if rotation_y.value == "none" else 8)
-
-
-                    elif line_status.value == "stop":
-                        stop_for_red()
-                        line_status.value = "line_detected"
-                        continue
-
-
-                    elif line_status.value == "gap_detected":
-                        verified_gap = orientate_gap()
-
-                        if verified_gap:
-                            timer.set_timer("gap_avoid", .4)
-                        else:
-                            line_status.value = "line_detected"
-                            min_line_size.value = 3000
-                            time.sleep(.1)
-
-                        timer.set_timer("stuck_cooldown", 4)
-                        continue
-
-
-                    elif line_status.value == "gap_avoid":
-                        status.value = f'Avoiding gap'
-
-                        if line_detected.value or silver_detected() or obstacle_detected():
-                            min_line_size.value = 3000
-                            line_status.value = "line_detected"
-                            timer.set_timer("stuck_cooldown", 4)
-                            continue
-                        else:
-                            steer(0, .6)
-
-                        if timer.get_timer("gap_avoid"):
-                            min_line_size.value = 4500
-                            steer(200, .6)
-                            time.sleep(1.35)
-                            drive_back_until_line(.3, .6)
-
-                            line_status.value = "line_detected"
-                            time.sleep(.1)
-                            timer.set_timer("stuck_cooldown", 4)
-                            continue
-
-
-                    elif line_status.value == "obstacle_detected":
-                        status.value = f'Obstacle detected'
-
-                        start_angle = sensor_x.value
-                        obstacle_is_ramp = rotation_y.value
-                        if turn_for_obstacle():
-                            line_status.value = "obstacle_avoid"
-
-                            if rotation_y.value == "none":
-                                timer.set_timer("obstacle_avoid", 1.6)
-                            elif rotation_y.value == "ramp_up":
-                                timer.set_timer("obstacle_avoid", 3.5)
-                            elif rotation_y.value == "ramp_down":
-                                timer.set_timer("obstacle_avoid", 1)
-
-                            timer.set_timer("obstacke_cooldown", .45)
-
-                            obstacle_direction.value = obstacle_dir[obstacle_count % len(obstacle_dir)]
-
-                            time_line_similarity = fill_array(0, 1200)
-                            min_line_size.value = 6500
-                            time.sleep(.1)
-                        else:
-                            status.value = f'Obstacle failed, returning to {start_angle}°'
-                            if program_continue():
-                                return_after_failed_obstacle(start_angle)
-                            line_status.value = "line_detected"
-                        continue
-
-
-                    elif line_status.value == "obstacle_avoid":
-                        status.value = f'Avoiding obstacle'
-
-                        if obstacle_dir[obstacle_count % len(obstacle_dir)] == "l" and not timer.get_timer("obstacle_avoid"):
-                            if rotation_y.value == "none":
-                                steer(max_turn_angle, .7)
-                            elif rotation_y.value == "ramp_up":
-                                steer(max_turn_angle - 40, 1)
-                            elif rotation_y.value == "ramp_down":
-                                steer(max_turn_angle, .3)
-
-                        elif obstacle_dir[obstacle_count % len(obstacle_dir)] == "l" and timer.get_timer("obstacle_avoid") and not rotation_y.value == "ramp_up":
-                            steer(180, .6)
-                            time.sleep(.1)
-                            if rotation_y.value == "none":
-                                timer.set_timer("obstacle_avoid", .7)
-                            elif rotation_y.value == "ramp_up":
-                                timer.set_timer("obstacle_avoid", 1.9)
-                            elif rotation_y.value == "ramp_down":
-                                timer.set_timer("obstacle_avoid", .75)
-
-                        elif obstacle_dir[obstacle_count % len(obstacle_dir)] == "r" and not timer.get_timer("obstacle_avoid"):
-                            if rotation_y.value == "none":
-                                steer(-max_turn_angle, .7)
-                            elif rotation_y.value == "ramp_up":
-                                steer(-max_turn_angle + 40, 1)
-                            elif rotation_y.value == "ramp_down":
-                                steer(-max_turn_angle, .3)
-
-                        elif obstacle_dir[obstacle_count % len(obstacle_dir)] == "r" and timer.get_timer("obstacle_avoid") and not rotation_y.value == "ramp_up":
-                            steer(-180, .6)
-                            time.sleep(.1)
-                            if rotation_y.value == "none":
-                                timer.set_timer("obstacle_avoid", .7)
-                            elif rotation_y.value == "ramp_up":
-                                timer.set_timer("obstacle_avoid", 1.9)
-                            elif rotation_y.value == "ramp_down":
-                                timer.set_timer("obstacle_avoid", .75)
-
-                        if get_time_average(time_line_similarity, 15) > .88 and timer.get_timer("stuck_cooldown"):
-                            steer(180 if obstacle_dir[obstacle_count % len(obstacle_dir)] == "r" else -180, .7)
-                            time.sleep(.4)
-                            steer()
-                            time.sleep(.2)
-                            timer.set_timer("stuck_cooldown", 10)
-
-                        if line_detected.value and timer.get_timer("obstacke_cooldown"):
-                            min_line_size.value = 3000
-                            line_status.value = "obstacle_orientate"
-
-                            if obstacle_is_ramp == "none":
-                                orientate_after_obstacle(obstacle_dir[obstacle_count % len(obstacle_dir)])
-
-                                if line_detected.value:
-                                    steer(200, .7)
-                                    time.sleep(1)
-                                    steer()
-                            else:
-                                steer(0, .3 if obstacle_is_ramp == "ramp_down" else .8)
-                                time.sleep(.6 if obstacle_is_ramp == "ramp_down" else 1)
-                                steer(180 if obstacle_dir[obstacle_count % len(obstacle_dir)] == "r" else -180, .7)
-                                time.sleep(.3)
-
-                            time_sensor_one = fill_array(300)
-                            time_sensor_two = fill_array(300)
-                            time_sensor_five = fill_array(300)
-
-                            obstacle_count += 1
-                            line_status.value = "line_detected"
-                            timer.set_timer("stuck_cooldown", 4)
-                            continue
-
-
-                    elif line_status.value == "position_entry":
-                        status.value = f'Positioning for entry'
-                        if not speed_zone:
-                            time.sleep(.5)
-                        if rotation_y.value == "none":
-                            if position_for_entry():
-                                line_status.value = "line_detected"
-                                objective.value = "zone"
-                        else:
-                            line_status.value = "line_detected"
-                            objective.value = "zone"
-
-
-                elif objective.value == "zone":
-
-                    if zone_status.value == "begin":
-                        if not wait_time(2 if speed_zone else 4, "AI model to load", rotation="u" if rotation_y.value == "ramp_up" else "n"):
-                            continue
-
-                        status.value = f'Driving into zone'
-
-                        if rotation_y.value == "none":
-                            gyro_x_offset(0)
-                            gyro_y_offset(0)
-
-                        if not speed_zone:
-                            drive_until_wall(2.4 if rotation_y.value == "ramp_up" else .7)
-
-                            avoid_angle = -361
-                            if distance_left() < 200 or distance_right() < 200 and not (distance_left() < 200 and distance_right() < 200):
-                                if distance_left() > distance_right():
-                                    avoid_angle = add_angle(sensor_x.value, -90)
-                                else:
-                                    avoid_angle = add_angle(sensor_x.value, 90)
-
-                            drive_until_wall(1.3)
-
-                            if distance_left() < 200 or distance_right() < 200 and not (distance_left() < 200 and distance_right() < 200):
-                                if distance_left() > distance_right():
-                                    avoid_angle = add_angle(sensor_x.value, -90)
-                                else:
-                                    avoid_angle = add_angle(sensor_x.value, 90)
-
-                            if avoid_angle != -361:
-                                turn_to_angle(avoid_angle, tolerance=5)
-
-                                reason, time_driven = drive_until_wall(1, stop_when_black=True, stop_when_silver=True, stop_when_victim=True, return_driven_time=True, speed=.9)
-
-                                if reason in ["black", "silver"]:
-                                    steer(200, .7)
-                                    time.sleep(.3)
-                                    turn_to_angle(add_angle(sensor_x.value, 180), tolerance=5, direction="r")
-
-                                    drive_until_wall(time_driven + 1.8, stop_when_black=True, stop_when_silver=True)
-
-                        else:
-                            drive_until_wall(2 if rotation_y.value == "ramp_up" else 1, speed=1)
-
-                        timer.set_timer("max_search_time", 240)
-                        time_zone_similarity = fill_array(0.7, 1200)
-
-                        if dumped_dead_victims:
-                            zone_status.value = "deposit_red"
-                        else:
-                            zone_status.value = "find_balls"
-                        continue
-
-
-                    elif zone_status.value == "find_balls":
-                        status.value = f'Searching for victims'
-
-                        if ball_type.value == "none":
-                            search_for_victims()
-                            if timer.get_timer("max_search_time"):
-                                zone_status.value = "deposit_green"
-                                continue
-                        else:
-                            zone_status.value = "pickup_ball"
-                            continue
-
-
-                    elif zone_status.value == "pickup_ball":
-                        time_victim_type = empty_time_arr(1200)
+                machine = active_machine()
 
-                        if turn_to_victim():
-                            if drive_to_victim(speed=1 if speed_zone else .6):
-                                victim_type = "silver ball" if get_time_average(time_victim_type, 10) > 0.5 else "black ball"
-                                status.value = f"Picking up {'alive' if victim_type == 'silver ball' else 'dead'} victim"
-
-                                alive = victim_type == "silver ball"
-                                if not alive and picked_up_dead_count.value > 0:
-                                    alive = True
-                                elif alive and picked_up_alive_count.value > 1:
-                                    alive = False
-
-                                if pick_up_victim(alive):
-                                    if alive and picked_up_alive_count.value < 2:
-                                        picked_up_alive_count.value += 1
-                                    else:
-                                        picked_up_dead_count.value += 1
-
-                                    status.value = f"Picked up {'alive' if alive else 'dead'} victim, new total: {picked_up_alive_count.value + picked_up_dead_count.value} victims"
-                                    if not speed_zone:
-                                        time.sleep(1)
-                                else:
-                                    status.value = f"Failed to pick up {'alive' if alive else 'dead'} victim"
-                                    if not speed_zone:
-                                        time.sleep(1)
-
-                                if picked_up_alive_count.value + picked_up_dead_count.value == 3:
-                                    zone_status.value = "deposit_green"
-                                    continue
-
-                        zone_status.value = "find_balls"
-                        continue
-
-
-                    elif zone_status.value == "deposit_green":
-                        if not dumped_alive_victims:
-                            status.value = f'Searching for green evacuation point'
-
-                            search_for_corner()
-
-                            if turn_to_corner("green"):
-                                if drive_to_corner("green", speed=.75 if speed_zone else .6):
-                                    if dump_victims(True):
-
-                                        if speed_zone:
-                                            dumped_alive_victims = True
-                                        else:
-                                            if wait_time(6, "confirmation of successful dump", rotation="n"):
-                                                dumped_alive_victims = True
-
-                                        time_zone_similarity = fill_array(0.7, 1200)
-                                        zone_status.value = "deposit_red"
-                        else:
-                            servo_pos(6)
-                            zone_status.value = "deposit_red"
-
-
-                    elif zone_status.value == "deposit_red":
-                        status.value = f'Searching for red evacuation point'
-
-                        search_for_corner()
-
-                        if turn_to_corner("red"):
-                            if drive_to_corner("red", speed=.75 if speed_zone else .6):
-                                if dump_victims(False, dumped_dead_victims):
-                                    if not dumped_dead_victims:
-                                        if speed_zone:
-                                            dumped_dead_victims = True
-                                        else:
-                                            if wait_time(6, "confirmation of successful dump", rotation="n"):
-                                                dumped_dead_victims = True
-                                    time_zone_similarity = fill_array(0.7, 1200)
-                                    zone_status.value = "exit"
-
-
-                    elif zone_status.value == "exit":
-                        status.value = f'Searching for exit'
-
-                        if orientate_at_corner:
-                            gyro_x_offset(45)
-
-                        switch_lights(True)
-
-                        if find_exit():
-                            status.value = f'Found zone exit'
-                            if not speed_zone:
-                                time.sleep(1)
-
-                                zone_status.value = "get_exit_angle"
-                                position_exit()
-
-                            else:
-                                switch_lights(True)
-
-                            zone_status.value = "exit"
-
-                            if not speed_zone:
-                                if not wait_time(6, "confirmation of exit position", rotation="n"):
-                                    continue
-
-                            timer.set_timer("obstacle_detect_cooldown", 3)
-
-                            objective.value = "follow_line"
-                            line_status.value = "line_detected"
-                            zone_status.value = "begin"
-
-                            zone_done = True
-                            time_line_similarity = fill_array(0, 1200)
-
-                            if speed_zone:
-                                steer(0, .6)
-
-                            time.sleep(.7)
-                            steer()
-                            time.sleep(1)
-
-                            zone_start_time.value = -1
-
-                            continue
-
-
-                elif objective.value == "debug":
+                if objective.value == "debug" and machine.maneuver is None:
                     status.value = f'Debugging'
 
                     time.sleep(1)
 
+                elif machine is line_machine and machine.maneuver is None and seesaw_detected():
+                    status.value = f'Avoiding seesaw'
+
+                    machine.start(avoid_seesaw_steps())
+                    machine.tick(frame)
+
+                else:
+                    machine.tick(frame)
 
         elif calibrate_color_status.value == "calibrate":
             if not calibration_switched_light:
@@ -2293,16 +2543,21 @@ def control_loop():
                     switch_lights(True)
                 calibration_switched_light = True
 
-        if time.perf_counter() - iteration_limit_time < 1 / max_iterations:
-            time.sleep(abs(1 / max_iterations - (time.perf_counter() - iteration_limit_time)))
-        iteration_limit_time = time.perf_counter()
-
         counter += 1
         if time.perf_counter() - iteration_time > 1:
             iterations_control.value = int(counter / (time.perf_counter() - iteration_time))
             iteration_time = time.perf_counter()
             counter = 0
 
+    scheduler.stop()
+    scheduler.dump("control_profile.csv")
+    line_machine.dump("line_states.csv")
+    zone_machine.dump("zone_states.csv")
+    dump_motions("motions.csv")
+    line_controller.dump("line_pid.csv")
+    heading_controller.dump("heading_pid.csv")
+    print(f"Control: {scheduler.missed} missed deadlines, per state in control_profile.csv")
+
     servo_pos(5)
     time.sleep(.25)
     servo_pos(7)
@@ -1,22 +1,14 @@
 import os
-from multiprocessing import shared_memory
 
 import cv2
-from libcamera import controls
 from numba import njit
-from picamera2 import Picamera2
-from skimage.metrics import structural_similarity
-from ultralytics import YOLO
 
-from Managers import Timer
+from Managers import CameraFrameSource, MorphologyChain, SimilarityDetector, StageTimer, Timer
+from Vision import ColorLut
 from mp_manager import *
 
 debug_mode = False
 
-# Disable libcamera and Picamera2 logging
-Picamera2.set_logging(Picamera2.ERROR)
-os.environ["LIBCAMERA_LOG_LEVELS"] = "4"
-
 camera_x = 448
 camera_y = 252
 
@@ -57,6 +49,9 @@ multiple_bottom_side = camera_x / 2
 
 timer = Timer()
 
+stage_timer = StageTimer()
+color_lut = ColorLut((camera_y, camera_x))
+
 
 def save_image(image):
     if not os.path.exists("../../Ai/datasets/images_to_annotate"):
@@ -92,6 +87,31 @@ def update_color_values():
     red_min_2_zone = np.array(config_manager.read_variable('color_values_line', 'red_min_2_zone'))
     red_max_2_zone = np.array(config_manager.read_variable('color_values_line', 'red_max_2_zone'))
 
+    color_lut.build({"black_normal_top": (black_min, black_max_normal_top),
+                     "black_normal_bottom": (black_min, black_max_normal_bottom),
+                     "black_silver_validate_top_off": (black_min, black_max_silver_validate_top_off),
+                     "black_silver_validate_bottom_off": (black_min, black_max_silver_validate_bottom_off),
+                     "black_silver_validate_top_on": (black_min, black_max_silver_validate_top_on),
+                     "black_silver_validate_bottom_on": (black_min, black_max_silver_validate_bottom_on),
+                     "black_ramp_down_top": (black_min, black_max_ramp_down_top),
+                     "black_zone": (black_min, black_max_zone)},
+                    {"green": [(green_min, green_max)],
+                     "red": [(red_min_1, red_max_1), (red_min_2, red_max_2)],
+                     "green_zone": [(green_min_zone, green_max_zone)],
+                     "red_zone": [(red_min_1_zone, red_max_1_zone), (red_min_2_zone, red_max_2_zone)]})
+
+
+def update_morphology():
+    global black_morphology, green_morphology, red_morphology, zone_morphology
+
+    # "black" is used for every line_status without its own "black_<line_status>" chain
+    morphology = config_manager.read_section('morphology')
+    black_morphology = {variable[len("black_"):]: MorphologyChain(steps) for variable, steps in morphology.items() if variable.startswith("black_")}
+    black_morphology["default"] = MorphologyChain(morphology['black'])
+    green_morphology = MorphologyChain(morphology['green'])
+    red_morphology = MorphologyChain(morphology['red'])
+    zone_morphology = MorphologyChain(morphology['zone'])
+
 
 def check_contour_size(contours, contour_color="red", size=15000):
     if contour_color == "red":
@@ -524,11 +544,11 @@ def calc_silver_angle(silver_image):
 ########################################################################################################################
 
 
-def line_cam_loop():
+def line_cam_loop(frame_source=None, frame_callback=None):
+    # frame_source defaults to the line camera, replay.py passes recorded or synthetic frames and a frame_callback
+    # that is called after every processed frame
     global cv2_img, x_last, y_last, time_line_angle
 
-    model = YOLO('../../Ai/models/silver_zone_entry/silver_classify_s.onnx', task='classify')
-
     x_last = camera_x / 2
     y_last = camera_y / 2
 
@@ -540,20 +560,12 @@ def line_cam_loop():
     time_last_bottom_point_x = empty_time_arr()
     time_last_average_line_point = empty_time_arr()
 
-    camera = Picamera2()
-
-    mode = camera.sensor_modes[0]
-    camera.configure(camera.create_video_configuration(sensor={'output_size': mode['size'], 'bit_depth': mode['bit_depth']}))
-
-    camera.start()
-    camera.set_controls({"AfMode": controls.AfModeEnum.Manual, "LensPosition": 6.5, "FrameDurationLimits": (1000000 // 50, 1000000 // 50)})  # {"AfMode": controls.AfModeEnum.Manual, "LensPosition": 0.4} {"AfMode": controls.AfModeEnum.Continuous, "AfSpeed": controls.AfSpeedEnum.Fast}
-    time.sleep(0.1)
-
-    if not debug_mode:
-        shm_cam1 = shared_memory.SharedMemory(name="shm_cam_1", create=True, size=338688)
+    if frame_source is None:
+        frame_source = CameraFrameSource(0, sensor_mode=0, lens_position=6.5, frame_rate=50)
 
     calibration_saved = True
     update_color_values()
+    update_morphology()
 
     # Kernal for noise reduction
     kernal = np.ones((3, 3), np.uint8)
@@ -568,7 +580,8 @@ def line_cam_loop():
     max_frames_line = 90
     fps_limit_time = time.perf_counter()
 
-    last_image = np.zeros((camera_y, camera_x), dtype=np.uint8)
+    # Similarity of the black image to the one 30 frames earlier, for the stuck detection
+    similarity_detector = SimilarityDetector(30)
 
     timer.set_timer("image_similarity", .5)
     timer.set_timer("multiple_bottom", .05)
@@ -579,88 +592,68 @@ def line_cam_loop():
     timer.set_timer("right_marker_up", .05)
     timer.set_timer("left_marker_up", .05)
 
-    do_inference_counter = 10
-    check_similarity_counter = 0
-    check_similarity_limit = 30
-
     while not terminate.value:
-        raw_capture = camera.capture_array()
+        stage_timer.start()
+        raw_capture, capture_time = frame_source.read()
+        if raw_capture is None:
+            break
+        stage_timer.lap("capture")
         raw_capture = cv2.resize(raw_capture, (camera_x, camera_y))
+        stage_timer.lap("resize")
         cv2_img = cv2.cvtColor(raw_capture, cv2.COLOR_RGBA2BGR)
+        stage_timer.lap("convert")
 
         frame_limit = max_frames_zone if objective.value == "zone" and (zone_status.value == "begin" or zone_status.value == "find_balls" or zone_status.value == "pickup_ball") else max_frames_line
-        if objective.value == "follow_line" and not rotation_y.value in ["ramp_down", "ramp_up"]:
-            do_inference_limit = 7
-        elif objective.value == "follow_line" and rotation_y.value in ["ramp_down", "ramp_up"]:
-            do_inference_limit = 4
-        else:
-            do_inference_limit = 10
 
-        if time.perf_counter() - fps_limit_time > 1 / frame_limit:
+        # Recorded frames are never skipped
+        if time.perf_counter() - fps_limit_time > 1 / frame_limit or not frame_source.realtime:
             fps_limit_time = time.perf_counter()
 
+            # Everything published for this frame becomes visible at once with state.commit("line")
+            state.begin("line")
+            line_frame.value += 1
+            line_frame_time.value = capture_time
+
             if calibrate_color_status.value == "none":
 
-                # Silver AI prediction
+                # Silver AI prediction, silver_cam classifies the newest posted frame whenever it is free
                 if objective.value == "follow_line":
-                    if do_inference_counter >= do_inference_limit:
-                        results = model.predict(raw_capture, imgsz=128, conf=0.4, workers=4, verbose=False)
-                        result = results[0].numpy()
-
-                        confidences = result.probs.top5conf
-                        silver_value.value = confidences[0] if result.probs.top1 == 1 else confidences[1]  # 0 = Line, 1 = Silver
-                        do_inference_counter = 0
-
-                    do_inference_counter += 1
+                    silver_frames.write(raw_capture, capture_time)
                     if silver_value.value > .5:
                         cv2.circle(cv2_img, (10, camera_y - 10), 5, (100, 100, 100), -1, cv2.LINE_AA)
+                    stage_timer.lap("silver_ai")
 
                 if objective.value == "follow_line":
-                    hsv_image = cv2.cvtColor(cv2_img, cv2.COLOR_BGR2HSV)
-                    green_image = cv2.inRange(hsv_image, green_min, green_max)
-                    red_image = cv2.inRange(hsv_image, red_min_1, red_max_1) + cv2.inRange(hsv_image, red_min_2, red_max_2)
-
                     # Adjust black calibration for zone entry
                     if line_status.value in ["check_silver", "position_entry", "position_entry_1"]:
-                        black_image = cv2.inRange(cv2_img, black_min, black_max_silver_validate_bottom_off)
-                        black_image[0:int(camera_y * .7), 0:camera_x] = cv2.inRange(cv2_img, black_min, black_max_silver_validate_top_off)[0:int(camera_y * .7), 0:camera_x]
-
+                        black_top, black_bottom, top_rows = "black_silver_validate_top_off", "black_silver_validate_bottom_off", int(camera_y * .7)
                     elif line_status.value == "position_entry_2":
-                        black_image = cv2.inRange(cv2_img, black_min, black_max_silver_validate_bottom_on)
-                        black_image[0:int(camera_y * .4), 0:camera_x] = cv2.inRange(cv2_img, black_min, black_max_silver_validate_top_on)[0:int(camera_y * .4), 0:camera_x]
-
+                        black_top, black_bottom, top_rows = "black_silver_validate_top_on", "black_silver_validate_bottom_on", int(camera_y * .4)
                     else:
-                        black_image = cv2.inRange(cv2_img, black_min, black_max_normal_bottom)
-                        black_image[0:int(camera_y * .4), 0:camera_x] = cv2.inRange(cv2_img, black_min, black_max_normal_top)[0:int(camera_y * .4), 0:camera_x]
+                        black_top, black_bottom, top_rows = "black_normal_top", "black_normal_bottom", int(camera_y * .4)
 
-                    black_image -= green_image
-                    black_image[black_image < 2] = 0
+                    # Black (without green), green, red and the ramp down black of the top, green and red only around coarse grid hits
+                    black_image, green_image, red_image, black_image_2, black_mean, black_mean_2 = color_lut.line_masks(cv2_img, black_top, black_bottom, top_rows, "black_ramp_down_top", int(camera_y * .4), int(camera_y * .25))
 
                     # Change black_max to black_max_ramp_down_top if the top section of the image is too dark
                     dark_ahead = False
-                    black_mean = round(np.mean(black_image[0:int(camera_y * .25), 0:camera_x]), 2)
+                    black_mean = round(black_mean, 2)
                     if black_mean > 90 and not line_status.value == "check_silver":
-                        black_image_2 = cv2.inRange(cv2_img, black_min, black_max_ramp_down_top)
-                        black_image_2 -= green_image
-                        black_image_2[black_image_2 < 2] = 0
-
-                        black_mean_2 = round(np.mean(black_image_2[0:int(camera_y * .25), 0:camera_x]), 2)
+                        black_mean_2 = round(black_mean_2, 2)
 
                         if black_mean_2 + 30 < black_mean:  # 20
                             cv2.circle(cv2_img, (10, 10), 5, (0, 0, 0), -1, cv2.LINE_AA)
-                            black_image[0:int(camera_y * .4), 0:camera_x] = black_image_2[0:int(camera_y * .4), 0:camera_x]
+                            black_image[0:int(camera_y * .4), 0:camera_x] = black_image_2
                             dark_ahead = True
 
                     ramp_ahead.value = dark_ahead
 
                     black_average.value = np.mean(black_image[:])
+                    stage_timer.lap("in_range")
 
                     # Check für image similarity
-                    if check_similarity_counter >= check_similarity_limit:
-                        line_similarity.value = structural_similarity(black_image, last_image)
-                        last_image = black_image.copy()
-                        check_similarity_counter = 0
-                    check_similarity_counter += 1
+                    line_similarity.value = similarity_detector.update(black_image)
+                    stage_timer.lap("ssim")
 
                     # Cut out certain parts of the image
                     if line_status.value == "obstacle_avoid" or line_status.value == "obstacle_detected":
@@ -681,26 +674,10 @@ def line_cam_loop():
                         cv2.rectangle(black_image, (0, 0), (int(camera_x * .25), camera_y), 0, -1)
                         cv2.rectangle(black_image, (int(camera_x * .75), 0), (camera_x, camera_y), 0, -1)
 
-                    # Noise reduction
-                    if line_status.value == "position_entry_2":
-                        black_image = cv2.erode(black_image, kernal, iterations=1)
-                        black_image = cv2.dilate(black_image, kernal, iterations=11)
-                        black_image = cv2.erode(black_image, kernal, iterations=9)
-                    elif line_status.value == "gap_avoid":
-                        black_image = cv2.erode(black_image, kernal, iterations=5)
-                        black_image = cv2.dilate(black_image, kernal, iterations=8)
-                    else:
-                        black_image = cv2.erode(black_image, kernal, iterations=5)
-                        black_image = cv2.dilate(black_image, kernal, iterations=17) # Previous values: 12 | 16
-                        black_image = cv2.erode(black_image, kernal, iterations=9)  # Previous values: 4 | 8
-
-                    green_image = cv2.erode(green_image, kernal, iterations=1)
-                    green_image = cv2.dilate(green_image, kernal, iterations=11)
-                    green_image = cv2.erode(green_image, kernal, iterations=9)
-
-                    red_image = cv2.erode(red_image, kernal, iterations=1)
-                    red_image = cv2.dilate(red_image, kernal, iterations=11)
-                    red_image = cv2.erode(red_image, kernal, iterations=9)
+                    # Noise reduction, chains per line_status are set in the [morphology] section of config.ini
+                    black_image = black_morphology.get(line_status.value, black_morphology["default"]).apply(black_image)
+                    green_image = green_morphology.apply(green_image)
+                    red_image = red_morphology.apply(red_image)
 
                     # Calculate the angle of the silver line
                     if line_status.value == "position_entry_1":
@@ -710,6 +687,7 @@ def line_cam_loop():
                         silver_image = black_image.copy() - silver_black_image.copy()
                         silver_image[silver_image < 2] = 0
                         calc_silver_angle(silver_image)
+                    stage_timer.lap("morphology")
 
                     # Find contours in the image
                     contours_grn, _ = cv2.findContours(green_image, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
@@ -719,6 +697,7 @@ def line_cam_loop():
                     blk_contour_area = np.array([cv2.contourArea(i) for i in contours_blk])
                     blk_mask = blk_contour_area > min_line_size.value
                     contours_blk = [c for c, m in zip(contours_blk, blk_mask) if m]
+                    stage_timer.lap("contours")
 
                     # Check for red line
                     red_detected.value = check_contour_size(contours_red)
@@ -756,11 +735,13 @@ def line_cam_loop():
                     else:
                         turn_dir.value = turn_direction
                         line_crop.value = .75 if rotation_y.value == "ramp_up" or not timer.get_timer("was_ramp_up") else .48
+                    stage_timer.lap("green")
 
                     # Determine the correct line
                     if len(contours_blk) > 0:
                         line_detected.value = True
                         blackline, black_line_crop = determine_correct_line(contours_blk)
+                        stage_timer.lap("correct_line")
                         line_size.value = cv2.contourArea(blackline)
 
                         # Calculate the gap angle 
@@ -814,6 +795,7 @@ def line_cam_loop():
                         gap_angle.value = -181
                         gap_center_x.value = -181
                         gap_center_y.value = -1
+                    stage_timer.lap("angle")
 
 
                 ########################################################################################################################
@@ -821,13 +803,13 @@ def line_cam_loop():
                 ########################################################################################################################
 
                 elif objective.value == "zone":
-                    hsv_image = cv2.cvtColor(cv2_img, cv2.COLOR_BGR2HSV)
-                    green_image = cv2.inRange(hsv_image, green_min_zone, green_max_zone)
-                    red_image = cv2.inRange(hsv_image, red_min_1_zone, red_max_1_zone) + cv2.inRange(hsv_image, red_min_2_zone, red_max_2_zone)
+                    classes = color_lut.classify(cv2_img)
+                    green_image = color_lut.mask(classes, "green_zone")
+                    red_image = color_lut.mask(classes, "red_zone")
 
                     if zone_status.value in ["exit", "deposit_red", "deposit_green"]:  # With LEDs on
-                        black_image = cv2.inRange(cv2_img, black_min, black_max_normal_bottom)
-                        black_image[0:int(camera_y * .4), 0:camera_x] = cv2.inRange(cv2_img, black_min, black_max_normal_top)[0:int(camera_y * .4), 0:camera_x]
+                        black_image = color_lut.mask(classes, "black_normal_bottom")
+                        black_image[0:int(camera_y * .4), 0:camera_x] = color_lut.mask(classes[0:int(camera_y * .4), 0:camera_x], "black_normal_top")
 
                         black_image -= green_image
                         black_image[black_image < 2] = 0
@@ -835,19 +817,16 @@ def line_cam_loop():
                         black_image -= red_image
                         black_image[black_image < 2] = 0
                     else:
-                        black_image = cv2.inRange(cv2_img, black_min, black_max_zone)
+                        black_image = color_lut.mask(classes, "black_zone")
 
                     black_average.value = np.mean(black_image[:])
+                    stage_timer.lap("in_range")
 
                     # Noise reduction
-                    black_image = cv2.erode(black_image, kernal, iterations=5)
-                    black_image = cv2.dilate(black_image, kernal, iterations=8)
-
-                    green_image = cv2.erode(green_image, kernal, iterations=5)
-                    green_image = cv2.dilate(green_image, kernal, iterations=8)
-
-                    red_image = cv2.erode(red_image, kernal, iterations=5)
-                    red_image = cv2.dilate(red_image, kernal, iterations=8)
+                    black_image = zone_morphology.apply(black_image)
+                    green_image = zone_morphology.apply(green_image)
+                    red_image = zone_morphology.apply(red_image)
+                    stage_timer.lap("morphology")
 
                     # Find contours in the image
                     contours_grn, _ = cv2.findContours(green_image, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
@@ -858,6 +837,8 @@ def line_cam_loop():
                     blk_mask = blk_contour_area > min_line_size.value
                     contours_blk = [c for c, m in zip(contours_blk, blk_mask) if m]
 
+                    stage_timer.lap("contours")
+
                     zone_found_black.value = check_contour_size(contours_blk, contour_color="black", size=16500)
                     zone_found_green.value = check_contour_size(contours_grn, contour_color="green", size=9000)
                     zone_found_red.value = check_contour_size(contours_red, contour_color="red", size=9000)
@@ -872,6 +853,7 @@ def line_cam_loop():
                                 cv2.line(cv2_img, (int(p1[0]), int(p1[1])), (int(p2[0]), int(p2[1])), (0, 255, 0), 2)
                         else:
                             exit_angle.value = -181
+                    stage_timer.lap("zone")
 
 
             ########################################################################################################################
@@ -1081,6 +1063,8 @@ def line_cam_loop():
 
                 cv2_img = cv2.cvtColor(cv2_img, cv2.COLOR_GRAY2BGR)
 
+            state.commit("line")
+
             # FPS Counter
             counter += 1
             if time.perf_counter() - fps_time > 1:
@@ -1092,18 +1076,19 @@ def line_cam_loop():
 
             # Checking the shared memory buffer size of the image
             # print(cv2_img.size)
+            stage_timer.lap("output")
 
             if debug_mode:
                 cv2.imshow("Line Camera", cv2_img)
                 if cv2.waitKey(1) & 0xFF == ord('q'):
                     break
             else:
-                buf = np.ndarray(cv2_img.shape, dtype=cv2_img.dtype, buffer=shm_cam1.buf)
-                buf[:] = cv2_img[:]
+                cam_1_frames.write(cv2_img)
+            stage_timer.lap("shm_copy")
+            line_profile.add(stage_timer.stages)
 
-    if not debug_mode:
-        shm_cam1.close()
-        shm_cam1.unlink()
+            if frame_callback is not None:
+                frame_callback(stage_timer.stages)
 
 
 if debug_mode:
@@ -1,6 +1,6 @@
 import tkinter
 from datetime import timedelta
-from multiprocessing import Process, shared_memory
+from multiprocessing import Process
 from tkinter import *
 
 import customtkinter as ctk
@@ -13,6 +13,7 @@ from control import control_loop
 from line_cam import line_cam_loop
 from mp_manager import *
 from sensor_serial import serial_loop
+from silver_cam import silver_loop
 from zone_cam import zone_cam_loop
 
 ctk.set_appearance_mode("Dark")  # Modes: "System" (standard), "Dark", "Light"
@@ -26,6 +27,8 @@ camera_height_2 = 151
 
 last_canvas = 1
 display_status = "none"
+cam_1_sequence = 0
+cam_2_sequence = 0
 
 data_font_size = 15
 label_color = "#141414"
@@ -326,8 +329,6 @@ class App(ctk.CTk):
 
     def exit(self):
         self.destroy()
-        cam_1_stream.close()
-        cam_2_stream.close()
 
         terminate.value = True
 
@@ -337,6 +338,14 @@ class App(ctk.CTk):
             process.terminate()
             time.sleep(.5)
 
+        line_profile.dump("line_profile.csv")
+
+        cam_1_frames.unlink()
+        cam_2_frames.unlink()
+        silver_frames.unlink()
+        line_profile.unlink()
+        state.unlink()
+
     @staticmethod
     def capture_image():
         capture_image.value = True
@@ -484,7 +493,7 @@ class App(ctk.CTk):
             self.set_calibration_status()
 
     def main(self, *args):
-        global cam_1_stream, cam_2_stream, rgb_img_arr_cam_2, last_canvas, display_status
+        global cam_1_sequence, cam_2_sequence, last_canvas, display_status
 
         self.label_sensor_1_var.set(f"{sensor_one.value:.0f} mm")
         self.label_sensor_2_var.set(f"{sensor_two.value:.0f} mm")
@@ -566,19 +575,24 @@ class App(ctk.CTk):
         elif picked_up_dead_count.value == 1:
             create_circle(65, 15, 10, self.canvas, 3)
 
-        cam_1_stream = shared_memory.SharedMemory(name="shm_cam_1")
-        bgr_img_arr_cam_1 = np.ndarray((252, 448, 3), dtype=np.uint8, buffer=cam_1_stream.buf)
-        rgb_img_arr_cam_1 = cv2.cvtColor(bgr_img_arr_cam_1, cv2.COLOR_BGR2RGB)
-        img_cam_1 = Image.fromarray(rgb_img_arr_cam_1)
-        img_tks_cam_1 = ctk.CTkImage(img_cam_1, size=(camera_width_1, camera_height_1))
-        self.top_camera.configure(image=img_tks_cam_1)
-
-        cam_2_stream = shared_memory.SharedMemory(name="shm_cam_2")
-        bgr_img_arr_cam_2 = np.ndarray((216, 640, 3), dtype=np.uint8, buffer=cam_2_stream.buf)
-        rgb_img_arr_cam_2 = cv2.cvtColor(bgr_img_arr_cam_2, cv2.COLOR_BGR2RGB)
-        img_cam_2 = Image.fromarray(rgb_img_arr_cam_2)
-        img_tks_cam_2 = ctk.CTkImage(img_cam_2, size=(camera_width_2, camera_height_2))
-        self.bottom_camera.configure(image=img_tks_cam_2)
+        # Only convert and redraw a camera image if a new frame arrived since the last tick
+        sequence, bgr_img_arr_cam_1 = cam_1_frames.read(cam_1_sequence)
+        if bgr_img_arr_cam_1 is not None:
+            rgb_img_arr_cam_1 = cv2.cvtColor(bgr_img_arr_cam_1, cv2.COLOR_BGR2RGB)
+            if not cam_1_frames.overwritten(sequence):
+                cam_1_sequence = sequence
+                img_cam_1 = Image.fromarray(rgb_img_arr_cam_1)
+                img_tks_cam_1 = ctk.CTkImage(img_cam_1, size=(camera_width_1, camera_height_1))
+                self.top_camera.configure(image=img_tks_cam_1)
+
+        sequence, bgr_img_arr_cam_2 = cam_2_frames.read(cam_2_sequence)
+        if bgr_img_arr_cam_2 is not None:
+            rgb_img_arr_cam_2 = cv2.cvtColor(bgr_img_arr_cam_2[:216], cv2.COLOR_BGR2RGB)
+            if not cam_2_frames.overwritten(sequence):
+                cam_2_sequence = sequence
+                img_cam_2 = Image.fromarray(rgb_img_arr_cam_2)
+                img_tks_cam_2 = ctk.CTkImage(img_cam_2, size=(camera_width_2, camera_height_2))
+                self.bottom_camera.configure(image=img_tks_cam_2)
 
         if not testing_mode:
             rotation = get_yaw_pitch(sensor_x.value, sensor_y.value)
@@ -595,6 +609,7 @@ if __name__ == "__main__":
     processes = [
         Process(target=serial_loop, args=()),
         Process(target=line_cam_loop, args=()),
+        Process(target=silver_loop, args=()),
         Process(target=zone_cam_loop, args=()),
         Process(target=control_loop, args=())
         ]
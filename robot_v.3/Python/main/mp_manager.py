@@ -1,104 +1,154 @@
+import os
 import time
-from multiprocessing import Manager
 
 import numpy as np
 
-from Managers import ConfigManager
+from Managers import ConfigManager, FrameRing, ImuFusion, StageProfile, StateManager, TimeSeries
 
 config_manager = ConfigManager('config.ini')
 
-manager = Manager()
-
-terminate = manager.Value("i", False)
-
-sensor_one = manager.Value("i", -2.0)  # Front Left
-sensor_two = manager.Value("i", -2.0)  # Front Right
-sensor_three = manager.Value("i", -2.0)  # Left
-sensor_four = manager.Value("i", -2.0)  # Right
-sensor_five = manager.Value("i", -2.0)  # Front Center
-sensor_six = manager.Value("i", -2.0)  # Back
-sensor_seven = manager.Value("i", -2.0)  # Gripper
-
-sensor_x_1 = manager.Value("i", 361.0)
-sensor_x_2 = manager.Value("i", 361.0)
-sensor_y_1 = manager.Value("i", 361.0)
-sensor_y_2 = manager.Value("i", 361.0)
-sensor_z_1 = manager.Value("i", 361.0)
-sensor_z_2 = manager.Value("i", 361.0)
-sensor_ax_1 = manager.Value("i", 361.0)
-sensor_ax_2 = manager.Value("i", 361.0)
-sensor_ay_1 = manager.Value("i", 361.0)
-sensor_ay_2 = manager.Value("i", 361.0)
-
-sensor_x = manager.Value("i", 361.0)
-sensor_y = manager.Value("i", 361.0)
-sensor_z = manager.Value("i", 361.0)
-
-x_offset_1 = manager.Value("i", 0.0)
-x_offset_2 = manager.Value("i", 0.0)
-y_offset_1 = manager.Value("i", 0.0)
-y_offset_2 = manager.Value("i", 0.0)
-z_offset_1 = manager.Value("i", 0.0)
-z_offset_2 = manager.Value("i", 0.0)
-x_acc_mean = manager.Value("i", 0.0)
-
-rotation_y = manager.Value("i", "none")  # "ramp_up""; "ramp_down"; "none"
-
-obstacle_direction = manager.Value("i", "n")
-min_line_size = manager.Value("i", 3000)
-
-line_angle = manager.Value("i", 0.)
-line_angle_y = manager.Value("i", -1)
-line_detected = manager.Value("i", False)
-line_crop = manager.Value("i", .6)
-line_similarity = manager.Value("i", 0.)
-gap_angle = manager.Value("i", 0.)
-gap_center_x = manager.Value("i", -180)
-gap_center_y = manager.Value("i", -1)
-silver_angle = manager.Value("i", -181)
-line_size = manager.Value("i", 0.)
-ramp_ahead = manager.Value("i", False)
-red_detected = manager.Value("i", False)
-turn_dir = manager.Value("i", "straight")  # "straight"; "left"; "right"; "turn_around"
-silver_value = manager.Value("i", -1.)
-black_average = manager.Value("i", 0.)
-
-ball_distance = manager.Value("i", 0)
-ball_type = manager.Value("i", "none")  # "none"; "black ball"; "silver ball"
-ball_width = manager.Value("i", -1)
-zone_similarity = manager.Value("i", 0.)
-zone_similarity_average = manager.Value("i", 0.)
-zone_found_black = manager.Value("i", False)
-zone_found_green = manager.Value("i", False)
-zone_found_red = manager.Value("i", False)
-exit_angle = manager.Value("i", -181.)
-corner_distance = manager.Value("i", -181)
-corner_size = manager.Value("i", 0)
-
-picked_up_alive_count = manager.Value("i", 0)
-picked_up_dead_count = manager.Value("i", 0)
-
-switch = manager.Value("i", False)
-program_start_time = manager.Value("i", -1)
-run_start_time = manager.Value("i", -1)
-zone_start_time = manager.Value("i", -1)
-
-capture_image = manager.Value("i", False)
-calibrate_color_status = manager.Value("i", "none")  # "none"; "calibrate"; "check"
-calibration_color = manager.Value("i", "z-g")  # "z-g"; "z-r"; "l-gz"; "l-rz"; "l-bz; "l-bn"; "l-bv"; "l-bvl"; "l-bd"; "l-gl"; "l-rl"
-iterations_control = manager.Value("i", -1)
-iterations_serial = manager.Value("i", -1)
-sensor1_disconnected = manager.Value("i", False)
-sensor2_disconnected = manager.Value("i", False)
-
-objective = manager.Value("i", "follow_line")  # "follow_line"; "zone"; "debug"
-line_status = manager.Value("i", "line_detected")  # "line_detected"; "gap_detected"; "gap_avoid"; "obstacle_detected"; "obstacle_avoid"; "obstacle_orientate"; "check_silver"; "position_entry"; "position_entry_1"; "position_entry_2"; "stop"
-zone_status = manager.Value("i", "begin")  # "begin"; "find_balls"; "pickup_ball"; "deposit_red"; "deposit_green"; "exit"
-
-status = manager.Value("i", "Stopped")
-
-
-def average_rotation():
+# All values shared between the processes live in one shared memory block, so reading them is a plain memory access
+# Groups: "system" (control / GUI), "distance", "imu", "pose" and "serial" (serial), "line" (line cam), "zone" (zone cam),
+# "silver" (silver classifier), "corner" (zone cam, reset by control)
+# Tools that run next to the robot (replay, benchmarks) set ROBOT_SHM_PREFIX before importing this module,
+# so they get their own segments instead of replacing and unlinking the live ones
+shm_prefix = os.environ.get("ROBOT_SHM_PREFIX", "")
+state = StateManager("shm_state", shm_prefix)
+
+terminate = state.Value("terminate", "system", "?", False)
+
+sensor_one = state.Value("sensor_one", "distance", "f8", -2.0)  # Front Left
+sensor_two = state.Value("sensor_two", "distance", "f8", -2.0)  # Front Right
+sensor_three = state.Value("sensor_three", "distance", "f8", -2.0)  # Left
+sensor_four = state.Value("sensor_four", "distance", "f8", -2.0)  # Right
+sensor_five = state.Value("sensor_five", "distance", "f8", -2.0)  # Front Center
+sensor_six = state.Value("sensor_six", "distance", "f8", -2.0)  # Back
+sensor_seven = state.Value("sensor_seven", "distance", "f8", -2.0)  # Gripper
+distance_time = state.Value("distance_time", "distance", "f8", -1)
+
+sensor_x_1 = state.Value("sensor_x_1", "imu", "f8", 361.0)
+sensor_x_2 = state.Value("sensor_x_2", "imu", "f8", 361.0)
+sensor_y_1 = state.Value("sensor_y_1", "imu", "f8", 361.0)
+sensor_y_2 = state.Value("sensor_y_2", "imu", "f8", 361.0)
+sensor_z_1 = state.Value("sensor_z_1", "imu", "f8", 361.0)
+sensor_z_2 = state.Value("sensor_z_2", "imu", "f8", 361.0)
+sensor_ax_1 = state.Value("sensor_ax_1", "imu", "f8", 361.0)
+sensor_ax_2 = state.Value("sensor_ax_2", "imu", "f8", 361.0)
+sensor_ay_1 = state.Value("sensor_ay_1", "imu", "f8", 361.0)
+sensor_ay_2 = state.Value("sensor_ay_2", "imu", "f8", 361.0)
+
+imu_time = state.Value("imu_time", "imu", "f8", -1)
+
+# Fused pose, written by average_rotation together with the IMU sample it is fused from
+sensor_x = state.Value("sensor_x", "pose", "f8", 361.0)
+sensor_y = state.Value("sensor_y", "pose", "f8", 361.0)
+sensor_z = state.Value("sensor_z", "pose", "f8", 361.0)
+pose_time = state.Value("pose_time", "pose", "f8", -1)
+
+# Set by control, not part of the "imu" transactions of the serial process, which would overwrite them with the values from before
+x_offset_1 = state.Value("x_offset_1", "system", "f8", 0.0)
+x_offset_2 = state.Value("x_offset_2", "system", "f8", 0.0)
+y_offset_1 = state.Value("y_offset_1", "system", "f8", 0.0)
+y_offset_2 = state.Value("y_offset_2", "system", "f8", 0.0)
+z_offset_1 = state.Value("z_offset_1", "system", "f8", 0.0)
+z_offset_2 = state.Value("z_offset_2", "system", "f8", 0.0)
+x_acc_mean = state.Value("x_acc_mean", "imu", "f8", 0.0)
+
+rotation_y = state.Value("rotation_y", "system", "U16", "none")  # "ramp_up""; "ramp_down"; "none"
+
+obstacle_direction = state.Value("obstacle_direction", "system", "U4", "n")
+min_line_size = state.Value("min_line_size", "system", "i8", 3000)
+
+line_frame = state.Value("line_frame", "line", "i8", 0)
+line_frame_time = state.Value("line_frame_time", "line", "f8", -1)
+line_angle = state.Value("line_angle", "line", "i8", 0)
+line_angle_y = state.Value("line_angle_y", "line", "i8", -1)
+line_detected = state.Value("line_detected", "line", "?", False)
+line_crop = state.Value("line_crop", "line", "f8", .6)
+line_similarity = state.Value("line_similarity", "line", "f8", 0.)
+gap_angle = state.Value("gap_angle", "line", "f8", 0.)
+gap_center_x = state.Value("gap_center_x", "line", "i8", -180)
+gap_center_y = state.Value("gap_center_y", "line", "f8", -1)
+silver_angle = state.Value("silver_angle", "line", "f8", -181)
+line_size = state.Value("line_size", "line", "f8", 0.)
+ramp_ahead = state.Value("ramp_ahead", "line", "?", False)
+red_detected = state.Value("red_detected", "line", "?", False)
+turn_dir = state.Value("turn_dir", "line", "U16", "straight")  # "straight"; "left"; "right"; "turn_around"
+black_average = state.Value("black_average", "line", "f8", 0.)
+
+zone_frame_time = state.Value("zone_frame_time", "zone", "f8", -1)  # capture time of the frame the zone values are from
+ball_distance = state.Value("ball_distance", "zone", "i8", 0)
+ball_type = state.Value("ball_type", "zone", "U16", "none")  # "none"; "black ball"; "silver ball"
+ball_width = state.Value("ball_width", "zone", "i8", -1)
+ball_id = state.Value("ball_id", "zone", "i8", -1)  # track id of the target ball, stays the same while it is followed
+zone_similarity = state.Value("zone_similarity", "zone", "f8", 0.)
+zone_similarity_average = state.Value("zone_similarity_average", "system", "f8", 0.)
+zone_found_black = state.Value("zone_found_black", "line", "?", False)
+zone_found_green = state.Value("zone_found_green", "line", "?", False)
+zone_found_red = state.Value("zone_found_red", "line", "?", False)
+exit_angle = state.Value("exit_angle", "line", "f8", -181.)
+# Not committed as a frame like "zone", control resets corner_distance itself
+corner_distance = state.Value("corner_distance", "corner", "f8", -181)
+corner_size = state.Value("corner_size", "corner", "i8", 0)
+corner_time = state.Value("corner_time", "corner", "f8", -1)  # capture time of the frame the corner values are from
+
+# Result of the silver classifier for the line frame captured at silver_time
+silver_value = state.Value("silver_value", "silver", "f8", -1.)
+silver_time = state.Value("silver_time", "silver", "f8", -1)
+
+picked_up_alive_count = state.Value("picked_up_alive_count", "system", "i8", 0)
+picked_up_dead_count = state.Value("picked_up_dead_count", "system", "i8", 0)
+
+switch = state.Value("switch", "system", "?", False)
+program_start_time = state.Value("program_start_time", "system", "f8", -1)
+run_start_time = state.Value("run_start_time", "system", "f8", -1)
+zone_start_time = state.Value("zone_start_time", "system", "f8", -1)
+
+capture_image = state.Value("capture_image", "system", "?", False)
+calibrate_color_status = state.Value("calibrate_color_status", "system", "U16", "none")  # "none"; "calibrate"; "check"
+calibration_color = state.Value("calibration_color", "system", "U8", "z-g")  # "z-g"; "z-r"; "l-gz"; "l-rz"; "l-bz; "l-bn"; "l-bv"; "l-bvl"; "l-bd"; "l-gl"; "l-rl"
+iterations_control = state.Value("iterations_control", "system", "i8", -1)
+iterations_serial = state.Value("iterations_serial", "system", "i8", -1)
+serial_channels = ["S1", "S2", "S3", "S4", "S5", "S6", "S7", "G1", "G2"]
+serial_received = {channel: state.Value(f"serial_received_{channel}", "serial", "i8", -1) for channel in serial_channels}
+serial_rate = {channel: state.Value(f"serial_rate_{channel}", "serial", "i8", -1) for channel in serial_channels}
+serial_dropped = {channel: state.Value(f"serial_dropped_{channel}", "serial", "i8", 0) for channel in serial_channels}
+serial_late = {channel: state.Value(f"serial_late_{channel}", "serial", "i8", 0) for channel in serial_channels}
+sensor1_disconnected = state.Value("sensor1_disconnected", "system", "?", False)  # reset by control with the offsets
+sensor2_disconnected = state.Value("sensor2_disconnected", "system", "?", False)
+
+objective = state.Value("objective", "system", "U16", "follow_line")  # "follow_line"; "zone"; "debug"
+line_status = state.Value("line_status", "system", "U24", "line_detected")  # "line_detected"; "gap_detected"; "gap_avoid"; "obstacle_detected"; "obstacle_avoid"; "obstacle_orientate"; "check_silver"; "position_entry"; "position_entry_1"; "position_entry_2"; "stop"
+zone_status = state.Value("zone_status", "system", "U16", "begin")  # "begin"; "find_balls"; "pickup_ball"; "deposit_red"; "deposit_green"; "exit"
+
+status = state.Value("status", "system", "U160", "Stopped")
+
+state.allocate()
+
+# Finished camera images for the GUI
+cam_1_frames = FrameRing("shm_cam_1", (252, 448, 3), prefix=shm_prefix)
+cam_2_frames = FrameRing("shm_cam_2", (264, 640, 3), prefix=shm_prefix)
+cam_1_frames.allocate()
+cam_2_frames.allocate()
+
+# Mailbox for the silver classifier, line_cam posts its newest frame and the classifier always takes the newest one
+silver_frames = FrameRing("shm_silver", (252, 448, 4), prefix=shm_prefix)
+silver_frames.allocate()
+
+# Per stage times of line_cam_loop, in pipeline order
+line_stages = ["capture", "resize", "convert", "silver_ai", "in_range", "ssim", "morphology", "contours", "green", "correct_line", "angle", "zone", "output", "shm_copy"]
+line_profile = StageProfile("shm_line_profile", line_stages, prefix=shm_prefix)
+line_profile.allocate()
+
+imu_fusion = ImuFusion(config_manager.read_variable('imu', 'accel_weight'), config_manager.read_variable('imu', 'accel_signs'))
+
+
+def snapshot():
+    return state.snapshot()
+
+
+def average_rotation(sample_time):
+    # Called inside the transaction of the IMU sample, which has to include "pose"
     if (time.perf_counter() - program_start_time.value) > 7 and not program_start_time.value == -1:
         if not sensor1_disconnected.value:
             sensor1_disconnected.value = sensor_x_1.value == 0 and sensor_y_1.value == 0 and sensor_z_1.value == 0 and sensor_ax_1.value == 0 and sensor_ay_1.value == 0
@@ -110,63 +160,40 @@ def average_rotation():
             if sensor2_disconnected.value:
                 print("Sensor 2 disconnected")
 
-    gyro_x_1 = (sensor_x_1.value + x_offset_1.value) % 360
-    gyro_x_2 = (sensor_x_2.value + x_offset_2.value) % 360
-
-    if abs(gyro_x_1 - gyro_x_2) > 180:
-        if gyro_x_1 < gyro_x_2:
-            gyro_x_1 += 360
-        else:
-            gyro_x_2 += 360
-
-    if not sensor_x_1.value == 361 and not sensor_x_2.value == 361 and not sensor1_disconnected.value and not sensor2_disconnected.value:
-        sensor_x.value = round(((gyro_x_1 + gyro_x_2) / 2) % 360, 2)
-    elif sensor_x_1.value == 361 or sensor1_disconnected.value:
-        sensor_x.value = round((sensor_x_2.value + x_offset_2.value) % 360, 2)
-    elif sensor_x_2.value == 361 or sensor2_disconnected.value:
-        sensor_x.value = round((sensor_x_1.value + x_offset_1.value) % 360, 2)
-
-    if not sensor_y_1.value == 361 and not sensor_y_2.value == 361 and not sensor1_disconnected.value and not sensor2_disconnected.value:
-        sensor_y.value = -round(((sensor_y_1.value + y_offset_1.value) - (sensor_y_2.value + y_offset_2.value)) / 2, 2)
-    elif sensor_y_1.value == 361 or sensor1_disconnected.value:
-        sensor_y.value = round((sensor_y_2.value + y_offset_2.value), 2)
-    elif sensor_y_2.value == 361 or sensor2_disconnected.value:
-        sensor_y.value = -round((sensor_y_1.value + y_offset_1.value), 2)
-
-    if not sensor_z_1.value == 361 and not sensor_z_2.value == 361 and not sensor1_disconnected.value and not sensor2_disconnected.value:
-        sensor_z.value = round(((sensor_z_1.value + z_offset_1.value) - (sensor_z_2.value + z_offset_2.value)) / 2, 2)
-    elif sensor_z_1.value == 361 or sensor1_disconnected.value:
-        sensor_z.value = round((sensor_z_2.value + z_offset_2.value), 2)
-    elif sensor_z_2.value == 361 or sensor2_disconnected.value:
-        sensor_z.value = round((sensor_z_1.value + z_offset_1.value), 2)
+    raw = np.array([[sensor_x_1.value, sensor_y_1.value, sensor_z_1.value, sensor_ax_1.value, sensor_ay_1.value],
+                    [sensor_x_2.value, sensor_y_2.value, sensor_z_2.value, sensor_ax_2.value, sensor_ay_2.value]])
+    offsets = np.array([[x_offset_1.value, y_offset_1.value, z_offset_1.value],
+                        [x_offset_2.value, y_offset_2.value, z_offset_2.value]])
+    pose = imu_fusion.update(raw, offsets, (not sensor1_disconnected.value, not sensor2_disconnected.value))
+
+    if pose[0] != 361:
+        sensor_x.value = round(pose[0], 2)
+        sensor_y.value = round(pose[1], 2)
+        sensor_z.value = round(pose[2], 2)
+        pose_time.value = sample_time
 
 
 def empty_time_arr(length: int = 240):
-    return np.zeros((length, 2))
+    return TimeSeries(length)
 
 
 def fill_array(value: int, length: int = 240, fill_time: int = 0):
-    arr = np.zeros((length, 2))
-    arr[fill_time:, 0] = time.perf_counter()
-    arr[:, 1] = value
-    return arr
+    time_series = TimeSeries(length)
+    time_series.fill(value, fill_time)
+    return time_series
 
 
-def add_time_value(time_value_array, value):
-    return np.delete(np.vstack((time_value_array, [time.perf_counter(), value])), 0, axis=0)
+def add_time_value(time_series, value):
+    time_series.add(value)
+    return time_series
 
 
-def get_time_average(time_value_array, time_range):
-    time_value_array = time_value_array[np.where(time_value_array[:, 0] > time.perf_counter() - time_range)]
-    if time_value_array.size > 0:
-        return np.mean(time_value_array[:, 1])
-    else:
-        return -1
+def get_time_average(time_series, time_range):
+    return time_series.average(time_range)
 
 
-def get_max_value(time_value_array, time_range):
-    time_value_array = time_value_array[np.where(time_value_array[:, 0] > time.perf_counter() - time_range)]
-    return np.max(time_value_array[:, 1])
+def get_max_value(time_series, time_range):
+    return time_series.max(time_range)
 
 
 def calculate_x_offset(current_angle, target_angle):
@@ -0,0 +1,78 @@
+import argparse
+import csv
+import os
+from multiprocessing import Process
+
+# Own shared memory segments, so replaying on the robot leaves the running processes alone
+os.environ["ROBOT_SHM_PREFIX"] = "replay_"
+
+from Managers import FileFrameSource, SyntheticFrameSource
+from line_cam import line_cam_loop
+from mp_manager import *
+from silver_cam import silver_loop
+
+# Published line values written to the CSV for every frame
+line_outputs = ["line_detected", "line_angle", "line_angle_y", "line_size", "turn_dir", "red_detected", "gap_angle", "gap_center_x", "ramp_ahead", "black_average", "silver_value", "silver_time", "line_similarity"]
+
+
+def replay(frame_source, csv_path, silver_model_path=None):
+    stage_times = {stage: [] for stage in line_stages}
+
+    with open(csv_path, "w", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(["frame"] + [f"{stage}_us" for stage in line_stages] + line_outputs)
+
+        def write_frame(stages):
+            frame = snapshot()
+            for stage in line_stages:
+                stage_times[stage].append(stages.get(stage, 0) / 1000)
+            writer.writerow([frame.line_frame] + [round(stages.get(stage, 0) / 1000, 1) for stage in line_stages] + [getattr(frame, output) for output in line_outputs])
+
+        # The classifier runs next to the pipeline like on the robot, silver_time tells which frame it belongs to
+        silver_process = Process(target=silver_loop, args=(silver_model_path,)) if silver_model_path is not None else None
+        if silver_process is not None:
+            silver_process.start()
+
+        try:
+            line_cam_loop(frame_source, write_frame)
+        finally:
+            if silver_process is not None:
+                terminate.value = True
+                silver_process.join()
+
+    frames = len(stage_times[line_stages[0]])
+    print(f"{frames} frames -> {csv_path}")
+    if frames == 0:
+        return
+
+    total = np.sum([stage_times[stage] for stage in line_stages], axis=0)
+    for stage in line_stages:
+        times = np.array(stage_times[stage])
+        print(f"{stage:>12}: mean {np.mean(times):8.1f} us  p50 {np.percentile(times, 50):8.1f} us  p95 {np.percentile(times, 95):8.1f} us  p99 {np.percentile(times, 99):8.1f} us")
+    print(f"{'total':>12}: mean {np.mean(total):8.1f} us  p50 {np.percentile(total, 50):8.1f} us  p95 {np.percentile(total, 95):8.1f} us  p99 {np.percentile(total, 99):8.1f} us  ({1e6 / np.mean(total):.0f} fps)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the line camera pipeline headless on recorded or synthetic frames")
+    parser.add_argument("source", help="directory of PNGs, an .npy stack of frames or 'synthetic'")
+    parser.add_argument("--csv", default="replay.csv", help="per frame stage timings and outputs")
+    parser.add_argument("--frames", type=int, default=500, help="number of synthetic frames")
+    parser.add_argument("--silver-model", default=None, help="silver classifier, skipped if not given")
+    parser.add_argument("--line-status", default="line_detected")
+    args = parser.parse_args()
+
+    if args.source == "synthetic":
+        source = SyntheticFrameSource(args.frames)
+    else:
+        source = FileFrameSource(args.source)
+
+    line_status.value = args.line_status
+
+    try:
+        replay(source, args.csv, args.silver_model)
+    finally:
+        cam_1_frames.unlink()
+        cam_2_frames.unlink()
+        silver_frames.unlink()
+        line_profile.unlink()
+        state.unlink()
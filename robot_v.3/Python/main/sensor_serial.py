@@ -1,165 +1,247 @@
+import math
+import struct
+
 import serial
 
+from Managers import ChannelStats
 from mp_manager import *
 
-serial_port = serial.Serial('/dev/ttyUSB0', 115200, timeout=1, dsrdtr=True, rtscts=True)
-serial_port.reset_input_buffer()
+serial_port = None
+
+# Binary frames: sync byte, message id, little endian float32 payload, CRC8 (poly 0x07) over id + payload
+SYNC_BYTE = 0xA5
+FRAMES = {0x01: "S1", 0x02: "S2", 0x03: "S3", 0x04: "S4", 0x05: "S5", 0x06: "S6", 0x07: "S7", 0x11: "G1", 0x12: "G2"}
+
+channel_stats = ChannelStats(serial_received, serial_rate, serial_dropped, serial_late)
+
+# serial_loop blocks on the port at most this long, so it still sees terminate
+read_timeout = .05
+
+
+def crc8_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return bytes(table)
+
+
+CRC8_TABLE = crc8_table()
 
 
-def serial_loop():
+def crc8(data):
+    crc = 0
+    for byte in data:
+        crc = CRC8_TABLE[crc ^ byte]
+    return crc
+
+
+def open_port(port=None):
+    global serial_port
+
+    if port is None:
+        port = config_manager.read_variable('serial', 'port') or '/dev/ttyUSB0'
+    serial_port = serial.Serial(port, 115200, timeout=1, dsrdtr=True, rtscts=True)
+    serial_port.reset_input_buffer()
+
+
+def negotiate_protocol(timeout=3.0):
+    # The Arduino answers "BIN OK" once it switched to binary frames, an old sketch just keeps sending text
+    if not config_manager.read_variable('serial', 'binary_protocol'):
+        return False
+
+    start_time = time.perf_counter()
+    request_time = 0
+    while time.perf_counter() - start_time < timeout and not terminate.value:
+        if time.perf_counter() - request_time > .5:
+            serial_port.write(b"B")
+            request_time = time.perf_counter()
+        try:
+            if serial_port.readline().decode(errors="ignore").strip() == "BIN OK":
+                print("Serial: binary protocol")
+                return True
+        except serial.SerialException:
+            break
+
+    print("Serial: binary protocol not acknowledged, using text")
+    return False
+
+
+def distance_value(value):
+    if value != value:
+        return -2.0
+    elif value == -1:
+        return 1400.0
+    else:
+        return value
+
+
+def imu_values(values):
+    return [361.0 if value != value else round(value, 2) if index < 3 else value for index, value in enumerate(values)]
+
+
+def decode_distance_text(fields):
+    # "S1 123.00", "S1 -1" or "S1 No"
+    return [-2.0 if fields[1] == "No" else distance_value(float(fields[1]))]
+
+
+def decode_imu_text(fields):
+    # "G1 X: 1.00 Y: 2.00 Z: 3.00 AX: 4.00 AY: 5.00", every value can be "No"
+    return imu_values([math.nan if fields[index] == "No" else float(fields[index]) for index in (2, 4, 6, 8, 10)])
+
+
+def decode_distance_frame(values):
+    return [distance_value(values[0])]
+
+
+# channel: (text decoder, frame payload, frame decoder, destination)
+distance_channel = (decode_distance_text, struct.Struct("<f"), decode_distance_frame)
+imu_channel = (decode_imu_text, struct.Struct("<5f"), imu_values)
+CHANNELS = {
+    "S1": (*distance_channel, (sensor_one,)),
+    "S2": (*distance_channel, (sensor_two,)),
+    "S3": (*distance_channel, (sensor_three,)),
+    "S4": (*distance_channel, (sensor_four,)),
+    "S5": (*distance_channel, (sensor_five,)),
+    "S6": (*distance_channel, (sensor_six,)),
+    "S7": (*distance_channel, (sensor_seven,)),
+    "G1": (*imu_channel, (sensor_x_1, sensor_y_1, sensor_z_1, sensor_ax_1, sensor_ay_1)),
+    "G2": (*imu_channel, (sensor_x_2, sensor_y_2, sensor_z_2, sensor_ax_2, sensor_ay_2)),
+    }
+
+# The IMUs are only fused once both sent a new sample, or when the other one went quiet
+imu_fresh = {"G1": False, "G2": False}
+imu_last_time = {"G1": -1., "G2": -1.}
+imu_timeout = .5
+
+
+def decode_frames(buffer, now):
+    # Returns the newest decoded values per channel and the unconsumed rest of buffer
+    frames = {}
+    position = 0
+    while True:
+        position = buffer.find(SYNC_BYTE, position)
+        if position == -1:
+            return frames, bytearray()
+        if len(buffer) - position < 2:
+            return frames, buffer[position:]
+
+        channel = FRAMES.get(buffer[position + 1])
+        if channel is None:
+            position += 1
+            continue
+
+        payload, decoder = CHANNELS[channel][1:3]
+        end = position + 2 + payload.size
+        if len(buffer) <= end:
+            return frames, buffer[position:]
+        if crc8(buffer[position + 1:end]) != buffer[end]:
+            position += 1
+            continue
+
+        channel_stats.received(channel, now)
+        if channel in frames:
+            channel_stats.overwritten(channel)
+        frames[channel] = decoder(payload.unpack_from(buffer, position + 2))
+        position = end + 1
+
+
+def split_lines(buffer, now):
+    # Returns the newest complete line per channel and the unfinished last line
+    *lines, rest = buffer.split(b"\n")
+    newest = {}
+    for line in lines:
+        try:
+            line = line.decode().rstrip()
+        except UnicodeDecodeError:
+            print("UnicodeDecodeError")
+            continue
+
+        channel = line[:2]
+        channel_stats.received(channel, now)
+        if channel in newest:
+            channel_stats.overwritten(channel)
+        newest[channel] = line
+    return newest, bytearray(rest)
+
+
+def decode_line(line):
+    # Returns the channel and its decoded values, or None for lines that are no sensor data
+    fields = line.split(" ")
+    entry = CHANNELS.get(fields[0])
+    if entry is None:
+        return None
+
+    try:
+        return fields[0], entry[0](fields)
+    except (ValueError, IndexError):
+        print(f"ValueError or IndexError: {line}")
+        return None
+
+
+def publish(channel, values, now):
+    # One transaction per sample: its values, its time and the pose fused from it become visible at once
+    channel_stats.published(channel)
+
+    if channel[0] == "S":
+        state.begin("distance")
+        for sensor, value in zip(CHANNELS[channel][3], values):
+            sensor.value = value
+        distance_time.value = now
+        state.commit("distance")
+        return
+
+    imu_fresh[channel] = True
+    imu_last_time[channel] = now
+    other = "G2" if channel == "G1" else "G1"
+    fuse = imu_fresh[other] or now - imu_last_time[other] > imu_timeout
+    groups = ("imu", "pose") if fuse else ("imu",)
+
+    state.begin(*groups)
+    for sensor, value in zip(CHANNELS[channel][3], values):
+        sensor.value = value
+    imu_time.value = now
+    if fuse:
+        average_rotation(now)
+        imu_fresh["G1"] = imu_fresh["G2"] = False
+    state.commit(*groups)
+
+
+def serial_loop(port=None):
+    open_port(port)
     time.sleep(.2)
 
-    iteration_limit_time = time.perf_counter()
-    max_iterations = 60
+    binary_protocol = negotiate_protocol()
+    buffer = bytearray()
+    serial_port.timeout = read_timeout
+
     iteration_time = time.perf_counter()
     counter = 0
 
     while not terminate.value:
-        if serial_port.in_waiting > 0:
-            try:
-                line = serial_port.readline().decode().rstrip()
-            except UnicodeDecodeError or UnboundLocalError:
-                print("UnicodeDecodeError or UnboundLocalError")
-                continue
-
-            try:
-                if line.startswith("S1 "):
-                    data = line.split(" ")[1]
-                    if data == "No":
-                        sensor_one.value = -2.0
-                    elif data == "-1":
-                        sensor_one.value = 1400.0
-                    else:
-                        sensor_one.value = float(data)
-                elif line.startswith("S2 "):
-                    data = line.split(" ")[1]
-                    if data == "No":
-                        sensor_two.value = -2.0
-                    elif data == "-1":
-                        sensor_two.value = 1400.0
-                    else:
-                        sensor_two.value = float(data)
-                elif line.startswith("S3 "):
-                    data = line.split(" ")[1]
-                    if data == "No":
-                        sensor_three.value = -2.0
-                    elif data == "-1":
-                        sensor_three.value = 1400.0
-                    else:
-                        sensor_three.value = float(data)
-                elif line.startswith("S4 "):
-                    data = line.split(" ")[1]
-                    if data == "No":
-                        sensor_four.value = -2.0
-                    elif data == "-1":
-                        sensor_four.value = 1400.0
-                    else:
-                        sensor_four.value = float(data)
-                elif line.startswith("S5 "):
-                    data = line.split(" ")[1]
-                    if data == "No":
-                        sensor_five.value = -2.0
-                    elif data == "-1":
-                        sensor_five.value = 1400.0
-                    else:
-                        sensor_five.value = float(data)
-                elif line.startswith("S6 "):
-                    data = line.split(" ")[1]
-                    if data == "No":
-                        sensor_six.value = -2.0
-                    elif data == "-1":
-                        sensor_six.value = 1400.0
-                    else:
-                        sensor_six.value = float(data)
-                elif line.startswith("S7 "):
-                    data = line.split(" ")[1]
-                    if data == "No":
-                        sensor_seven.value = -2.0
-                    elif data == "-1":
-                        sensor_seven.value = 1400.0
-                    else:
-                        sensor_seven.value = float(data)
-                elif line.startswith("G1 "):
-                    data = line.split(" ")[2]
-                    if data == "No":
-                        sensor_x_1.value = 361.0
-                        print("G1: X: No data")
-                    else:
-                        sensor_x_1.value = round(float(data), 2)
-
-                    data = line.split(" ")[4]
-                    if data == "No":
-                        sensor_y_1.value = 361.0
-                        print("G1: Y: No data")
-                    else:
-                        sensor_y_1.value = round(float(data), 2)
-
-                    data = line.split(" ")[6]
-                    if data == "No":
-                        sensor_z_1.value = 361.0
-                        print("G1: Z: No data")
-                    else:
-                        sensor_z_1.value = round(float(data), 2)
-
-                    data = line.split(" ")[8]
-                    if data == "No":
-                        sensor_ax_1.value = 361.0
-                    else:
-                        sensor_ax_1.value = float(data)
-
-                    data = line.split(" ")[10]
-                    if data == "No":
-                        sensor_ay_1.value = 361.0
-                    else:
-                        sensor_ay_1.value = float(data)
-
-                    average_rotation()
-
-                elif line.startswith("G2 "):
-                    data = line.split(" ")[2]
-                    if data == "No":
-                        sensor_x_2.value = 361.0
-                        print("G2: X: No data")
-                    else:
-                        sensor_x_2.value = round(float(data), 2)
-
-                    data = line.split(" ")[4]
-                    if data == "No":
-                        sensor_y_2.value = 361.0
-                        print("G2: Y: No data")
-                    else:
-                        sensor_y_2.value = round(float(data), 2)
-
-                    data = line.split(" ")[6]
-                    if data == "No":
-                        sensor_z_2.value = 361.0
-                        print("G2: Z: No data")
-                    else:
-                        sensor_z_2.value = round(float(data), 2)
-
-                    data = line.split(" ")[8]
-                    if data == "No":
-                        sensor_ax_2.value = 361.0
-                    else:
-                        sensor_ax_2.value = float(data)
-
-                    data = line.split(" ")[10]
-                    if data == "No":
-                        sensor_ay_2.value = 361.0
-                    else:
-                        sensor_ay_2.value = float(data)
-
-                    average_rotation()
-
-            except ValueError or IndexError:
-                print("ValueError or IndexError")
-
-        if time.perf_counter() - iteration_limit_time < 1 / max_iterations:
-            time.sleep(abs(1 / max_iterations - (time.perf_counter() - iteration_limit_time)))
-        iteration_limit_time = time.perf_counter()
+        # Wakes up with the first byte of a sample instead of polling at a fixed rate
+        data = serial_port.read(1)
+        if data:
+            # Everything else that already arrived is decoded at once, only the newest sample per channel is used
+            buffer += data + serial_port.read(serial_port.in_waiting)
+            now = time.perf_counter()
+
+            if binary_protocol:
+                frames, buffer = decode_frames(buffer, now)
+                for channel, values in frames.items():
+                    publish(channel, values, now)
+            else:
+                lines, buffer = split_lines(buffer, now)
+                for line in lines.values():
+                    decoded = decode_line(line)
+                    if decoded is not None:
+                        publish(*decoded, now)
 
         counter += 1
         if time.perf_counter() - iteration_time > 1:
             iterations_serial.value = int(counter / (time.perf_counter() - iteration_time))
+            channel_stats.publish(time.perf_counter() - iteration_time)
             iteration_time = time.perf_counter()
             counter = 0
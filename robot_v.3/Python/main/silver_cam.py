@@ -0,0 +1,35 @@
+import os
+
+from Vision import SilverClassifier
+from mp_manager import *
+
+
+def silver_loop(model_path='../../Ai/models/silver_zone_entry/silver_classify_s.onnx'):
+    # line_cam posts its frames to silver_frames and never waits for the classifier
+    # The lower priority leaves the CPU to the other processes first, so the classifier runs as often as there is time left
+    os.nice(10)
+
+    # 0 = Line, 1 = Silver
+    classifier = SilverClassifier(model_path)
+
+    frame = np.empty(silver_frames.shape, silver_frames.dtype)
+    sequence = 0
+
+    while not terminate.value:
+        new_sequence, new_frame = silver_frames.read(sequence)
+        if new_frame is None:
+            time.sleep(.002)
+            continue
+
+        frame[:] = new_frame
+        frame_time = silver_frames.frame_time(new_sequence)
+        if silver_frames.overwritten(new_sequence):
+            continue
+        sequence = new_sequence
+
+        value = classifier.predict(frame)
+
+        state.begin("silver")
+        silver_value.value = value
+        silver_time.value = frame_time
+        state.commit("silver")
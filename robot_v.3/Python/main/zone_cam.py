@@ -1,13 +1,10 @@
 import os
-from multiprocessing import shared_memory
 
 import cv2
-from picamera2 import Picamera2
-from skimage.metrics import structural_similarity
-from ultralytics import YOLO
 from ultralytics.utils.plotting import colors
 
-from Managers import Timer
+from Managers import CameraFrameSource, SimilarityDetector, Timer
+from Vision import BallDetector, BallTracker
 from mp_manager import *
 
 camera_width = 640
@@ -97,15 +94,15 @@ def get_red_contours(image):
 
 
 def zone_cam_loop():
-    model = YOLO('../../Ai/models/ball_zone_s/ball_detect_s_edgetpu.tflite', task='detect')
-
     crop_percentage = 0.45
     crop_height = int(camera_height * crop_percentage)
 
-    camera = Picamera2(1)
-    camera.start()
+    detector = BallDetector('../../Ai/models/ball_zone_s/ball_detect_s_edgetpu.tflite', (camera_width, camera_height - crop_height), conf=0.3, iou=0.2)
+    ball_tracker = BallTracker(len(detector.names))
 
-    shm_cam2 = shared_memory.SharedMemory(name="shm_cam_2", create=True, size=506880)
+    # The camera delivers the frames at this rate, read() waits for the next one
+    max_frames_zone = 30
+    camera = CameraFrameSource(1, frame_rate=max_frames_zone)
 
     calibration_saved = True
 
@@ -114,19 +111,26 @@ def zone_cam_loop():
     counter = 0
     fps = 0
 
-    # fps limiter 
-    max_frames_zone = 30
-    max_frames_line = 1
-    fps_limit_time = time.perf_counter()
+    # The ball tracker predicts the balls on the frames in between
+    max_detections_zone = 15
+    detection_limit_time = time.perf_counter()
 
-    last_best_box = None
-    last_image = np.zeros((264, camera_width), dtype=np.uint8)
-    check_similarity_counter = 0
-    check_similarity_limit = 10
+    # Similarity of the grey image to the one 10 frames earlier, for the stuck detection
+    # A quarter of 640x264 (whole factors are a lot faster for INTER_AREA), at 64x33 moving frames read above the .95 of zone_stuck_detected
+    similarity_detector = SimilarityDetector(10, (160, 66))
 
     update_color_values()
     while not terminate.value:
-        raw_capture = camera.capture_array()
+        # Outside the zone the frames are only needed for the color calibration and to save an image, otherwise the
+        # camera is stopped until the zone is reached
+        if objective.value == "zone" or not calibrate_color_status.value == "none" or capture_image.value:
+            camera.resume()
+        else:
+            camera.pause()
+            time.sleep(.05)
+            continue
+
+        raw_capture, capture_time = camera.read()
         raw_capture = raw_capture[crop_height:, :]
         cv2_img = cv2.cvtColor(raw_capture, cv2.COLOR_RGBA2BGR)
 
@@ -134,121 +138,107 @@ def zone_cam_loop():
             save_image(cv2_img)
             capture_image.value = False
 
-        frame_limit = max_frames_zone if objective.value == "zone" or not calibrate_color_status.value == "none" else max_frames_line
-
-        if time.perf_counter() - fps_limit_time > 1 / frame_limit:
-            fps_limit_time = time.perf_counter()
-
-            if calibrate_color_status.value == "none":
-                if objective.value == "zone":
-                    if check_similarity_counter >= check_similarity_limit:
-                        grey_image = cv2.cvtColor(cv2_img, cv2.COLOR_BGR2GRAY)
-                        zone_similarity.value = structural_similarity(grey_image, last_image)
-                        last_image = grey_image.copy()
-                        check_similarity_counter = 0
-                    check_similarity_counter += 1
-
-                    if zone_status.value == "begin" or zone_status.value == "find_balls" or zone_status.value == "pickup_ball":
-                        results = model.predict(cv2_img, imgsz=(512, 224), conf=0.3, iou=0.2, agnostic_nms=True, workers=4, verbose=False)  # verbose=True to enable debug info
-
-                        result = results[0].numpy()
-
-                        boxes = []
-                        for box in result.boxes:
-                            x1, y1, x2, y2 = box.xyxy[0].astype(int)
-                            class_id = box.cls[0].astype(int)
-                            name = result.names[class_id]
-                            confidence = box.conf[0].astype(float)
-
-                            width = x2 - x1
-                            height = y2 - y1
-                            area = width * height
-                            distance = (x1 + width // 2) - horizontal_center
-                            boxes.append([area, distance, name, width])
-
+        if calibrate_color_status.value == "none":
+            if objective.value == "zone":
+                # Everything published for this frame becomes visible at once with state.commit("zone")
+                state.begin("zone")
+                zone_frame_time.value = capture_time
+                zone_similarity.value = similarity_detector.update(cv2.cvtColor(cv2_img, cv2.COLOR_BGR2GRAY))
+
+                if zone_status.value == "begin" or zone_status.value == "find_balls" or zone_status.value == "pickup_ball":
+                    if time.perf_counter() - detection_limit_time > 1 / max_detections_zone:
+                        detection_limit_time = time.perf_counter()
+                        detections = detector.detect(cv2_img)
+
+                        for detection in detections:
+                            x1, y1, x2, y2 = int(detection["x1"]), int(detection["y1"]), int(detection["x2"]), int(detection["y2"])
+                            class_id = int(detection["cls"])
                             color = colors(class_id, True)
                             cv2.rectangle(cv2_img, (x1, y1), (x2, y2), color, 2)
-                            cv2.putText(cv2_img, f"{name}: {confidence:.2f}", (x1, y1 - 5), cv2.FONT_HERSHEY_DUPLEX, 0.5, color, 1, cv2.LINE_AA)
+                            cv2.putText(cv2_img, f"{detector.names[class_id]}: {float(detection['conf']):.2f}", (x1, y1 - 5), cv2.FONT_HERSHEY_DUPLEX, 0.5, color, 1, cv2.LINE_AA)
 
-                        if len(boxes) > 0:
-                            best_box = max(boxes, key=lambda x: x[0])
-                            if last_best_box is not None:
-                                best_box = min(boxes, key=lambda x: abs(x[1] - last_best_box[1]))
+                        target = ball_tracker.update(detections, capture_time)
+                    else:
+                        target = ball_tracker.predict(capture_time)
 
-                            last_best_box = best_box
-                            ball_distance.value = best_box[1]
-                            ball_type.value = str.lower(str(best_box[2]))
-                            ball_width.value = best_box[3]
-                        else:
-                            last_best_box = None
-                            ball_distance.value = 0
-                            ball_type.value = "none"
-                            ball_width.value = -1
+                    if target is not None:
+                        ball_id.value = target.id
+                        ball_distance.value = int(target.x) - horizontal_center
+                        ball_type.value = str.lower(str(detector.names[target.cls]))
+                        ball_width.value = int(target.width)
 
-                    elif zone_status.value == "deposit_green":
-                        contours_green = get_green_contours(cv2_img)
-                        corner_distance.value, corner_size.value = check_contours(contours_green, cv2_img, (0, 0, 255))
+                        cv2.rectangle(cv2_img, (int(target.x - target.width / 2), int(target.y - target.height / 2)), (int(target.x + target.width / 2), int(target.y + target.height / 2)), (255, 255, 255), 1)
+                        cv2.putText(cv2_img, str(target.id), (int(target.x), int(target.y)), cv2.FONT_HERSHEY_DUPLEX, 0.5, (255, 255, 255), 1, cv2.LINE_AA)
+                    else:
+                        ball_id.value = -1
+                        ball_distance.value = 0
+                        ball_type.value = "none"
+                        ball_width.value = -1
 
-                    elif zone_status.value == "deposit_red":
-                        contours_red = get_red_contours(cv2_img)
-                        corner_distance.value, corner_size.value = check_contours(contours_red, cv2_img, (0, 255, 0))
+                elif zone_status.value == "deposit_green":
+                    contours_green = get_green_contours(cv2_img)
+                    corner_distance.value, corner_size.value = check_contours(contours_green, cv2_img, (0, 0, 255))
+                    corner_time.value = capture_time
 
+                elif zone_status.value == "deposit_red":
+                    contours_red = get_red_contours(cv2_img)
+                    corner_distance.value, corner_size.value = check_contours(contours_red, cv2_img, (0, 255, 0))
+                    corner_time.value = capture_time
 
-            elif calibrate_color_status.value == "calibrate" and (calibration_color.value == "z-r" or calibration_color.value == "z-g"):
-                color = (0, 0, 255) if calibration_color.value == "z-r" else (0, 255, 0)
+                state.commit("zone")
 
-                cv2.rectangle(cv2_img, (int(camera_width // 2 - calibration_square_size), int(((camera_height * crop_percentage) / 2) - calibration_square_size)), (int(camera_width / 2 + calibration_square_size), int(((camera_height * crop_percentage) / 2)) + calibration_square_size), color, 2)
-                calibration_saved = False
 
-            elif calibrate_color_status.value == "check" and (calibration_color.value == "z-r" or calibration_color.value == "z-g"):
-                if not calibration_saved:
-                    average_color = find_average_color(cv2.cvtColor(cv2_img, cv2.COLOR_BGR2HSV)[int(((camera_height * crop_percentage) / 2) - calibration_square_size):int(((camera_height * crop_percentage) / 2) + calibration_square_size), int(camera_width / 2 - calibration_square_size):int(camera_width / 2 + calibration_square_size)])
+        elif calibrate_color_status.value == "calibrate" and (calibration_color.value == "z-r" or calibration_color.value == "z-g"):
+            color = (0, 0, 255) if calibration_color.value == "z-r" else (0, 255, 0)
 
-                    if calibration_color.value == "z-g":
-                        c_green_min = np.clip(np.rint(np.array([average_color[0] - 25, average_color[1] - 60, average_color[2] - 60])), 0, 255)
-                        c_green_max = np.clip(np.rint(np.array([average_color[0] + 25, average_color[1] + 60, average_color[2] + 70])), 0, 255)
+            cv2.rectangle(cv2_img, (int(camera_width // 2 - calibration_square_size), int(((camera_height * crop_percentage) / 2) - calibration_square_size)), (int(camera_width / 2 + calibration_square_size), int(((camera_height * crop_percentage) / 2)) + calibration_square_size), color, 2)
+            calibration_saved = False
 
-                        config_manager.write_variable('color_values_zone', 'green_min', [int(c_green_min[0]), int(c_green_min[1]), int(c_green_min[2])])
-                        config_manager.write_variable('color_values_zone', 'green_max', [int(c_green_max[0]), int(c_green_max[1]), int(c_green_max[2])])
+        elif calibrate_color_status.value == "check" and (calibration_color.value == "z-r" or calibration_color.value == "z-g"):
+            if not calibration_saved:
+                average_color = find_average_color(cv2.cvtColor(cv2_img, cv2.COLOR_BGR2HSV)[int(((camera_height * crop_percentage) / 2) - calibration_square_size):int(((camera_height * crop_percentage) / 2) + calibration_square_size), int(camera_width / 2 - calibration_square_size):int(camera_width / 2 + calibration_square_size)])
 
-                        update_color_values()
+                if calibration_color.value == "z-g":
+                    c_green_min = np.clip(np.rint(np.array([average_color[0] - 25, average_color[1] - 60, average_color[2] - 60])), 0, 255)
+                    c_green_max = np.clip(np.rint(np.array([average_color[0] + 25, average_color[1] + 60, average_color[2] + 70])), 0, 255)
 
-                    elif calibration_color.value == "z-r":
-                        c_red_min = np.clip(np.rint(np.array([average_color[1] - 70, average_color[2] - 40])), 0, 255)
-                        c_red_max = np.clip(np.rint(np.array([average_color[1] + 70, average_color[2] + 150])), 0, 255)
+                    config_manager.write_variable('color_values_zone', 'green_min', [int(c_green_min[0]), int(c_green_min[1]), int(c_green_min[2])])
+                    config_manager.write_variable('color_values_zone', 'green_max', [int(c_green_max[0]), int(c_green_max[1]), int(c_green_max[2])])
 
-                        config_manager.write_variable('color_values_zone', 'red_min_1', [0, int(c_red_min[0]), int(c_red_min[1])])
-                        config_manager.write_variable('color_values_zone', 'red_max_1', [10, int(c_red_max[0]), int(c_red_max[1])])
-                        config_manager.write_variable('color_values_zone', 'red_min_2', [170, int(c_red_min[0]), int(c_red_min[1])])
-                        config_manager.write_variable('color_values_zone', 'red_max_2', [180, int(c_red_max[0]), int(c_red_max[1])])
+                    update_color_values()
 
-                        update_color_values()
+                elif calibration_color.value == "z-r":
+                    c_red_min = np.clip(np.rint(np.array([average_color[1] - 70, average_color[2] - 40])), 0, 255)
+                    c_red_max = np.clip(np.rint(np.array([average_color[1] + 70, average_color[2] + 150])), 0, 255)
 
-                    calibration_saved = True
-                    continue
+                    config_manager.write_variable('color_values_zone', 'red_min_1', [0, int(c_red_min[0]), int(c_red_min[1])])
+                    config_manager.write_variable('color_values_zone', 'red_max_1', [10, int(c_red_max[0]), int(c_red_max[1])])
+                    config_manager.write_variable('color_values_zone', 'red_min_2', [170, int(c_red_min[0]), int(c_red_min[1])])
+                    config_manager.write_variable('color_values_zone', 'red_max_2', [180, int(c_red_max[0]), int(c_red_max[1])])
 
-                if calibration_color.value == "z-g":
-                    cv2_img = cv2.inRange(cv2.cvtColor(cv2_img.copy(), cv2.COLOR_BGR2HSV), green_min, green_max)
-                    cv2_img = cv2.cvtColor(cv2_img, cv2.COLOR_GRAY2BGR)
+                    update_color_values()
 
-                elif calibration_color.value == "z-r":
-                    cv2_img = cv2.inRange(cv2.cvtColor(cv2_img, cv2.COLOR_BGR2HSV), red_min_1, red_max_1) + cv2.inRange(cv2.cvtColor(cv2_img, cv2.COLOR_BGR2HSV), red_min_2, red_max_2)
-                    cv2_img = cv2.cvtColor(cv2_img, cv2.COLOR_GRAY2BGR)
+                calibration_saved = True
+                continue
+
+            if calibration_color.value == "z-g":
+                cv2_img = cv2.inRange(cv2.cvtColor(cv2_img.copy(), cv2.COLOR_BGR2HSV), green_min, green_max)
+                cv2_img = cv2.cvtColor(cv2_img, cv2.COLOR_GRAY2BGR)
 
-            counter += 1
-            if time.perf_counter() - fps_time > 1:
-                fps = int(counter / (time.perf_counter() - fps_time))
-                fps_time = time.perf_counter()
-                counter = 0
+            elif calibration_color.value == "z-r":
+                cv2_img = cv2.inRange(cv2.cvtColor(cv2_img, cv2.COLOR_BGR2HSV), red_min_1, red_max_1) + cv2.inRange(cv2.cvtColor(cv2_img, cv2.COLOR_BGR2HSV), red_min_2, red_max_2)
+                cv2_img = cv2.cvtColor(cv2_img, cv2.COLOR_GRAY2BGR)
 
-            cv2.putText(cv2_img, str(fps), text_pos, cv2.FONT_HERSHEY_DUPLEX, .7, (0, 255, 0), 1, cv2.LINE_AA)
-            cv2.putText(cv2_img, str(zone_similarity_average.value), np.array([int(camera_width * 0.46), int(camera_height * 0.43)]), cv2.FONT_HERSHEY_DUPLEX, .7, (0, 0, 0), 1, cv2.LINE_AA)
+        counter += 1
+        if time.perf_counter() - fps_time > 1:
+            fps = int(counter / (time.perf_counter() - fps_time))
+            fps_time = time.perf_counter()
+            counter = 0
 
-            # checking the shared memory buffer size of the image
-            # print(image.size)
+        cv2.putText(cv2_img, str(fps), text_pos, cv2.FONT_HERSHEY_DUPLEX, .7, (0, 255, 0), 1, cv2.LINE_AA)
+        cv2.putText(cv2_img, str(zone_similarity_average.value), np.array([int(camera_width * 0.46), int(camera_height * 0.43)]), cv2.FONT_HERSHEY_DUPLEX, .7, (0, 0, 0), 1, cv2.LINE_AA)
 
-            buf = np.ndarray(cv2_img.shape, dtype=cv2_img.dtype, buffer=shm_cam2.buf)
-            buf[:] = cv2_img[:]
+        # checking the shared memory buffer size of the image
+        # print(image.size)
 
-    shm_cam2.close()
-    shm_cam2.unlink()
+        cam_2_frames.write(cv2_img)